@@ -17,6 +17,8 @@ import netaddr
 from neutron.common import exceptions
 from neutron.openstack.common import log as logging
 
+from quark import ip_ranges
+
 LOG = logging.getLogger(__name__)
 
 
@@ -37,7 +39,12 @@ class AllocationPools(object):
             self._alloc_pools = [
                 {"start": self._subnet_first_ip,
                  "end": self._subnet_last_ip}]
-        self._policies = policies or []
+        # NOTE: policies are kept as integer ranges in the IPv6 space
+        #       IPAddress.address uses; callers hand us either CIDRs or an
+        #       already compiled IPPolicy.get_ip_policy_ranges.
+        if not isinstance(policies, ip_ranges.IntervalSet):
+            policies = ip_ranges.IntervalSet.from_cidrs(policies or [])
+        self._policies = policies
 
     # Note(asadoughi): Copied from neutron/db/db_base_plugin_v2.py
     def _validate_allocation_pools(self):
@@ -52,7 +59,7 @@ class AllocationPools(object):
         subnet_cidr = self._subnet_cidr
 
         LOG.debug(_("Performing IP validity checks on allocation pools"))
-        ip_sets = []
+        intervals = []
         for ip_pool in ip_pools:
             try:
                 start_ip = netaddr.IPAddress(ip_pool['start'])
@@ -83,55 +90,41 @@ class AllocationPools(object):
                     pool=ip_pool,
                     subnet_cidr=subnet_cidr)
             # Valid allocation pool
-            # Create an IPSet for it for easily verifying overlaps
-            ip_sets.append(netaddr.IPSet(netaddr.IPRange(
-                ip_pool['start'],
-                ip_pool['end']).cidrs()))
+            intervals.append((start_ip.value, end_ip.value, ip_pool))
 
         LOG.debug(_("Checking for overlaps among allocation pools "
                     "and gateway ip"))
-        ip_ranges = ip_pools[:]
-
-        # Use integer cursors as an efficient way for implementing
-        # comparison and avoiding comparing the same pair twice
-        for l_cursor in xrange(len(ip_sets)):
-            for r_cursor in xrange(l_cursor + 1, len(ip_sets)):
-                if ip_sets[l_cursor] & ip_sets[r_cursor]:
-                    l_range = ip_ranges[l_cursor]
-                    r_range = ip_ranges[r_cursor]
-                    LOG.info(_("Found overlapping ranges: %(l_range)s and "
-                               "%(r_range)s"),
-                             {'l_range': l_range, 'r_range': r_range})
-                    raise exceptions.OverlappingAllocationPools(
-                        pool_1=l_range,
-                        pool_2=r_range,
-                        subnet_cidr=subnet_cidr)
+        # Sorted by start, a pool overlaps an earlier one exactly when it
+        # starts at or before the furthest end seen so far
+        intervals.sort(key=lambda interval: interval[:2])
+        furthest = None
+        for start, end, ip_pool in intervals:
+            if furthest is not None and start <= furthest[1]:
+                l_range = furthest[2]
+                r_range = ip_pool
+                LOG.info(_("Found overlapping ranges: %(l_range)s and "
+                           "%(r_range)s"),
+                         {'l_range': l_range, 'r_range': r_range})
+                raise exceptions.OverlappingAllocationPools(
+                    pool_1=l_range,
+                    pool_2=r_range,
+                    subnet_cidr=subnet_cidr)
+            if furthest is None or end > furthest[1]:
+                furthest = (start, end, ip_pool)
 
     def _build_excludes(self):
         self._validate_allocation_pools()
-        subnet_net = netaddr.IPNetwork(self._subnet_cidr)
-        version = subnet_net.version
-        cidrset = netaddr.IPSet(
-            netaddr.IPRange(
-                netaddr.IPAddress(subnet_net.first, version=version),
-                netaddr.IPAddress(subnet_net.last, version=version)).cidrs())
+        subnet_net = self._subnet_cidr.ipv6()
 
+        excludes = []
         if isinstance(self._alloc_pools, list):
-            for p in self._alloc_pools:
-                start = netaddr.IPAddress(p["start"])
-                end = netaddr.IPAddress(p["end"])
-                cidrset -= netaddr.IPSet(netaddr.IPRange(
-                    netaddr.IPAddress(start),
-                    netaddr.IPAddress(end)).cidrs())
-        elif self._alloc_pools is None:
-            # Empty list is completely unallocatable, None is fully
-            # allocatable
-            cidrset = netaddr.IPSet()
-
-        for p in self._policies:
-            cidrset.add(netaddr.IPNetwork(p))
-
-        self._exclude_cidrs = cidrset
+            pools = [(ip_ranges.ip_value(netaddr.IPAddress(p["start"])),
+                      ip_ranges.ip_value(netaddr.IPAddress(p["end"])))
+                     for p in self._alloc_pools]
+            excludes = ip_ranges.FreeRanges(subnet_net.first,
+                                            subnet_net.last, pools).ranges()
+
+        self._exclude_cidrs = self._policies.union(excludes)
 
     def _refresh_excludes(self):
         if not self._exclude_cidrs:
@@ -143,7 +136,8 @@ class AllocationPools(object):
 
     def add_policy(self, policy):
         self._exclude_cidrs = None
-        self._policies.append(policy)
+        self._policies = self._policies.union(
+            ip_ranges.IntervalSet.from_cidrs([policy]).ranges())
 
     def validate_gateway_excluded(self, gateway_ip):
         self._refresh_excludes()
@@ -157,4 +151,5 @@ class AllocationPools(object):
 
     def get_policy_cidrs(self):
         self._refresh_excludes()
-        return [str(c) for c in self._exclude_cidrs.iter_cidrs()]
+        return [str(c) for c in self._exclude_cidrs.iter_cidrs(
+            self._subnet_cidr.version)]
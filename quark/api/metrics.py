@@ -0,0 +1,39 @@
+# Copyright (c) 2014 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from neutron import wsgi
+from oslo.config import cfg
+import webob.dec
+
+from quark import metrics
+
+
+class MetricsMiddleware(wsgi.Middleware):
+    """Serves the worker's metrics at GET /metrics.
+
+    The text is in Prometheus' exposition format. Each worker keeps its
+    own metrics, so a scrape sees whichever worker answered it; push to
+    statsd to see every worker. Put it ahead of authentication only where
+    /metrics isn't reachable from outside.
+    """
+
+    @webob.dec.wsgify(RequestClass=wsgi.Request)
+    def __call__(self, req):
+        if req.method != "GET" or req.path_info.rstrip("/") != "/metrics":
+            return self.application
+        res = webob.Response()
+        res.content_type = "text/plain"
+        res.body = metrics.REGISTRY.render(cfg.CONF.QUARK.metrics_prefix)
+        return res
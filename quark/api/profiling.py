@@ -0,0 +1,44 @@
+# Copyright (c) 2014 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from neutron import wsgi
+import webob.dec
+
+from quark import profiling
+
+PROFILE_HEADER = "X-Quark-Profile"
+
+
+class ProfileMiddleware(wsgi.Middleware):
+    """Profiles the plugin calls of admin requests that send X-Quark-Profile.
+
+    A request counts as an admin's if its neutron context says so or, ahead
+    of the context being made, if keystone's auth_token middleware gave it
+    the admin role.
+    """
+
+    @webob.dec.wsgify(RequestClass=wsgi.Request)
+    def __call__(self, req):
+        if not req.headers.get(PROFILE_HEADER) or not self._is_admin(req):
+            return self.application
+        with profiling.requested():
+            return req.get_response(self.application)
+
+    def _is_admin(self, req):
+        ctx = req.environ.get("neutron.context")
+        if ctx is not None:
+            return ctx.is_admin
+        roles = req.headers.get("X-Roles", "")
+        return "admin" in [role.strip() for role in roles.split(",")]
@@ -0,0 +1,333 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Concurrent load harness for the IPAM strategies
+
+Seeds a network per strategy, with several partly used v4 subnets behind
+the default IP policy and a v6 subnet or two, then has --workers threads
+or processes create --ports ports each the way create_port does: a MAC,
+then the port's IPs. Latency, throughput, retry, deadlock and lock wait
+figures for every strategy are written to --output as JSON, so runs from
+two versions of ipam.py or db/api.py can be compared directly.
+
+    quark-ipam-benchmark --config-file /etc/neutron/neutron.conf \\
+        --strategies ANY,ANY_OPTIMISTIC --workers 16 --mode processes
+"""
+
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import netaddr
+from neutron.common import config
+from neutron import context as neutron_context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import timeutils
+from neutron.openstack.common import uuidutils
+from oslo.config import cfg
+from oslo.db import exception as db_exception
+from sqlalchemy import event
+
+from quark.benchmarks import stats
+from quark.db import api as db_api
+from quark.db import models
+from quark import exceptions as q_exc
+from quark import ipam
+from quark.plugin_modules import ip_policies
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+cli_opts = [
+    cfg.ListOpt("strategies", default=["ANY", "BOTH", "BOTH_REQUIRED"],
+                help=_("IPAM strategies to benchmark, one after another.")),
+    cfg.StrOpt("mode", default="threads",
+               help=_("Run workers as 'threads' sharing one strategy, like"
+                      " an eventlet worker, or as 'processes', like"
+                      " separate API workers.")),
+    cfg.IntOpt("workers", default=8,
+               help=_("Number of concurrent workers.")),
+    cfg.IntOpt("ports", default=50,
+               help=_("Number of ports each worker creates.")),
+    cfg.IntOpt("v4_subnets", default=4,
+               help=_("Number of v4 subnets seeded on each network.")),
+    cfg.IntOpt("v4_prefix", default=24,
+               help=_("Prefix length of the seeded v4 subnets.")),
+    cfg.IntOpt("v6_subnets", default=1,
+               help=_("Number of /64 v6 subnets seeded on each network.")),
+    cfg.FloatOpt("fill", default=0.5,
+                 help=_("Fraction of each v4 subnet allocated before the"
+                        " run starts.")),
+    cfg.FloatOpt("churn", default=0.1,
+                 help=_("Fraction of ports released again right after"
+                        " they're created, so reallocation gets exercised"
+                        " too.")),
+    cfg.IntOpt("reuse_after", default=0,
+               help=_("ipam_reuse_after used for the run, in seconds.")),
+    cfg.StrOpt("db_connection",
+               help=_("SQLAlchemy URL to run against. Defaults to the"
+                      " [database] connection, or to a file-backed sqlite"
+                      " database in a temporary directory.")),
+    cfg.StrOpt("output", default="ipam-benchmark.json",
+               help=_("File the JSON results are written to."))
+]
+
+# NOTE: Summed over every worker in the process. Process mode workers
+#       reset and report their own.
+COUNTERS = stats.Counters()
+
+_MAC_RANGE = "BE:EF:00:00:00:00/24"
+_MAC_RANGE_SIZE = 1 << 24
+
+
+def _instrument_engine(engine):
+    """Counts statements, and the time spent in ones taking row locks.
+
+    sqlite never emits FOR UPDATE, so lock waits only show up against a
+    database that has row locks.
+    """
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        conn.info["quark_benchmark_start"] = time.time()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context,
+                             executemany):
+        elapsed = time.time() - conn.info["quark_benchmark_start"]
+        COUNTERS.add("statements")
+        if "FOR UPDATE" in statement:
+            COUNTERS.add("lock_waits")
+            COUNTERS.add("lock_wait_seconds", elapsed)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+def _strategy(name):
+    """Returns a fresh instance of the named strategy that counts retries.
+
+    A new instance means strategies with per-worker caches start cold.
+    """
+    strategy = ipam.IPAM_REGISTRY.get_strategy(name).__class__()
+    allocate = strategy._allocate_ips_from_subnets
+
+    def _allocate_ips_from_subnets(*args, **kwargs):
+        try:
+            return allocate(*args, **kwargs)
+        except q_exc.IPAddressRetryableFailure:
+            COUNTERS.add("retries")
+            raise
+
+    strategy._allocate_ips_from_subnets = _allocate_ips_from_subnets
+    return strategy
+
+
+def _admin_context():
+    return neutron_context.Context("quark-benchmark", "quark-benchmark",
+                                   is_admin=True)
+
+
+def seed_mac_range(context):
+    """Makes sure there is a MAC address range to allocate from."""
+    with context.session.begin():
+        if db_api.mac_address_range_find(context, cidr=_MAC_RANGE,
+                                         scope=db_api.ONE):
+            return
+        first = netaddr.EUI(_MAC_RANGE.split("/")[0]).value
+        db_api.mac_address_range_create(
+            context, cidr=_MAC_RANGE, first_address=first,
+            last_address=first + _MAC_RANGE_SIZE,
+            next_auto_assign_mac=first)
+
+
+def _seed_subnet(context, network, cidr):
+    subnet = db_api.subnet_create(context, network=network, cidr=str(cidr),
+                                  do_not_use=False)
+    policy_cidrs = []
+    ip_policies.ensure_default_policy(policy_cidrs, [subnet])
+    subnet["ip_policy"] = db_api.ip_policy_create(context,
+                                                  exclude=policy_cidrs)
+    if cidr.version == 6:
+        return subnet
+
+    # NOTE: start out part way through the subnet, the way a network
+    #       that's been in service for a while would be.
+    fill = int((cidr.size - 2) * CONF.fill)
+    for value in xrange(cidr.first + 1, cidr.first + 1 + fill):
+        db_api.ip_address_create(context, address=netaddr.IPAddress(value),
+                                 subnet_id=subnet["id"],
+                                 network_id=network["id"], version=4)
+    cursor = netaddr.IPAddress(cidr.first + 1 + fill).ipv6().value
+    db_api.subnet_update(context, subnet, next_auto_assign_ip=cursor)
+    return subnet
+
+
+def seed_network(context, strategy_name):
+    """Creates a network using strategy_name, returning its id."""
+    v4_cidrs = netaddr.IPNetwork("10.0.0.0/8").subnet(CONF.v4_prefix)
+    v6_cidrs = netaddr.IPNetwork("fd00::/48").subnet(64)
+    with context.session.begin():
+        network = db_api.network_create(
+            context, name="benchmark-%s" % strategy_name,
+            tenant_id=context.tenant_id, ipam_strategy=strategy_name)
+        for i in xrange(CONF.v4_subnets):
+            _seed_subnet(context, network, v4_cidrs.next())
+        for i in xrange(CONF.v6_subnets):
+            _seed_subnet(context, network, v6_cidrs.next())
+    return network["id"]
+
+
+def run_ports(strategy, net_id, ports, context=None):
+    """Creates ports' MACs and IPs, returning each port's latency.
+
+    Failures are counted rather than raised, so one bad port doesn't end
+    the whole run.
+    """
+    context = context or _admin_context()
+    churn = random.Random()
+    latencies = []
+    for i in xrange(ports):
+        port_id = uuidutils.generate_uuid()
+        addresses = []
+        start = time.time()
+        try:
+            mac = strategy.allocate_mac_address(context, net_id, port_id,
+                                                CONF.reuse_after)
+            strategy.allocate_ip_address(context, addresses, net_id,
+                                         port_id, CONF.reuse_after,
+                                         mac_address=mac)
+        except db_exception.DBDeadlock:
+            COUNTERS.add("deadlocks")
+            continue
+        except Exception:
+            LOG.exception("Port %s failed" % port_id)
+            COUNTERS.add("errors")
+            continue
+        latencies.append(time.time() - start)
+
+        if churn.random() < CONF.churn:
+            with context.session.begin():
+                for address in addresses:
+                    strategy.deallocate_ip_address(context, address)
+                strategy.deallocate_mac_address(context, mac["address"])
+    return latencies
+
+
+def run_threads(strategy_name, net_id):
+    strategy = _strategy(strategy_name)
+    results = []
+
+    def worker():
+        results.extend(run_ports(strategy, net_id, CONF.ports))
+
+    threads = [threading.Thread(target=worker)
+               for i in xrange(CONF.workers)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    ipam.MAC_BLOCKS.release()
+    return results, elapsed, COUNTERS.snapshot()
+
+
+def _process_worker(strategy_name, net_id, queue):
+    # NOTE: pooled connections can't be shared with the parent
+    neutron_db_api.get_engine().dispose()
+    COUNTERS.reset()
+    latencies = []
+    try:
+        latencies = run_ports(_strategy(strategy_name), net_id, CONF.ports)
+        ipam.MAC_BLOCKS.release()
+    finally:
+        queue.put((latencies, COUNTERS.snapshot()))
+
+
+def run_processes(strategy_name, net_id):
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_process_worker,
+                                         args=(strategy_name, net_id, queue))
+                 for i in xrange(CONF.workers)]
+    start = time.time()
+    for process in processes:
+        process.start()
+    results = [queue.get() for process in processes]
+    elapsed = time.time() - start
+    for process in processes:
+        process.join()
+
+    counters = stats.Counters()
+    latencies = []
+    for worker_latencies, worker_counters in results:
+        latencies.extend(worker_latencies)
+        counters.update(worker_counters)
+    return latencies, elapsed, counters.snapshot()
+
+
+def _connection():
+    connection = CONF.db_connection or CONF.database.connection
+    if not connection or connection == "sqlite://":
+        # NOTE: an in-memory database can't be shared between workers
+        connection = "sqlite:///%s" % os.path.join(tempfile.mkdtemp(),
+                                                   "quark-benchmark.sqlite")
+    return connection
+
+
+def main():
+    CONF.register_cli_opts(cli_opts)
+    config.init(sys.argv[1:])
+    runners = dict(threads=run_threads, processes=run_processes)
+    if CONF.mode not in runners:
+        sys.exit(_("ERROR: --mode must be one of %s") % ", ".join(runners))
+    for name in CONF.strategies:
+        if not ipam.IPAM_REGISTRY.is_valid_strategy(name):
+            sys.exit(_("ERROR: Unknown IPAM strategy %s") % name)
+
+    CONF.set_override("connection", _connection(), "database")
+    neutron_db_api.configure_db()
+    neutron_db_api.register_models(base=models.BASEV2)
+    _instrument_engine(neutron_db_api.get_engine())
+
+    context = _admin_context()
+    seed_mac_range(context)
+
+    results = dict(started_at=timeutils.isotime(), strategies={},
+                   options=dict((opt.dest, CONF[opt.dest])
+                                for opt in cli_opts))
+    for name in CONF.strategies:
+        net_id = seed_network(context, name)
+        COUNTERS.reset()
+        latencies, elapsed, counters = runners[CONF.mode](name, net_id)
+        summary = stats.summarize(latencies, elapsed, counters)
+        results["strategies"][name] = summary
+        print("%-16s %8.1f ports/s  p50 %8.2fms  p99 %8.2fms  retries %d" %
+              (name, summary["throughput"] or 0,
+               summary["latency_ms"]["p50"] or 0,
+               summary["latency_ms"]["p99"] or 0,
+               summary.get("retries", 0)))
+
+    with open(CONF.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Counters and summaries shared by the benchmarks
+"""
+
+import collections
+import math
+import threading
+
+
+class Counters(object):
+    """Thread safe named counters, summed across workers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = collections.defaultdict(int)
+
+    def add(self, name, amount=1):
+        with self._lock:
+            self._values[name] += amount
+
+    def update(self, values):
+        with self._lock:
+            for name, amount in values.iteritems():
+                self._values[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+def summarize(latencies, elapsed, counters=None):
+    """Summarizes one run: per-operation latencies in seconds, wall time."""
+    summary = dict(operations=len(latencies), seconds=elapsed,
+                   throughput=len(latencies) / elapsed if elapsed else None)
+    summary["latency_ms"] = dict(
+        (name, value * 1000 if value is not None else None)
+        for name, value in (("p50", percentile(latencies, 50)),
+                            ("p99", percentile(latencies, 99)),
+                            ("max", max(latencies) if latencies else None)))
+    summary.update(counters or {})
+    return summary
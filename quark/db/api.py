@@ -20,17 +20,30 @@ import netaddr
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import timeutils
 from neutron.openstack.common import uuidutils
+from oslo.config import cfg
 from sqlalchemy import event
 from sqlalchemy import func as sql_func
-from sqlalchemy import and_, asc, orm, or_, not_
+from sqlalchemy import and_, asc, orm, or_, not_, select
 
 from quark.db import models
+from quark import exceptions as q_exc
 from quark import network_strategy
 
 
+CONF = cfg.CONF
 STRATEGY = network_strategy.STRATEGY
 LOG = logging.getLogger(__name__)
 
+quark_opts = [
+    cfg.IntOpt("db_page_size",
+               default=500,
+               help=_("Rows read per query when a listing walks everything"
+                      " that matches, so only that many models are held"
+                      " at once."))
+]
+
+CONF.register_opts(quark_opts, "QUARK")
+
 ONE = "one"
 ALL = "all"
 
@@ -50,6 +63,62 @@ for _name, klass in inspect.getmembers(models, inspect.isclass):
         event.listen(klass, "init", _perhaps_generate_id)
 
 
+def _is_allocated(deallocated):
+    return deallocated is not None and not deallocated
+
+
+def _update_allocation_counts(connection, table, row_id, generated,
+                              allocated):
+    if not row_id or not (generated or allocated):
+        return
+    connection.execute(table.update().where(table.c.id == row_id).values(
+        generated_count=table.c.generated_count + generated,
+        allocated_count=table.c.allocated_count + allocated))
+
+
+def _listen_allocation_counts(model, parent_model, parent_key, flag):
+    """Keeps parent_model's allocated/generated counts in line with model.
+
+    The counters are adjusted with relative UPDATEs in the same flush that
+    writes the child row, so they can't drift under concurrent writers.
+    """
+    table = parent_model.__table__
+
+    def after_insert(mapper, connection, target):
+        _update_allocation_counts(
+            connection, table, getattr(target, parent_key), 1,
+            int(_is_allocated(getattr(target, flag))))
+
+    def after_update(mapper, connection, target):
+        history = orm.attributes.get_history(target, flag)
+        if not history.has_changes():
+            return
+        now = _is_allocated(getattr(target, flag))
+        if history.deleted:
+            was = _is_allocated(history.deleted[0])
+        else:
+            was = not now
+        _update_allocation_counts(connection, table,
+                                  getattr(target, parent_key), 0,
+                                  int(now) - int(was))
+
+    def after_delete(mapper, connection, target):
+        history = orm.attributes.get_history(target, flag)
+        committed = (history.deleted or history.unchanged or [None])[0]
+        _update_allocation_counts(
+            connection, table, getattr(target, parent_key), -1,
+            -int(_is_allocated(committed)))
+
+    event.listen(model, "after_insert", after_insert)
+    event.listen(model, "after_update", after_update)
+    event.listen(model, "after_delete", after_delete)
+
+_listen_allocation_counts(models.IPAddress, models.Subnet, "subnet_id",
+                          "_deallocated")
+_listen_allocation_counts(models.MacAddress, models.MacAddressRange,
+                          "mac_address_range_id", "deallocated")
+
+
 def _listify(filters):
     for key in ["name", "network_id", "id", "device_id", "tenant_id",
                 "subnet_id", "mac_address", "shared", "version", "segment_id",
@@ -170,10 +239,177 @@ def scoped(f):
     return wrapped
 
 
-@scoped
-def port_find(context, fields=None, **filters):
-    query = context.session.query(models.Port).options(
-        orm.joinedload(models.Port.ip_addresses))
+# NOTE: where cached finders keep their results, in the session's info so
+#       they go away with the session they were read in
+_FIND_CACHE = "quark_find_cache"
+
+
+def _cache_key(context, name, args, kwargs):
+    filters = dict(kwargs)
+    _listify(filters)
+    # NOTE: an elevated context shares the session, but _model_query only
+    #       limits non-admin finds to the context's tenant
+    key = (name, context.is_admin, context.tenant_id, args, tuple(sorted(
+        (k, tuple(v) if isinstance(v, list) else v)
+        for k, v in filters.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _session_clean(session):
+    return not (session.new or session.dirty or session.deleted)
+
+
+def cached(*depends):
+    """Remembers a scoped finder's results for the rest of the session.
+
+    Results are keyed on the finder, the context's tenant and admin flag
+    and the normalized filters, and only kept for scope=ONE or scope=ALL
+    lookups that neither lock nor page. A remembered result is handed back
+    only while the session has nothing pending, and is forgotten when the
+    session flushes or rolls back, or when a helper marked invalidates()
+    with one of depends is called.
+    """
+    depends = frozenset(depends)
+
+    def decorator(f):
+        def wrapped(context, *args, **kwargs):
+            if (kwargs.get("scope") not in [ALL, ONE] or
+                    kwargs.get("lock_mode") or kwargs.get("limit") or
+                    kwargs.get("marker")):
+                return f(context, *args, **kwargs)
+            key = _cache_key(context, f.__name__, args, kwargs)
+            if key is None:
+                return f(context, *args, **kwargs)
+
+            session = context.session
+            entry = session.info.get(_FIND_CACHE, {}).get(key)
+            if entry and _session_clean(session):
+                result = entry[1]
+            else:
+                result = f(context, *args, **kwargs)
+                # NOTE: looked up again, as an autoflush in f drops the lot
+                session.info.setdefault(_FIND_CACHE, {})[key] = (depends,
+                                                                 result)
+            if isinstance(result, list):
+                return list(result)
+            return result
+        return wrapped
+    return decorator
+
+
+def invalidates(*changed):
+    """Forgets cached finder results that depend on any of changed.
+
+    Covers the writes a flush wouldn't, like objects still pending in the
+    session and statements run straight against the tables.
+    """
+    changed = frozenset(changed)
+
+    def decorator(f):
+        def wrapped(context, *args, **kwargs):
+            cache = context.session.info.get(_FIND_CACHE)
+            if cache:
+                for key, (depends, result) in cache.items():
+                    if depends & changed:
+                        del cache[key]
+            return f(context, *args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def find_cache_clear(context):
+    """Forgets every cached finder result read in context's session."""
+    if context._session is not None:
+        context._session.info.pop(_FIND_CACHE, None)
+
+
+def _clear_find_cache(session, *args):
+    session.info.pop(_FIND_CACHE, None)
+
+event.listen(orm.Session, "after_flush", _clear_find_cache)
+event.listen(orm.Session, "after_rollback", _clear_find_cache)
+
+
+def _paginate(query, model, limit=None, marker=None, sorts=None,
+              page_reverse=False):
+    """Orders query by sorts and keeps to the page that follows marker.
+
+    sorts are Neutron's (key, ascending) pairs, created_at by default, and
+    id is always added as the last key so the order is total. The page is
+    found with a keyset predicate against the marker row's values rather
+    than an OFFSET, so every page costs the same however deep it is.
+    """
+    sort_keys = list(sorts or [("created_at", True)])
+    if "id" not in [key for key, ascending in sort_keys]:
+        sort_keys.append(("id", True))
+
+    columns = []
+    for key, ascending in sort_keys:
+        attr = getattr(model, key, None)
+        if not isinstance(getattr(attr, "property", None),
+                          orm.ColumnProperty):
+            raise q_exc.InvalidSortKey(resource=model.__tablename__,
+                                       key=key)
+        columns.append((attr.property.columns[0], ascending != page_reverse))
+    query = query.order_by(*[column.asc() if ascending else column.desc()
+                             for column, ascending in columns])
+
+    if marker:
+        # NOTE: aliased, or the subqueries would correlate to the outer
+        #       query's table instead of reading the marker row
+        marker_table = model.__table__.alias("marker")
+        values = [select([marker_table.corresponding_column(column)]).where(
+                  marker_table.c.id == marker).as_scalar()
+                  for column, ascending in columns]
+        after = []
+        for i, (column, ascending) in enumerate(columns):
+            criteria = [prior == values[j]
+                        for j, (prior, _) in enumerate(columns[:i])]
+            criteria.append(column > values[i] if ascending
+                            else column < values[i])
+            after.append(and_(*criteria))
+        query = query.filter(or_(*after))
+
+    if limit:
+        query = query.limit(limit)
+    return query
+
+
+def _find_in_batches(finder, context, marker, sorts, filters):
+    batch_size = CONF.QUARK.db_page_size
+    while True:
+        rows = finder(context, limit=batch_size, marker=marker, sorts=sorts,
+                      scope=ALL, **filters) or []
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        marker = rows[-1]["id"]
+
+
+def paginate(finder, context, limit=None, marker=None, sorts=None,
+             page_reverse=False, **filters):
+    """Pages through a finder's results the way Neutron lists resources.
+
+    With a limit, returns that page as a list, in display order even when
+    page_reverse walked backwards to find it. Without one, returns a
+    generator over everything after marker that reads db_page_size rows per
+    query as it's iterated.
+    """
+    if limit:
+        rows = finder(context, limit=limit, marker=marker, sorts=sorts,
+                      page_reverse=page_reverse, scope=ALL, **filters) or []
+        if page_reverse:
+            rows.reverse()
+        return rows
+    return _find_in_batches(finder, context, marker, sorts, filters)
+
+
+def _port_filters(context, filters):
     model_filters = _model_query(context, models.Port, filters)
     if filters.get("ip_address_id"):
         model_filters.append(models.Port.ip_addresses.any(
@@ -181,18 +417,99 @@ def port_find(context, fields=None, **filters):
 
     if filters.get("device_id"):
         model_filters.append(models.Port.device_id.in_(filters["device_id"]))
+    return model_filters
+
+
+@cached(models.Port, models.IPAddress, models.SecurityGroup)
+@scoped
+def port_find(context, fields=None, limit=None, marker=None, sorts=None,
+              page_reverse=False, **filters):
+    # NOTE: listings load each relationship with one more query for the
+    #       whole page. Joining them all in instead returns a row for every
+    #       combination of a port's addresses, groups, routes and so on.
+    if "batch_relations" in filters:
+        load = orm.subqueryload
+    else:
+        load = orm.joinedload
+    query = context.session.query(models.Port).options(
+        load(models.Port.ip_addresses))
+    model_filters = _port_filters(context, filters)
 
     if "join_security_groups" in filters:
-        query = query.options(orm.joinedload(models.Port.security_groups))
+        query = query.options(load(models.Port.security_groups))
 
     if fields and "port_subnets" in fields:
-        query = query.options(orm.joinedload("ip_addresses.subnet"))
+        query = query.options(load("ip_addresses.subnet"))
+        query = query.options(load("ip_addresses.subnet.dns_nameservers"))
+        query = query.options(load("ip_addresses.subnet.routes"))
+        query = query.options(load("ip_addresses.subnet.ip_policy"))
         query = query.options(
-            orm.joinedload("ip_addresses.subnet.dns_nameservers"))
-        query = query.options(
-            orm.joinedload("ip_addresses.subnet.routes"))
+            load("ip_addresses.subnet.ip_policy.exclude"))
+
+    return _paginate(query.filter(*model_filters), models.Port, limit,
+                     marker, sorts, page_reverse)
+
 
-    return query.filter(*model_filters).order_by(asc(models.Port.created_at))
+# NOTE: port fields that are a column of the same name. Together with
+#       PORT_RELATION_FIELDS, these are what port_find_fields can answer
+#       without building models.
+PORT_COLUMN_FIELDS = ("id", "name", "network_id", "tenant_id", "mac_address",
+                      "admin_state_up", "device_id", "device_owner", "bridge",
+                      "status")
+PORT_RELATION_FIELDS = ("fixed_ips", "security_groups")
+
+
+def port_fields_projectable(fields):
+    """Whether port_find_fields can answer for every one of fields."""
+    known = PORT_COLUMN_FIELDS + PORT_RELATION_FIELDS
+    return bool(fields) and all(field in known for field in fields)
+
+
+@scoped
+def port_find_fields(context, fields, limit=None, marker=None, sorts=None,
+                     page_reverse=False, **filters):
+    """Finds ports like port_find, reading only what fields ask for.
+
+    Returns dicts of the requested columns, and always id, instead of
+    models. When asked for, fixed_ips come back as ip_addresses and
+    security_groups as group ids, each read with one query for all of the
+    ports rather than joined in.
+    """
+    columns = [getattr(models.Port, field) for field in PORT_COLUMN_FIELDS
+               if field == "id" or field in fields]
+    query = context.session.query(*columns)
+    query = query.filter(*_port_filters(context, filters))
+    query = _paginate(query, models.Port, limit, marker, sorts, page_reverse)
+    ports = [row._asdict() for row in query]
+    if not ports:
+        return ports
+    by_id = dict((port["id"], port) for port in ports)
+
+    if "fixed_ips" in fields:
+        for port in ports:
+            port["ip_addresses"] = []
+        assoc = models.port_ip_association_table
+        query = context.session.query(assoc.c.port_id,
+                                      models.IPAddress.subnet_id,
+                                      models.IPAddress.address_readable,
+                                      models.IPAddress.version)
+        query = query.join(models.IPAddress,
+                           models.IPAddress.id == assoc.c.ip_address_id)
+        query = query.filter(assoc.c.port_id.in_(by_id.keys()))
+        for row in query.order_by(models.IPAddress.allocated_at):
+            by_id[row.port_id]["ip_addresses"].append(
+                dict(subnet_id=row.subnet_id,
+                     address_readable=row.address_readable,
+                     version=row.version))
+
+    if "security_groups" in fields:
+        for port in ports:
+            port["security_groups"] = []
+        assoc = models.port_group_association_table
+        query = context.session.query(assoc.c.port_id, assoc.c.group_id)
+        for row in query.filter(assoc.c.port_id.in_(by_id.keys())):
+            by_id[row.port_id]["security_groups"].append(row.group_id)
+    return ports
 
 
 @scoped
@@ -209,6 +526,7 @@ def port_count_all(context, **filters):
     return query.filter(*model_filters).scalar()
 
 
+@invalidates(models.Port)
 def port_create(context, **port_dict):
     port = models.Port()
     port.update(port_dict)
@@ -219,6 +537,48 @@ def port_create(context, **port_dict):
     return port
 
 
+@invalidates(models.Port)
+def port_create_bulk(context, ports):
+    """Creates ports with one multi-row INSERT per table.
+
+    Each entry accepts the same keys as port_create. The new ports are
+    returned in the order they were given.
+    """
+    port_table = models.Port.__table__
+    now = timeutils.utcnow()
+    port_rows, address_rows, group_rows = [], [], []
+    for port_dict in ports:
+        row = dict((column.name, port_dict.get(column.name))
+                   for column in port_table.columns)
+        row["id"] = row["id"] or uuidutils.generate_uuid()
+        row["tenant_id"] = context.tenant_id
+        row["created_at"] = now
+        if row["admin_state_up"] is None:
+            row["admin_state_up"] = True
+        port_rows.append(row)
+
+        for address in port_dict.get("addresses", []):
+            address_rows.append(dict(port_id=row["id"],
+                                     ip_address_id=address["id"],
+                                     enabled=True))
+        for group in port_dict.get("security_groups", []):
+            group_rows.append(dict(port_id=row["id"], group_id=group["id"]))
+
+    context.session.execute(port_table.insert().values(port_rows))
+    if address_rows:
+        context.session.execute(
+            models.port_ip_association_table.insert().values(address_rows))
+    if group_rows:
+        context.session.execute(
+            models.port_group_association_table.insert().values(group_rows))
+
+    port_ids = [port_row["id"] for port_row in port_rows]
+    new_ports = dict((port["id"], port) for port in port_find(
+        context, id=port_ids, join_security_groups=True, scope=ALL))
+    return [new_ports[port_id] for port_id in port_ids]
+
+
+@invalidates(models.Port)
 def port_update(context, port, **kwargs):
     if "addresses" in kwargs:
         port["ip_addresses"] = kwargs.pop("addresses")
@@ -227,16 +587,70 @@ def port_update(context, port, **kwargs):
     return port
 
 
+@invalidates(models.Port)
 def port_delete(context, port):
     context.session.delete(port)
 
 
+def port_job_create(context, port_id):
+    job = models.PortJob(port_id=port_id, tenant_id=context.tenant_id,
+                         state=models.PortJob.PENDING, attempts=0,
+                         run_at=timeutils.utcnow())
+    context.session.add(job)
+    return job
+
+
+def port_job_find_due(context, limit=None):
+    """Returns pending jobs whose run_at has passed, oldest first."""
+    query = context.session.query(models.PortJob)
+    query = query.filter(models.PortJob.state == models.PortJob.PENDING)
+    query = query.filter(models.PortJob.run_at <= timeutils.utcnow())
+    query = query.order_by(asc(models.PortJob.run_at))
+    return query.limit(limit).all()
+
+
+def port_job_claim(context, job, lease):
+    """Claims a due job for the next lease seconds.
+
+    The UPDATE only matches while run_at is still the one read, so of any
+    number of concurrent callers only one sees a row count of 1. A job
+    whose worker dies comes due again once the lease is up.
+    """
+    query = context.session.query(models.PortJob)
+    query = query.filter(models.PortJob.id == job["id"])
+    query = query.filter(models.PortJob.run_at == job["run_at"])
+    run_at = timeutils.utcnow() + datetime.timedelta(seconds=lease)
+    return query.update(dict(run_at=run_at,
+                             attempts=models.PortJob.attempts + 1),
+                        synchronize_session=False) == 1
+
+
+def port_job_update(context, job_id, **kwargs):
+    query = context.session.query(models.PortJob)
+    query = query.filter(models.PortJob.id == job_id)
+    return query.update(kwargs, synchronize_session=False) == 1
+
+
+def port_job_delete(context, job_id=None, port_id=None):
+    """Deletes a job, or every job of a port. Returns whether any were."""
+    if not (job_id or port_id):
+        return False
+    query = context.session.query(models.PortJob)
+    if job_id:
+        query = query.filter(models.PortJob.id == job_id)
+    if port_id:
+        query = query.filter(models.PortJob.port_id == port_id)
+    return query.delete(synchronize_session=False) > 0
+
+
+@invalidates(models.IPAddress)
 def ip_address_update(context, address, **kwargs):
     address.update(kwargs)
     context.session.add(address)
     return address
 
 
+@invalidates(models.IPAddress)
 def ip_address_create(context, **address_dict):
     ip_address = models.IPAddress()
     address = address_dict.pop("address")
@@ -250,8 +664,100 @@ def ip_address_create(context, **address_dict):
     return ip_address
 
 
+def ip_address_find_generated(context, subnet_ids):
+    """Returns (subnet_id, address) for every row in the given subnets."""
+    if not subnet_ids:
+        return []
+    query = context.session.query(models.IPAddress.subnet_id,
+                                  models.IPAddress.address)
+    return query.filter(models.IPAddress.subnet_id.in_(subnet_ids)).all()
+
+
+def ip_address_find_existing(context, subnet_id, addresses):
+    """Returns {address: (id, deallocated)} for addresses already in a subnet.
+
+    All of the candidates are probed with a single IN (...) query, and only
+    the columns needed to decide between an INSERT and an UPDATE are read.
+    """
+    if not addresses:
+        return {}
+    query = context.session.query(models.IPAddress.id,
+                                  models.IPAddress.address,
+                                  models.IPAddress._deallocated)
+    query = query.filter(models.IPAddress.subnet_id == subnet_id)
+    query = query.filter(models.IPAddress.address.in_(
+        [int(address.ipv6()) for address in addresses]))
+    return dict((row.address, (row.id, row._deallocated)) for row in query)
+
+
+@invalidates(models.IPAddress)
+def ip_address_reallocate(context, subnet_id, ip_address_id,
+                          reuse_after=None):
+    """Allocates a deallocated address again, if nobody else has.
+
+    The UPDATE only matches while the row is still deallocated, so of any
+    number of concurrent callers only one sees a row count of 1. Being a
+    query update it skips the ORM events, so the subnet's allocated count
+    is bumped here instead.
+    """
+    query = context.session.query(models.IPAddress)
+    query = query.filter(models.IPAddress.id == ip_address_id)
+    query = query.filter(models.IPAddress._deallocated == 1)
+    if reuse_after:
+        reuse = (timeutils.utcnow() -
+                 datetime.timedelta(seconds=reuse_after))
+        query = query.filter(models.IPAddress.deallocated_at <= reuse)
+    values = {"_deallocated": 0, "deallocated_at": None,
+              "used_by_tenant_id": context.tenant_id,
+              "allocated_at": timeutils.utcnow()}
+    if query.update(values, synchronize_session=False) != 1:
+        return False
+    _update_allocation_counts(context.session.connection(),
+                              models.Subnet.__table__, subnet_id, 0, 1)
+    return True
+
+
+def ip_address_reuse_enqueue(context, address):
+    """Queues a deallocated address up for reallocation."""
+    entry = models.IPAddressReuse(
+        ip_address_id=address["id"], network_id=address["network_id"],
+        subnet_id=address["subnet_id"], version=address["version"],
+        deallocated_at=address["deallocated_at"] or timeutils.utcnow())
+    return context.session.merge(entry)
+
+
+def ip_address_reuse_find(context, network_id, reuse_after, version=None,
+                          subnet_id=None, limit=None):
+    """Returns ids of queued addresses that may be reused, oldest first."""
+    reuse = timeutils.utcnow() - datetime.timedelta(seconds=reuse_after)
+    query = context.session.query(models.IPAddressReuse.ip_address_id)
+    query = query.join(models.Subnet,
+                       models.Subnet.id == models.IPAddressReuse.subnet_id)
+    query = query.filter(models.IPAddressReuse.network_id == network_id)
+    query = query.filter(models.IPAddressReuse.deallocated_at <= reuse)
+    query = query.filter(models.Subnet.do_not_use == False)  # noqa
+    if version:
+        query = query.filter(models.IPAddressReuse.version.in_(version))
+    if subnet_id:
+        query = query.filter(models.IPAddressReuse.subnet_id.in_(subnet_id))
+    query = query.order_by(asc(models.IPAddressReuse.deallocated_at))
+    return [row.ip_address_id for row in query.limit(limit)]
+
+
+def ip_address_reuse_claim(context, ip_address_id):
+    """Takes an address off the reuse queue.
+
+    The DELETE is the claim: of any number of concurrent callers only one
+    sees a row count of 1, so there is no SELECT ... FOR UPDATE to queue on.
+    """
+    query = context.session.query(models.IPAddressReuse)
+    query = query.filter(models.IPAddressReuse.ip_address_id == ip_address_id)
+    return query.delete(synchronize_session=False) == 1
+
+
 @scoped
-def ip_address_find(context, lock_mode=False, **filters):
+def ip_address_find(context, lock_mode=False, limit=None, marker=None,
+                    sorts=None, page_reverse=False, **filters):
     query = context.session.query(models.IPAddress)
     query = query.join(models.Subnet)
 
@@ -282,7 +788,11 @@ def ip_address_find(context, lock_mode=False, **filters):
     if filters.get("device_id"):
         model_filters.append(models.IPAddress.ports.any(
             models.Port.device_id.in_(filters["device_id"])))
-    return query.filter(*model_filters)
+    query = query.filter(*model_filters)
+    if limit or marker or sorts:
+        query = _paginate(query, models.IPAddress, limit, marker, sorts,
+                          page_reverse)
+    return query
 
 
 @scoped
@@ -296,11 +806,9 @@ def mac_address_find(context, lock_mode=False, **filters):
 
 def mac_address_range_find_allocation_counts(context, address=None):
     query = context.session.query(models.MacAddressRange,
-                                  sql_func.count(models.MacAddress.address).
+                                  models.MacAddressRange.generated_count.
                                   label("count")).with_lockmode("update")
-    query = query.outerjoin(models.MacAddress)
-    query = query.group_by(models.MacAddressRange.id)
-    query = query.order_by("count DESC")
+    query = query.order_by(models.MacAddressRange.generated_count.desc())
     if address:
         query = query.filter(models.MacAddressRange.last_address >= address)
         query = query.filter(models.MacAddressRange.first_address <= address)
@@ -333,6 +841,23 @@ def mac_address_range_update(context, mac_range, **kwargs):
     return mac_range
 
 
+def mac_address_range_release_block(context, range_id, first, last):
+    """Rewinds a range's cursor to first if [first, last] was its tail.
+
+    Returns the number of ranges updated, which is 0 when another worker
+    has reserved past the block since.
+    """
+    query = context.session.query(models.MacAddressRange)
+    query = query.filter(models.MacAddressRange.id == range_id)
+    query = query.filter(models.MacAddressRange.first_address <= first)
+    query = query.filter(or_(
+        models.MacAddressRange.next_auto_assign_mac == last + 1,
+        and_(models.MacAddressRange.next_auto_assign_mac == -1,
+             models.MacAddressRange.last_address == last)))
+    return query.update({"next_auto_assign_mac": first},
+                        synchronize_session=False)
+
+
 def mac_address_update(context, mac, **kwargs):
     mac.update(kwargs)
     context.session.add(mac)
@@ -352,8 +877,10 @@ def mac_address_create(context, **mac_dict):
 INVERT_DEFAULTS = 'invert_defaults'
 
 
+@cached(models.Network, models.Subnet)
 @scoped
-def network_find(context, fields=None, **filters):
+def network_find(context, fields=None, limit=None, marker=None, sorts=None,
+                 page_reverse=False, **filters):
     ids = []
     defaults = []
     if "id" in filters:
@@ -374,10 +901,13 @@ def network_find(context, fields=None, **filters):
         else:
             defaults.insert(0, INVERT_DEFAULTS)
         filters.pop("shared")
-    return _network_find(context, fields, defaults=defaults, **filters)
+    return _network_find(context, fields, defaults=defaults, limit=limit,
+                         marker=marker, sorts=sorts, page_reverse=page_reverse,
+                         **filters)
 
 
-def _network_find(context, fields, defaults=None, **filters):
+def _network_find(context, fields, defaults=None, limit=None, marker=None,
+                  sorts=None, page_reverse=False, **filters):
     query = context.session.query(models.Network)
     model_filters = _model_query(context, models.Network, filters, query)
 
@@ -398,9 +928,12 @@ def _network_find(context, fields, defaults=None, **filters):
     else:
         query = query.filter(*model_filters)
 
-    if "join_subnets" in filters:
+    if filters.get("join_subnets"):
         query = query.options(orm.joinedload(models.Network.subnets))
 
+    if limit or marker or sorts:
+        query = _paginate(query, models.Network, limit, marker, sorts,
+                          page_reverse)
     return query
 
 
@@ -408,6 +941,7 @@ def network_find_all(context, fields=None, **filters):
     return network_find(context, fields, **filters).all()
 
 
+@invalidates(models.Network)
 def network_create(context, **network):
     new_net = models.Network()
     new_net.update(network)
@@ -415,6 +949,7 @@ def network_create(context, **network):
     return new_net
 
 
+@invalidates(models.Network)
 def network_update(context, network, **kwargs):
     network.update(kwargs)
     context.session.add(network)
@@ -427,18 +962,17 @@ def network_count_all(context):
         models.Network.tenant_id == context.tenant_id).scalar()
 
 
+@invalidates(models.Network)
 def network_delete(context, network):
     context.session.delete(network)
 
 
 def subnet_find_allocation_counts(context, net_id, **filters):
     query = context.session.query(models.Subnet,
-                                  sql_func.count(models.IPAddress.address).
+                                  models.Subnet.generated_count.
                                   label("count")).with_lockmode('update')
     query = query.filter_by(do_not_use=False)
-    query = query.outerjoin(models.Subnet.generated_ips)
-    query = query.group_by(models.Subnet.id)
-    query = query.order_by("count DESC")
+    query = query.order_by(models.Subnet.generated_count.desc())
 
     query = query.filter(models.Subnet.network_id == net_id)
     if "ip_version" in filters:
@@ -451,20 +985,91 @@ def subnet_find_allocation_counts(context, net_id, **filters):
     return query
 
 
+def subnet_find_availability(context, net_id):
+    """Returns what IPAM needs to tell which of a network's subnets are full.
+
+    Only columns are read, without locking, along with each subnet's IP
+    policy size.
+    """
+    query = context.session.query(models.Subnet.id, models.Subnet.ip_version,
+                                  models.Subnet.segment_id,
+                                  models.Subnet.first_ip,
+                                  models.Subnet.last_ip,
+                                  models.Subnet.next_auto_assign_ip,
+                                  models.Subnet.generated_count,
+                                  models.IPPolicy.size)
+    query = query.outerjoin(models.IPPolicy,
+                            models.IPPolicy.id == models.Subnet.ip_policy_id)
+    query = query.filter(models.Subnet.network_id == net_id)
+    query = query.filter(models.Subnet.do_not_use == False)  # noqa
+    return query.all()
+
+
+def subnet_find_allocatable(context, net_id, **filters):
+    """Lists the usable subnets for net_id without counting or locking."""
+    query = context.session.query(models.Subnet)
+    query = query.filter_by(do_not_use=False)
+    query = query.filter(models.Subnet.network_id == net_id)
+    if "ip_version" in filters:
+        query = query.filter(models.Subnet.ip_version == filters["ip_version"])
+    if "segment_id" in filters and filters["segment_id"]:
+        query = query.filter(models.Subnet.segment_id == filters["segment_id"])
+    if "subnet_id" in filters and filters["subnet_id"]:
+        query = query.filter(models.Subnet.id.in_(filters["subnet_id"]))
+    query = query.filter(models.Subnet.next_auto_assign_ip != -1)
+    # NOTE: the free-range strategy keys its cache on each subnet's policy,
+    #       which would otherwise be two lazy loads per subnet
+    query = query.options(
+        orm.joinedload(models.Subnet.ip_policy).joinedload(
+            models.IPPolicy.exclude))
+    return query.all()
+
+
+def subnet_find_next_auto_assign_ip(context, subnet_id):
+    """Reads a subnet's allocation cursor straight from the database."""
+    query = context.session.query(models.Subnet.next_auto_assign_ip)
+    return query.filter(models.Subnet.id == subnet_id).scalar()
+
+
+@invalidates(models.Subnet)
+def subnet_advance_next_auto_assign_ip(context, subnet_id, current,
+                                       following):
+    """Moves a subnet's allocation cursor from current to following.
+
+    A compare-and-swap: the UPDATE only matches if nobody has moved the
+    cursor since it was read as current, and the row count says which
+    happened. No lock outlives the statement. A subnet already loaded in
+    the session is moved along with the row, so it isn't stale next time.
+    """
+    query = context.session.query(models.Subnet)
+    query = query.filter(models.Subnet.id == subnet_id)
+    query = query.filter(models.Subnet.next_auto_assign_ip == current)
+    return query.update({"next_auto_assign_ip": following},
+                        synchronize_session="evaluate") == 1
+
+
+@cached(models.Subnet, models.DNSNameserver, models.Route)
 @scoped
-def subnet_find(context, **filters):
+def subnet_find(context, lock_mode=False, limit=None, marker=None, sorts=None,
+                page_reverse=False, **filters):
     if "shared" in filters and True in filters["shared"]:
         return []
     query = context.session.query(models.Subnet)
+    if lock_mode:
+        query = query.with_lockmode("update")
     model_filters = _model_query(context, models.Subnet, filters)
 
-    if "join_dns" in filters:
+    if filters.get("join_dns"):
         query = query.options(orm.joinedload(models.Subnet.dns_nameservers))
 
-    if "join_routes" in filters:
+    if filters.get("join_routes"):
         query = query.options(orm.joinedload(models.Subnet.routes))
 
-    return query.filter(*model_filters)
+    query = query.filter(*model_filters)
+    if limit or marker or sorts:
+        query = _paginate(query, models.Subnet, limit, marker, sorts,
+                          page_reverse)
+    return query
 
 
 def subnet_count_all(context, **filters):
@@ -476,10 +1081,12 @@ def subnet_count_all(context, **filters):
     return query.scalar()
 
 
+@invalidates(models.Subnet)
 def subnet_delete(context, subnet):
     context.session.delete(subnet)
 
 
+@invalidates(models.Subnet)
 def subnet_create(context, **subnet_dict):
     subnet = models.Subnet()
     subnet.update(subnet_dict)
@@ -488,12 +1095,14 @@ def subnet_create(context, **subnet_dict):
     return subnet
 
 
+@invalidates(models.Subnet)
 def subnet_update(context, subnet, **kwargs):
     subnet.update(kwargs)
     context.session.add(subnet)
     return subnet
 
 
+@cached(models.Route)
 @scoped
 def route_find(context, fields=None, **filters):
     query = context.session.query(models.Route)
@@ -501,6 +1110,7 @@ def route_find(context, fields=None, **filters):
     return query.filter(*model_filters)
 
 
+@invalidates(models.Route)
 def route_create(context, **route_dict):
     new_route = models.Route()
     new_route.update(route_dict)
@@ -509,16 +1119,19 @@ def route_create(context, **route_dict):
     return new_route
 
 
+@invalidates(models.Route)
 def route_update(context, route, **kwargs):
     route.update(kwargs)
     context.session.add(route)
     return route
 
 
+@invalidates(models.Route)
 def route_delete(context, route):
     context.session.delete(route)
 
 
+@invalidates(models.DNSNameserver)
 def dns_create(context, **dns_dict):
     dns_nameserver = models.DNSNameserver()
     ip = dns_dict.pop("ip")
@@ -529,18 +1142,26 @@ def dns_create(context, **dns_dict):
     return dns_nameserver
 
 
+@invalidates(models.DNSNameserver)
 def dns_delete(context, dns):
     context.session.delete(dns)
 
 
+@cached(models.SecurityGroup, models.SecurityGroupRule)
 @scoped
-def security_group_find(context, **filters):
+def security_group_find(context, limit=None, marker=None, sorts=None,
+                        page_reverse=False, **filters):
     query = context.session.query(models.SecurityGroup).options(
         orm.joinedload(models.SecurityGroup.rules))
     model_filters = _model_query(context, models.SecurityGroup, filters)
-    return query.filter(*model_filters)
+    query = query.filter(*model_filters)
+    if limit or marker or sorts:
+        query = _paginate(query, models.SecurityGroup, limit, marker, sorts,
+                          page_reverse)
+    return query
 
 
+@invalidates(models.SecurityGroup)
 def security_group_create(context, **sec_group_dict):
     new_group = models.SecurityGroup()
     new_group.update(sec_group_dict)
@@ -549,23 +1170,32 @@ def security_group_create(context, **sec_group_dict):
     return new_group
 
 
+@invalidates(models.SecurityGroup)
 def security_group_update(context, group, **kwargs):
     group.update(kwargs)
     context.session.add(group)
     return group
 
 
+@invalidates(models.SecurityGroup)
 def security_group_delete(context, group):
     context.session.delete(group)
 
 
+@cached(models.SecurityGroupRule)
 @scoped
-def security_group_rule_find(context, **filters):
+def security_group_rule_find(context, limit=None, marker=None, sorts=None,
+                             page_reverse=False, **filters):
     query = context.session.query(models.SecurityGroupRule)
     model_filters = _model_query(context, models.SecurityGroupRule, filters)
-    return query.filter(*model_filters)
+    query = query.filter(*model_filters)
+    if limit or marker or sorts:
+        query = _paginate(query, models.SecurityGroupRule, limit, marker,
+                          sorts, page_reverse)
+    return query
 
 
+@invalidates(models.SecurityGroupRule)
 def security_group_rule_create(context, **rule_dict):
     new_rule = models.SecurityGroupRule()
     new_rule.update(rule_dict)
@@ -575,10 +1205,12 @@ def security_group_rule_create(context, **rule_dict):
     return new_rule
 
 
+@invalidates(models.SecurityGroupRule)
 def security_group_rule_delete(context, rule):
     context.session.delete(rule)
 
 
+@invalidates(models.IPPolicy)
 def ip_policy_create(context, **ip_policy_dict):
     new_policy = models.IPPolicy()
     exclude = ip_policy_dict.pop("exclude")
@@ -597,6 +1229,7 @@ def ip_policy_create(context, **ip_policy_dict):
     return new_policy
 
 
+@cached(models.IPPolicy)
 @scoped
 def ip_policy_find(context, **filters):
     query = context.session.query(models.IPPolicy)
@@ -604,6 +1237,7 @@ def ip_policy_find(context, **filters):
     return query.filter(*model_filters)
 
 
+@invalidates(models.IPPolicy)
 def ip_policy_update(context, ip_policy, **ip_policy_dict):
     exclude = ip_policy_dict.pop("exclude", [])
     if exclude:
@@ -623,5 +1257,6 @@ def ip_policy_update(context, ip_policy, **ip_policy_dict):
     return ip_policy
 
 
+@invalidates(models.IPPolicy)
 def ip_policy_delete(context, ip_policy):
     context.session.delete(ip_policy)
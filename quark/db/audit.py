@@ -0,0 +1,174 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Statement counts per plugin call, slow statements and N+1 detection
+
+With statement_audit on, every statement a plugin call runs is grouped by
+its shape, and a call running the same shape statement_repeat_threshold
+or more times is logged with its worst offenders and the db_api function
+or view that ran them. That's the usual sign of a lazy relationship being
+loaded once per row inside a loop.
+"""
+
+import collections
+import contextlib
+import re
+import sys
+import threading
+import time
+
+from neutron.openstack.common import log as logging
+from oslo.config import cfg
+from sqlalchemy.engine import Engine
+from sqlalchemy import event
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+quark_opts = [
+    cfg.BoolOpt("statement_audit",
+                default=False,
+                help=_("Count the statements each plugin call runs and log"
+                       " the calls that repeat a statement.")),
+    cfg.IntOpt("statement_repeat_threshold",
+               default=5,
+               help=_("Times one statement may run in a plugin call before"
+                      " statement_audit logs it.")),
+    cfg.FloatOpt("slow_statement_seconds",
+                 default=0,
+                 help=_("Log statements taking longer than this many"
+                        " seconds, with where they came from. 0 disables"
+                        " the slow statement log."))
+]
+
+CONF.register_opts(quark_opts, "QUARK")
+
+_local = threading.local()
+
+# NOTE: "IN (?, ?, ?)" and "IN (%(id_1)s, %(id_2)s)" are one shape
+#       whatever the number of values
+_PARAM_LIST = re.compile(r"\(\s*(\?|%s|%\(\w+\)s)(\s*,\s*(\?|%s|%\(\w+\)s))*"
+                         r"\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# NOTE: modules whose frames say where a statement came from
+_ORIGINS = ("quark.db.api", "quark.plugin_views", "quark.plugin_modules.")
+
+
+def shape(statement):
+    return _PARAM_LIST.sub("(?)", _WHITESPACE.sub(" ", statement)).strip()
+
+
+def origin():
+    """Names the db_api function, view and plugin module up the stack."""
+    found = []
+    seen = set()
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        for prefix in _ORIGINS:
+            if module.startswith(prefix) and prefix not in seen:
+                seen.add(prefix)
+                found.append("%s.%s:%d" % (module, frame.f_code.co_name,
+                                           frame.f_lineno))
+        frame = frame.f_back
+    return " <- ".join(found) or "unknown"
+
+
+class StatementLog(object):
+    """The statements run while it's active, grouped by shape."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = collections.defaultdict(int)
+        self.origins = {}
+
+    def record(self, statement, seconds):
+        key = shape(statement)
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[key] += 1
+        if key not in self.origins:
+            self.origins[key] = origin()
+
+    def repeated(self, threshold):
+        """Returns (times, shape) run threshold times or more, worst first."""
+        return sorted([(times, key) for key, times in self.shapes.items()
+                       if times >= threshold], reverse=True)
+
+    def summary(self, limit=5):
+        lines = ["%d statements in %.3fs" % (self.count, self.seconds)]
+        for times, key in self.repeated(2)[:limit]:
+            lines.append("  %dx %s (from %s)" % (times, key,
+                                                 self.origins[key]))
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def recording():
+    """Records the statements run inside the block into a StatementLog.
+
+    A block nested inside another records into the outer one.
+    """
+    outer = getattr(_local, "log", None)
+    if outer is not None:
+        yield outer
+        return
+    _local.log = StatementLog()
+    try:
+        yield _local.log
+    finally:
+        _local.log = None
+
+
+@contextlib.contextmanager
+def audited(name):
+    """Logs plugin call name if it repeats a statement too often."""
+    if not CONF.QUARK.statement_audit or getattr(_local, "log", None):
+        yield
+        return
+    with recording() as log:
+        yield
+    threshold = CONF.QUARK.statement_repeat_threshold
+    if log.repeated(threshold):
+        LOG.warning("%s repeated statements %d or more times, a likely N+1:"
+                    "\n%s" % (name, threshold, log.summary()))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if (getattr(_local, "log", None) is not None or
+            CONF.QUARK.slow_statement_seconds > 0):
+        conn.info["quark_audit_began"] = time.time()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    began = conn.info.pop("quark_audit_began", None)
+    if began is None:
+        return
+    elapsed = time.time() - began
+    log = getattr(_local, "log", None)
+    if log is not None:
+        log.record(statement, elapsed)
+    slow = CONF.QUARK.slow_statement_seconds
+    if slow > 0 and elapsed > slow:
+        LOG.warning("Slow statement (%.3fs) from %s: %s" %
+                    (elapsed, origin(), shape(statement)))
+
+event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
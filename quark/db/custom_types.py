@@ -13,11 +13,57 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import struct
+
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.dialects import sqlite
 from sqlalchemy import types
 
+_UINT64_MASK = (1 << 64) - 1
+_UINT128_MASK = (1 << 128) - 1
+
 
 class INET(types.TypeDecorator):
+    """A 128 bit unsigned integer stored as 16 big-endian bytes.
+
+    Fixed width and big-endian means the database compares and indexes
+    the bytes in numeric order, so range filters and joins on addresses
+    work in SQL. -1, the exhausted next_auto_assign_ip marker, is stored
+    as all ones, which is ff00::/8 multicast and never handed out.
+    """
+    impl = types.BINARY
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "mysql":
+            return dialect.type_descriptor(mysql.BINARY(16))
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.BYTEA())
+        if dialect.name == "sqlite":
+            return dialect.type_descriptor(types.LargeBinary())
+        return dialect.type_descriptor(types.BINARY(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        value = long(value) & _UINT128_MASK
+        return struct.pack(">QQ", value >> 64, value & _UINT64_MASK)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return value
+        high, low = struct.unpack(">QQ", str(value))
+        value = (high << 64) | low
+        if value == _UINT128_MASK:
+            return -1
+        return value
+
+
+class DecimalINET(types.TypeDecorator):
+    """The CHAR(39) decimal string INET columns were stored as.
+
+    Only the migrations that predate the binary INET use this.
+    """
     impl = types.CHAR
 
     def load_dialect_impl(self, dialect):
@@ -13,7 +13,7 @@ down_revision = None
 from alembic import op
 import sqlalchemy as sa
 
-from quark.db.custom_types import INET
+from quark.db.custom_types import DecimalINET as INET
 
 
 def upgrade():
@@ -15,7 +15,7 @@ from sqlalchemy.sql import column, select, table
 import netaddr
 import sqlalchemy as sa
 
-from quark.db.custom_types import INET
+from quark.db.custom_types import DecimalINET as INET
 
 
 def upgrade():
@@ -0,0 +1,65 @@
+"""Add quark_ip_address_reuse
+
+Revision ID: 33e9e0aa5b3c
+Revises: 707901b8e3dc
+Create Date: 2014-08-19 14:02:31.884107
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '33e9e0aa5b3c'
+down_revision = '707901b8e3dc'
+
+from alembic import op
+from sqlalchemy.sql import column, select, table
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'quark_ip_address_reuse',
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('ip_address_id', sa.String(length=36), nullable=False),
+        sa.Column('network_id', sa.String(length=36), nullable=False),
+        sa.Column('subnet_id', sa.String(length=36), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('deallocated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['ip_address_id'], ['quark_ip_addresses.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('ip_address_id'),
+        mysql_engine='InnoDB')
+    op.create_index('idx_ip_address_reuse', 'quark_ip_address_reuse',
+                    ['network_id', 'version', 'deallocated_at'],
+                    unique=False)
+
+    ip_addresses = table('quark_ip_addresses',
+                         column('id', sa.String(length=36)),
+                         column('network_id', sa.String(length=36)),
+                         column('subnet_id', sa.String(length=36)),
+                         column('version', sa.Integer()),
+                         column('deallocated_at', sa.DateTime()),
+                         column('_deallocated', sa.Boolean()))
+    reuse = table('quark_ip_address_reuse',
+                  column('ip_address_id', sa.String(length=36)),
+                  column('network_id', sa.String(length=36)),
+                  column('subnet_id', sa.String(length=36)),
+                  column('version', sa.Integer()),
+                  column('deallocated_at', sa.DateTime()))
+
+    deallocated = select([ip_addresses.c.id, ip_addresses.c.network_id,
+                          ip_addresses.c.subnet_id, ip_addresses.c.version,
+                          ip_addresses.c.deallocated_at]).where(sa.and_(
+                              ip_addresses.c._deallocated == 1,
+                              ip_addresses.c.network_id.isnot(None),
+                              ip_addresses.c.subnet_id.isnot(None),
+                              ip_addresses.c.version.isnot(None),
+                              ip_addresses.c.deallocated_at.isnot(None)))
+    op.get_bind().execute(reuse.insert().from_select(
+        ['ip_address_id', 'network_id', 'subnet_id', 'version',
+         'deallocated_at'], deallocated))
+
+
+def downgrade():
+    op.drop_index('idx_ip_address_reuse',
+                  table_name='quark_ip_address_reuse')
+    op.drop_table('quark_ip_address_reuse')
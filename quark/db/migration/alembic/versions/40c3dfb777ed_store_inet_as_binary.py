@@ -0,0 +1,102 @@
+"""Store INET columns as 16 byte binary
+
+Revision ID: 40c3dfb777ed
+Revises: 33e9e0aa5b3c
+Create Date: 2014-08-26 10:12:48.126214
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '40c3dfb777ed'
+down_revision = '33e9e0aa5b3c'
+
+from alembic import op
+from sqlalchemy.sql import bindparam, column, select, table
+import sqlalchemy as sa
+
+from quark.db.custom_types import DecimalINET
+from quark.db.custom_types import INET
+
+# NOTE: rows are converted this many at a time, so no single statement
+#       touches a whole table
+BATCH_SIZE = 5000
+
+# table -> [(column, nullable)]
+COLUMNS = [
+    ('quark_ip_addresses', [('address', False)]),
+    ('quark_dns_nameservers', [('ip', True)]),
+    ('quark_subnets', [('first_ip', True), ('last_ip', True),
+                       ('next_auto_assign_ip', True)]),
+    ('quark_ip_policy', [('size', True)]),
+    ('quark_ip_policy_cidrs', [('first_ip', True), ('last_ip', True)])]
+
+
+def _copy(table_name, columns, from_type, to_type):
+    """Copies each column into a new <column>_new column of to_type."""
+    for name, nullable in columns:
+        op.add_column(table_name, sa.Column('%s_new' % name, to_type,
+                                            nullable=True))
+
+    source = table(table_name, column('id', sa.String(length=36)),
+                   *[column(name, from_type) for name, _ in columns])
+    target = table(table_name, column('id', sa.String(length=36)),
+                   *[column('%s_new' % name, to_type) for name, _ in columns])
+    update = target.update().where(
+        target.c.id == bindparam('_id')).values(
+            dict(('%s_new' % name, bindparam('_%s' % name))
+                 for name, _ in columns))
+
+    connection = op.get_bind()
+    last_id = ''
+    while True:
+        rows = connection.execute(
+            select([source]).where(source.c.id > last_id).order_by(
+                source.c.id).limit(BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        params = []
+        for row in rows:
+            values = dict(('_%s' % name, row[name]) for name, _ in columns)
+            values['_id'] = row['id']
+            params.append(values)
+        connection.execute(update, *params)
+        last_id = rows[-1]['id']
+
+
+def _swap(table_name, columns, to_type):
+    """Replaces each column with its <column>_new copy."""
+    with op.batch_alter_table(table_name) as batch_op:
+        for name, nullable in columns:
+            batch_op.drop_column(name)
+            batch_op.alter_column('%s_new' % name, new_column_name=name,
+                                  existing_type=to_type, nullable=nullable)
+
+
+def _convert(from_type, to_type):
+    # NOTE: the unique constraint and index on address have to go before
+    #       the column does, MySQL would otherwise quietly narrow the
+    #       constraint to subnet_id alone. sqlite loses the constraint
+    #       when batch_alter_table rebuilds the table.
+    op.drop_index('ix_quark_ip_addresses_address',
+                  table_name='quark_ip_addresses')
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint('subnet_id_address', 'quark_ip_addresses',
+                           type_='unique')
+
+    for table_name, columns in COLUMNS:
+        _copy(table_name, columns, from_type, to_type)
+        _swap(table_name, columns, to_type)
+
+    with op.batch_alter_table('quark_ip_addresses') as batch_op:
+        batch_op.create_unique_constraint('subnet_id_address',
+                                          ['subnet_id', 'address'])
+    op.create_index('ix_quark_ip_addresses_address', 'quark_ip_addresses',
+                    ['address'], unique=False)
+
+
+def upgrade():
+    _convert(DecimalINET(), INET())
+
+
+def downgrade():
+    _convert(INET(), DecimalINET())
@@ -0,0 +1,62 @@
+"""Add allocated_count, generated_count to subnets and MAC address ranges
+
+Revision ID: 707901b8e3dc
+Revises: 1664300cb03a
+Create Date: 2014-08-12 10:21:44.318022
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '707901b8e3dc'
+down_revision = '1664300cb03a'
+
+from alembic import op
+from sqlalchemy.sql import column, func, select, table
+import sqlalchemy as sa
+
+
+def _backfill(parent, child, parent_key, flag):
+    count = select([func.count()]).where(child.c[parent_key] == parent.c.id)
+    allocated = count.where(child.c[flag] == 0)
+    op.get_bind().execute(parent.update().values(
+        generated_count=count.as_scalar(),
+        allocated_count=allocated.as_scalar()))
+
+
+def upgrade():
+    for table_name in ('quark_subnets', 'quark_mac_address_ranges'):
+        op.add_column(table_name,
+                      sa.Column('allocated_count', sa.Integer(),
+                                server_default='0', nullable=False))
+        op.add_column(table_name,
+                      sa.Column('generated_count', sa.Integer(),
+                                server_default='0', nullable=False))
+
+    subnets = table('quark_subnets',
+                    column('id', sa.String(length=36)),
+                    column('allocated_count', sa.Integer()),
+                    column('generated_count', sa.Integer()))
+    ip_addresses = table('quark_ip_addresses',
+                         column('subnet_id', sa.String(length=36)),
+                         column('_deallocated', sa.Boolean()))
+    mac_ranges = table('quark_mac_address_ranges',
+                       column('id', sa.String(length=36)),
+                       column('allocated_count', sa.Integer()),
+                       column('generated_count', sa.Integer()))
+    mac_addresses = table('quark_mac_addresses',
+                          column('mac_address_range_id', sa.String(length=36)),
+                          column('deallocated', sa.Boolean()))
+
+    _backfill(subnets, ip_addresses, 'subnet_id', '_deallocated')
+    _backfill(mac_ranges, mac_addresses, 'mac_address_range_id',
+              'deallocated')
+
+    op.create_index('idx_subnets_generated_count', 'quark_subnets',
+                    ['network_id', 'generated_count'], unique=False)
+
+
+def downgrade():
+    op.drop_index('idx_subnets_generated_count', table_name='quark_subnets')
+    for table_name in ('quark_subnets', 'quark_mac_address_ranges'):
+        op.drop_column(table_name, 'generated_count')
+        op.drop_column(table_name, 'allocated_count')
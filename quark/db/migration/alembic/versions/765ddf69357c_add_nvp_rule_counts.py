@@ -0,0 +1,77 @@
+"""Add rule counts to NVP security profiles and lswitch ports
+
+Revision ID: 765ddf69357c
+Revises: c159ccfdd8f4
+Create Date: 2014-09-04 15:02:31.584110
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '765ddf69357c'
+down_revision = 'c159ccfdd8f4'
+
+from alembic import op
+from sqlalchemy.sql import column, func, select, table
+import sqlalchemy as sa
+
+
+def upgrade():
+    for table_name in ('quark_nvp_driver_security_profile',
+                       'quark_nvp_driver_lswitchport'):
+        op.add_column(table_name,
+                      sa.Column('rule_count', sa.Integer(),
+                                server_default='0', nullable=False))
+    op.create_table(
+        'quark_nvp_driver_lswitchport_security_profiles',
+        sa.Column('security_profile_id', sa.String(length=36),
+                  nullable=False),
+        sa.Column('lswitchport_id', sa.String(length=36), nullable=False),
+        sa.ForeignKeyConstraint(['lswitchport_id'],
+                                ['quark_nvp_driver_lswitchport.id'], ),
+        sa.ForeignKeyConstraint(['security_profile_id'],
+                                ['quark_nvp_driver_security_profile.id'], ),
+        sa.PrimaryKeyConstraint('security_profile_id', 'lswitchport_id'),
+        mysql_engine='InnoDB')
+
+    profiles = table('quark_nvp_driver_security_profile',
+                     column('id', sa.String(length=36)),
+                     column('rule_count', sa.Integer()))
+    rules = table('quark_security_group_rule',
+                  column('group_id', sa.String(length=36)))
+    lports = table('quark_nvp_driver_lswitchport',
+                   column('id', sa.String(length=36)),
+                   column('port_id', sa.String(length=36)),
+                   column('rule_count', sa.Integer()))
+    ports = table('quark_ports',
+                  column('id', sa.String(length=36)),
+                  column('backend_key', sa.String(length=36)))
+    port_groups = table('quark_port_security_group_associations',
+                        column('port_id', sa.String(length=36)),
+                        column('group_id', sa.String(length=36)))
+    assoc = table('quark_nvp_driver_lswitchport_security_profiles',
+                  column('security_profile_id', sa.String(length=36)),
+                  column('lswitchport_id', sa.String(length=36)))
+
+    # NOTE: lswitch ports are keyed by the NVP uuid quark keeps as the
+    #       port's backend_key
+    bind = op.get_bind()
+    bind.execute(profiles.update().values(rule_count=select(
+        [func.count()]).where(rules.c.group_id == profiles.c.id).as_scalar()))
+    bind.execute(assoc.insert().from_select(
+        ['security_profile_id', 'lswitchport_id'],
+        select([profiles.c.id, lports.c.id]).where(
+            ports.c.backend_key == lports.c.port_id).where(
+            port_groups.c.port_id == ports.c.id).where(
+            port_groups.c.group_id == profiles.c.id).distinct()))
+    bind.execute(lports.update().values(rule_count=select(
+        [func.coalesce(func.sum(profiles.c.rule_count), 0)]).where(
+        assoc.c.lswitchport_id == lports.c.id).where(
+        assoc.c.security_profile_id == profiles.c.id).as_scalar()))
+
+
+def downgrade():
+    op.drop_table('quark_nvp_driver_lswitchport_security_profiles')
+    for table_name in ('quark_nvp_driver_lswitchport',
+                       'quark_nvp_driver_security_profile'):
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_column('rule_count')
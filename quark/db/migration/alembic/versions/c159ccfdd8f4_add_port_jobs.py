@@ -0,0 +1,46 @@
+"""Add quark_ports.status and quark_port_jobs
+
+Revision ID: c159ccfdd8f4
+Revises: 40c3dfb777ed
+Create Date: 2014-09-02 11:37:05.201943
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c159ccfdd8f4'
+down_revision = '40c3dfb777ed'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('quark_ports',
+                  sa.Column('status', sa.String(length=16),
+                            server_default='ACTIVE', nullable=False))
+    op.create_table(
+        'quark_port_jobs',
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('tenant_id', sa.String(length=255), nullable=True),
+        sa.Column('port_id', sa.String(length=36), nullable=False),
+        sa.Column('state', sa.String(length=16), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.String(length=255), nullable=True),
+        sa.ForeignKeyConstraint(['port_id'], ['quark_ports.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        mysql_engine='InnoDB')
+    op.create_index('idx_port_jobs_due', 'quark_port_jobs',
+                    ['state', 'run_at'], unique=False)
+    op.create_index('idx_port_jobs_port', 'quark_port_jobs', ['port_id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('idx_port_jobs_port', table_name='quark_port_jobs')
+    op.drop_index('idx_port_jobs_due', table_name='quark_port_jobs')
+    op.drop_table('quark_port_jobs')
+    with op.batch_alter_table('quark_ports') as batch_op:
+        batch_op.drop_column('status')
@@ -25,6 +25,7 @@ from sqlalchemy.ext import hybrid
 from sqlalchemy import orm
 
 from quark.db import custom_types
+from quark import ip_ranges
 # NOTE(mdietz): This is the only way to actually create the quotas table,
 #              regardless if we need it. This is how it's done upstream.
 # NOTE(jhammond): If it isn't obvious quota_driver is unused and that's ok.
@@ -152,15 +153,42 @@ class IPAddress(BASEV2, models.HasId):
     def deallocated(cls):
         return IPAddress._deallocated
 
-    def formatted(self):
-        ip = netaddr.IPAddress(self.address_readable)
-        if self.version == 4:
+    @staticmethod
+    def format_address(address_readable, version):
+        ip = netaddr.IPAddress(address_readable)
+        if version == 4:
             return str(ip.ipv4())
         return str(ip.ipv6())
 
+    def formatted(self):
+        return self.format_address(self.address_readable, self.version)
+
     deallocated_at = sa.Column(sa.DateTime(), index=True)
 
 
+class IPAddressReuse(BASEV2):
+    """Deallocated addresses waiting to be handed out again.
+
+    A row is pushed when an address is deallocated and claimed by deleting
+    it, so reallocation never scans or locks quark_ip_addresses in address
+    order.
+    """
+    __tablename__ = "quark_ip_address_reuse"
+    ip_address_id = sa.Column(sa.String(36),
+                              sa.ForeignKey("quark_ip_addresses.id",
+                                            ondelete="CASCADE"),
+                              primary_key=True)
+    network_id = sa.Column(sa.String(36), nullable=False)
+    subnet_id = sa.Column(sa.String(36), nullable=False)
+    version = sa.Column(sa.Integer(), nullable=False)
+    deallocated_at = sa.Column(sa.DateTime(), nullable=False)
+
+
+sa.Index("idx_ip_address_reuse", IPAddressReuse.__table__.c.network_id,
+         IPAddressReuse.__table__.c.version,
+         IPAddressReuse.__table__.c.deallocated_at)
+
+
 class Route(BASEV2, models.HasTenant, models.HasId, IsHazTags):
     __tablename__ = "quark_routes"
     cidr = sa.Column(sa.String(64))
@@ -240,6 +268,15 @@ class Subnet(BASEV2, models.HasId, IsHazTags):
                              sa.ForeignKey("quark_ip_policy.id"))
     # Legacy data
     do_not_use = sa.Column(sa.Boolean(), default=False)
+    # Denormalized from quark_ip_addresses, maintained by quark.db.api
+    allocated_count = sa.Column(sa.Integer(), nullable=False, default=0,
+                                server_default="0")
+    generated_count = sa.Column(sa.Integer(), nullable=False, default=0,
+                                server_default="0")
+
+
+sa.Index("idx_subnets_generated_count", Subnet.__table__.c.network_id,
+         Subnet.__table__.c.generated_count)
 
 
 port_ip_association_table = sa.Table(
@@ -304,6 +341,9 @@ class Port(BASEV2, models.HasTenant, models.HasId):
     device_id = sa.Column(sa.String(255), nullable=False, index=True)
     device_owner = sa.Column(sa.String(255))
     bridge = sa.Column(sa.String(255))
+    # NOTE: BUILD while a PortJob is still creating the backend port
+    status = sa.Column(sa.String(16), nullable=False, default="ACTIVE",
+                       server_default="ACTIVE")
 
     @declarative.declared_attr
     def ip_addresses(cls):
@@ -333,6 +373,31 @@ sa.Index("idx_ports_2", Port.__table__.c.device_owner,
 sa.Index("idx_ports_3", Port.__table__.c.tenant_id)
 
 
+class PortJob(BASEV2, models.HasId, models.HasTenant):
+    """A backend port still to be created for a port committed as BUILD.
+
+    quark.port_jobs claims a job by moving run_at past its lease, and
+    deletes it once the backend port exists. A job out of attempts is kept
+    as FAILED, with its port in ERROR.
+    """
+    __tablename__ = "quark_port_jobs"
+    PENDING = "PENDING"
+    FAILED = "FAILED"
+
+    port_id = sa.Column(sa.String(36),
+                        sa.ForeignKey("quark_ports.id", ondelete="CASCADE"),
+                        nullable=False)
+    state = sa.Column(sa.String(16), nullable=False)
+    attempts = sa.Column(sa.Integer(), nullable=False, default=0)
+    run_at = sa.Column(sa.DateTime(), nullable=False)
+    last_error = sa.Column(sa.String(255))
+
+
+sa.Index("idx_port_jobs_due", PortJob.__table__.c.state,
+         PortJob.__table__.c.run_at)
+sa.Index("idx_port_jobs_port", PortJob.__table__.c.port_id)
+
+
 class MacAddress(BASEV2, models.HasTenant):
     __tablename__ = "quark_mac_addresses"
     address = sa.Column(sa.BigInteger(), primary_key=True)
@@ -358,6 +423,17 @@ class MacAddressRange(BASEV2, models.HasId):
                                       backref="mac_address_range")
     do_not_use = sa.Column(sa.Boolean(), default=False, nullable=False,
                            server_default='0')
+    # Denormalized from quark_mac_addresses, maintained by quark.db.api
+    allocated_count = sa.Column(sa.Integer(), nullable=False, default=0,
+                                server_default="0")
+    generated_count = sa.Column(sa.Integer(), nullable=False, default=0,
+                                server_default="0")
+
+
+# NOTE: compiled policies keyed by their sorted CIDRs, so editing a
+#       policy's CIDRs just misses the cache.
+_POLICY_RANGES = {}
+_POLICY_RANGES_MAX = 4096
 
 
 class IPPolicy(BASEV2, models.HasId, models.HasTenant):
@@ -386,6 +462,33 @@ class IPPolicy(BASEV2, models.HasId, models.HasTenant):
                            for ip_policy_cidr in ip_policies]
         return netaddr.IPSet(ip_policy_cidrs)
 
+    @staticmethod
+    def get_ip_policy_ranges(subnet):
+        """Returns the subnet's excluded addresses as an IntervalSet.
+
+        Values are in the IPAddress.address space (IPv4 mapped into IPv6),
+        built from the first_ip/last_ip columns where they're populated.
+        """
+        ip_policy = subnet["ip_policy"] or {}
+        ip_policy_cidrs = ip_policy.get("exclude", [])
+        key = tuple(sorted(ippc.cidr for ippc in ip_policy_cidrs))
+        ranges = _POLICY_RANGES.get(key)
+        if ranges is not None:
+            return ranges
+
+        intervals = []
+        for ippc in ip_policy_cidrs:
+            if ippc.first_ip is None or ippc.last_ip is None:
+                net = netaddr.IPNetwork(ippc.cidr).ipv6()
+                intervals.append((net.first, net.last))
+            else:
+                intervals.append((int(ippc.first_ip), int(ippc.last_ip)))
+        ranges = ip_ranges.IntervalSet(intervals)
+        if len(_POLICY_RANGES) >= _POLICY_RANGES_MAX:
+            _POLICY_RANGES.clear()
+        _POLICY_RANGES[key] = ranges
+        return ranges
+
 
 class IPPolicyCIDR(BASEV2, models.HasId):
     __tablename__ = "quark_ip_policy_cidrs"
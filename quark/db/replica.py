@@ -0,0 +1,113 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Sessions on the read replica for read-only plugin calls
+"""
+
+import threading
+import time
+
+from neutron.openstack.common import log as logging
+from oslo.config import cfg
+from oslo.db.sqlalchemy import session as db_session
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+quark_opts = [
+    cfg.IntOpt("read_after_write_window",
+               default=0,
+               help=_("Seconds after a tenant's last write during which its"
+                      " reads stay on the primary, so the tenant sees its own"
+                      " writes whatever the replica's lag. 0 always reads"
+                      " from [database] slave_connection when it's set."))
+]
+
+CONF.register_opts(quark_opts, "QUARK")
+
+_FACADE = None
+_FACADE_LOCK = threading.Lock()
+
+
+def _facade():
+    global _FACADE
+    with _FACADE_LOCK:
+        if _FACADE is None:
+            db = CONF.database
+            _FACADE = db_session.EngineFacade(
+                db.slave_connection, autocommit=True,
+                expire_on_commit=False, idle_timeout=db.idle_timeout,
+                max_pool_size=db.max_pool_size,
+                max_overflow=db.max_overflow, pool_timeout=db.pool_timeout)
+    return _FACADE
+
+
+class RecentWriters(object):
+    """When each tenant last wrote, as seen by this worker.
+
+    Only writes made through this worker count, so a tenant whose writes
+    land on a different API worker can still read stale rows for as long
+    as the replica lags.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._writes = {}
+
+    def wrote(self, tenant_id):
+        window = CONF.QUARK.read_after_write_window
+        if window <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self._writes[tenant_id] = now
+            # NOTE: drop the tenants whose windows have passed so the map
+            #       only ever holds the recent ones
+            if len(self._writes) > 1024:
+                self._writes = dict((tenant, at) for tenant, at
+                                    in self._writes.items()
+                                    if now - at < window)
+
+    def wrote_recently(self, tenant_id):
+        window = CONF.QUARK.read_after_write_window
+        if window <= 0:
+            return False
+        with self._lock:
+            at = self._writes.get(tenant_id)
+        return at is not None and time.time() - at < window
+
+    def clear(self):
+        with self._lock:
+            self._writes.clear()
+
+
+RECENT_WRITERS = RecentWriters()
+
+
+def get_session(context):
+    """Returns a session on the read replica for context, or None.
+
+    None means the call should read from the primary: there is no replica
+    configured, context already has a session, or its tenant wrote within
+    read_after_write_window.
+    """
+    if not CONF.database.slave_connection:
+        return None
+    if context._session is not None:
+        return None
+    if RECENT_WRITERS.wrote_recently(context.tenant_id):
+        return None
+    return _facade().get_session(autocommit=True, expire_on_commit=False)
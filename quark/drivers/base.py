@@ -60,6 +60,11 @@ class BaseDriver(object):
     def delete_port(self, context, port_id, **kwargs):
         LOG.info("delete_port %s %s" % (context.tenant_id, port_id))
 
+    def delete_ports(self, context, port_ids):
+        """Deletes many ports, one delete_port at a time unless overridden."""
+        for port_id in port_ids:
+            self.delete_port(context, port_id)
+
     def diag_port(self, context, network_id, **kwargs):
         LOG.info("diag_port %s" % network_id)
         return {}
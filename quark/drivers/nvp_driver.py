@@ -17,13 +17,19 @@
 NVP client driver for Quark
 """
 
+import time
+
 import aiclib
+import eventlet
+from neutron import context as neutron_context
 from neutron.extensions import securitygroup as sg_ext
 from neutron.openstack.common import log as logging
 from oslo.config import cfg
 
 from quark.drivers import base
+from quark.drivers import nvp_pool
 from quark import exceptions
+from quark import metrics
 
 LOG = logging.getLogger(__name__)
 
@@ -50,6 +56,14 @@ nvp_opts = [
     cfg.IntOpt('backoff',
                default=0,
                help=_('Base seconds for exponential backoff')),
+    cfg.IntOpt('port_delete_concurrency',
+               default=8,
+               help=_('NVP logical ports deleted at once by delete_ports')),
+    cfg.IntOpt('security_profile_cache_ttl',
+               default=300,
+               help=_('Seconds a cached security profile is used before it'
+                      ' is reloaded in the background. 0 disables the'
+                      ' cache.')),
 ]
 
 physical_net_type_map = {
@@ -72,10 +86,93 @@ def _tag_unroll(tags):
     return dict((t['scope'], t['tag']) for t in tags)
 
 
+class SecurityProfileCache(object):
+    """Per-worker map of security group to its NVP security profile.
+
+    An entry holds the profile's uuid and how many ingress and egress rules
+    it has, which is all creating or updating a port needs, so ports whose
+    groups are cached cost no profile reads. Entries come from the
+    profiles the driver creates, updates and reads, and are dropped when
+    their group is deleted. An entry older than security_profile_cache_ttl
+    is still used, but reloaded in the background, so changes made through
+    other workers show up within that long.
+    """
+
+    def __init__(self, load):
+        # NOTE: group_id -> dict(uuid, tenant_id, ingress, egress,
+        #       expires_at), load(context, group_id, group=None) returns
+        #       the profile, given the group's model when there is one
+        self._groups = {}
+        self._uuids = {}
+        self._refreshing = set()
+        self._load = load
+
+    def clear(self):
+        self._groups.clear()
+        self._uuids.clear()
+
+    def invalidate(self, group_id):
+        entry = self._groups.pop(group_id, None)
+        if entry:
+            self._uuids.pop(entry["uuid"], None)
+
+    def add(self, tenant_id, group_id, profile):
+        """Caches profile, as NVP returns it, as that of group_id."""
+        ttl = CONF.NVP.security_profile_cache_ttl
+        entry = dict(
+            uuid=profile["uuid"], tenant_id=tenant_id,
+            ingress=len(profile.get("logical_port_ingress_rules") or []),
+            egress=len(profile.get("logical_port_egress_rules") or []),
+            expires_at=time.time() + ttl)
+        if ttl > 0:
+            self.invalidate(group_id)
+            self._groups[group_id] = entry
+            self._uuids[entry["uuid"]] = group_id
+        return entry
+
+    def get(self, context, group_id, group=None):
+        """Returns the entry for group_id, loading it if it isn't cached.
+
+        group is the security group's model, with its rules, when the
+        caller has already read it.
+        """
+        entry = self._groups.get(group_id)
+        if entry is None or entry["tenant_id"] != context.tenant_id:
+            metrics.incr("nvp.security_profiles.misses")
+            return self.add(context.tenant_id, group_id,
+                            self._load(context, group_id, group=group))
+        metrics.incr("nvp.security_profiles.hits")
+        if (entry["expires_at"] <= time.time() and
+                group_id not in self._refreshing):
+            self._refreshing.add(group_id)
+            eventlet.spawn_n(self._refresh, group_id, entry["tenant_id"])
+        return entry
+
+    def by_uuid(self, uuid):
+        """Returns the unexpired entry of the profile uuid, if any."""
+        entry = self._groups.get(self._uuids.get(uuid))
+        if entry and entry["expires_at"] > time.time():
+            return entry
+
+    def _refresh(self, group_id, tenant_id):
+        context = neutron_context.Context(None, tenant_id, is_admin=True)
+        try:
+            self.add(tenant_id, group_id, self._load(context, group_id))
+        except sg_ext.SecurityGroupNotFound:
+            self.invalidate(group_id)
+        except Exception:
+            LOG.exception("Failed to reload the security profile of group"
+                          " %s" % group_id)
+        finally:
+            self._refreshing.discard(group_id)
+
+
 class NVPDriver(base.BaseDriver):
     def __init__(self):
         self.nvp_connections = []
-        self.conn_index = 0
+        self.connection = None
+        self.security_profiles = SecurityProfileCache(
+            self._get_security_group)
         self.limits = {'max_ports_per_switch': 0,
                        'max_rules_per_group': 0,
                        'max_rules_per_port': 0}
@@ -115,22 +212,11 @@ class NVPDriver(base.BaseDriver):
                                         backoff=backoff))
 
     def get_connection(self):
-        conn = self.nvp_connections[self.conn_index]
-        if "connection" not in conn:
-            scheme = conn["port"] == "443" and "https" or "http"
-            uri = "%s://%s:%s" % (scheme, conn["ip_address"], conn["port"])
-            user = conn['username']
-            passwd = conn['password']
-            timeout = conn['http_timeout']
-            retries = conn['retries']
-            backoff = conn['backoff']
-            conn["connection"] = aiclib.nvp.Connection(uri,
-                                                       username=user,
-                                                       password=passwd,
-                                                       timeout=timeout,
-                                                       retries=retries,
-                                                       backoff=backoff)
-        return conn["connection"]
+        """Returns a connection spreading requests over every controller."""
+        if self.connection is None:
+            pool = nvp_pool.ControllerPool(self.nvp_connections)
+            self.connection = nvp_pool.PooledConnection(pool)
+        return self.connection
 
     def create_network(self, context, network_name, tags=None,
                        network_id=None, **kwargs):
@@ -183,15 +269,15 @@ class NVPDriver(base.BaseDriver):
 
     def create_port(self, context, network_id, port_id,
                     status=True, security_groups=None,
-                    device_id=""):
+                    device_id="", security_group_models=None):
         security_groups = security_groups or []
         tenant_id = context.tenant_id
         lswitch = self._create_or_choose_lswitch(context, network_id)
         connection = self.get_connection()
         port = connection.lswitch_port(lswitch)
         port.admin_status_enabled(status)
-        nvp_group_ids = self._get_security_groups_for_port(context,
-                                                           security_groups)
+        nvp_group_ids = self._get_security_groups_for_port(
+            context, security_groups, security_group_models)
         port.security_profiles(nvp_group_ids)
         tags = [dict(tag=network_id, scope="neutron_net_id"),
                 dict(tag=port_id, scope="neutron_port_id"),
@@ -213,13 +299,13 @@ class NVPDriver(base.BaseDriver):
         return res
 
     def update_port(self, context, port_id, status=True,
-                    security_groups=None):
+                    security_groups=None, security_group_models=None):
         security_groups = security_groups or []
         connection = self.get_connection()
         lswitch_id = self._lswitch_from_port(context, port_id)
         port = connection.lswitch_port(lswitch_id, port_id)
-        nvp_group_ids = self._get_security_groups_for_port(context,
-                                                           security_groups)
+        nvp_group_ids = self._get_security_groups_for_port(
+            context, security_groups, security_group_models)
         if nvp_group_ids:
             port.security_profiles(nvp_group_ids)
         port.admin_status_enabled(status)
@@ -249,6 +335,13 @@ class NVPDriver(base.BaseDriver):
                      " Ignoring explicitly. Message: %s"
                      % (port_id, e.args[0]))
 
+    def delete_ports(self, context, port_ids):
+        """Deletes many ports, port_delete_concurrency of them at once."""
+        pool = eventlet.GreenPool(CONF.NVP.port_delete_concurrency)
+        for port_id in port_ids:
+            pool.spawn_n(self.delete_port, context, port_id)
+        pool.waitall()
+
     def _collect_lport_info(self, lport, get_status):
         info = {
             'mirror_targets': lport['mirror_targets'],
@@ -346,12 +439,20 @@ class NVPDriver(base.BaseDriver):
                 dict(tag=tenant_id, scope="os_tid")]
         LOG.debug("Creating security profile %s" % group_name)
         profile.tags(tags)
-        return profile.create()
+        res = profile.create()
+        if group_id:
+            self.security_profiles.add(
+                tenant_id, group_id,
+                dict(uuid=res["uuid"],
+                     logical_port_ingress_rules=ingress_rules,
+                     logical_port_egress_rules=egress_rules))
+        return res
 
     def delete_security_group(self, context, group_id):
         guuid = self._get_security_group_id(context, group_id)
         connection = self.get_connection()
         LOG.debug("Deleting security profile %s" % group_id)
+        self.security_profiles.invalidate(group_id)
         connection.securityprofile(guuid).delete()
 
     def update_security_group(self, context, group_id, **group):
@@ -374,11 +475,22 @@ class NVPDriver(base.BaseDriver):
             profile.port_ingress_rules(ingress_rules)
         if group.get('port_egress_rules', None) is not None:
             profile.port_egress_rules(egress_rules)
-        return profile.update()
+        res = profile.update()
+        self._security_profile_updated(
+            context, group_id,
+            dict(uuid=query.get('uuid'),
+                 logical_port_ingress_rules=ingress_rules,
+                 logical_port_egress_rules=egress_rules))
+        return res
+
+    def _security_profile_updated(self, context, group_id, profile):
+        """Called with the rules a group's profile was just updated to."""
+        self.security_profiles.add(context.tenant_id, group_id, profile)
 
     def _update_security_group_rules(self, context, group_id, rule, operation,
                                      checks):
         groupd = self._get_security_group(context, group_id)
+        self.security_profiles.add(context.tenant_id, group_id, groupd)
         direction, secrule = self._get_security_group_rule_object(context,
                                                                   rule)
         rulelist = groupd['logical_port_%s_rules' % direction]
@@ -540,7 +652,8 @@ class NVPDriver(base.BaseDriver):
             raise Exception("No lswitch found for port %s" % port_id)
         return port['results'][0]["_relations"]["LogicalSwitchConfig"]["uuid"]
 
-    def _get_security_group(self, context, group_id):
+    def _get_security_group(self, context, group_id, group=None):
+        # NOTE: the profile only lives in NVP, so group is no help here
         connection = self.get_connection()
         query = connection.securityprofile().query()
         query.tagscopes(['os_tid', 'neutron_group_id'])
@@ -551,7 +664,7 @@ class NVPDriver(base.BaseDriver):
         return query['results'][0]
 
     def _get_security_group_id(self, context, group_id):
-        return self._get_security_group(context, group_id)['uuid']
+        return self.security_profiles.get(context, group_id)['uuid']
 
     def _get_security_group_rule_object(self, context, rule):
         ethertype = rule.get('ethertype', None)
@@ -576,27 +689,47 @@ class NVPDriver(base.BaseDriver):
                 "Direction not specified as 'ingress' or 'egress'.")
         return (direction, secrule)
 
+    def _profile_rule_count(self, context, connection, profile_uuid):
+        entry = self.security_profiles.by_uuid(profile_uuid)
+        if entry:
+            return entry['ingress'] + entry['egress']
+        profile = connection.securityprofile(profile_uuid).read()
+        tags = _tag_unroll(profile.get('tags') or [])
+        if tags.get('neutron_group_id'):
+            self.security_profiles.add(tags.get('os_tid'),
+                                       tags['neutron_group_id'], profile)
+        return self._check_rule_count_for_groups(context, [profile])
+
     def _check_rule_count_per_port(self, context, group_id):
         connection = self.get_connection()
         ports = connection.lswitch_port("*").query().security_profile_uuid(
             '=', self._get_security_group_id(
                 context, group_id)).results().get('results', [])
-        groups = (port.get('security_profiles', []) for port in ports)
-        return max([self._check_rule_count_for_groups(
-            context, (connection.securityprofile(gp).read() for gp in group))
-            for group in groups] or [0])
+        # NOTE: ports mostly share the same few groups, so each profile is
+        #       counted once however many ports it is on
+        counts = {}
+        for port in ports:
+            for gp in port.get('security_profiles', []):
+                if gp not in counts:
+                    counts[gp] = self._profile_rule_count(context,
+                                                          connection, gp)
+        return max([sum(counts[gp]
+                        for gp in port.get('security_profiles', []))
+                    for port in ports] or [0])
 
     def _check_rule_count_for_groups(self, context, groups):
         return sum(len(group['logical_port_ingress_rules']) +
                    len(group['logical_port_egress_rules'])
                    for group in groups)
 
-    def _get_security_groups_for_port(self, context, groups):
-        if (self._check_rule_count_for_groups(
-                context,
-                (self._get_security_group(context, g) for g in groups))
-                > self.limits['max_rules_per_port']):
+    def _get_security_groups_for_port(self, context, groups,
+                                      group_models=None):
+        group_models = dict((group["id"], group)
+                            for group in group_models or [])
+        profiles = [self.security_profiles.get(context, g, group_models.get(g))
+                    for g in groups]
+        if (sum(p['ingress'] + p['egress'] for p in profiles) >
+                self.limits['max_rules_per_port']):
             raise exceptions.DriverLimitReached(limit="rules per port")
 
-        return [self._get_security_group(context, group)['uuid']
-                for group in groups]
+        return [p['uuid'] for p in profiles]
@@ -0,0 +1,217 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Connections to every configured NVP controller
+
+Each request goes to the controller with the fewest requests outstanding,
+or the next one round robin, over one of connections_per_controller
+persistent aiclib connections kept for it. A controller failing
+controller_failure_threshold requests in a row, with a 5xx, a timeout or a
+connection error, is left alone for controller_retry_seconds, then sent a
+single request to find out whether it has recovered. Reads failing that
+way are retried on the next controller.
+"""
+
+import threading
+import time
+
+import aiclib
+from neutron.openstack.common import log as logging
+from oslo.config import cfg
+
+from quark import metrics
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+pool_opts = [
+    cfg.IntOpt('connections_per_controller',
+               default=2,
+               help=_('Idle connections kept open to each NVP controller')),
+    cfg.StrOpt('controller_selection',
+               default='least_outstanding',
+               help=_("How requests are spread over the NVP controllers,"
+                      " 'least_outstanding' or 'round_robin'")),
+    cfg.IntOpt('controller_failure_threshold',
+               default=3,
+               help=_('Failed requests in a row before an NVP controller'
+                      ' is left alone')),
+    cfg.IntOpt('controller_retry_seconds',
+               default=30,
+               help=_('Seconds a failing NVP controller is left alone')),
+]
+
+CONF.register_opts(pool_opts, "NVP")
+
+# NOTE: requests that are safe to send again to another controller
+_FAILOVER_METHODS = ("GET",)
+
+
+def is_controller_failure(e):
+    """Whether e says the controller, rather than the request, is at fault."""
+    if isinstance(e, aiclib.core.AICException):
+        return e.code >= 500 or e.code == 408
+    return True
+
+
+class Controller(object):
+    """One NVP controller, its idle connections and how healthy it is."""
+
+    def __init__(self, config):
+        self.config = config
+        self.name = "%s:%s" % (config["ip_address"], config["port"])
+        self.metric = "nvp.%s" % self.name.replace(".", "_").replace(":", "_")
+        self.outstanding = 0
+        self.failures = 0
+        self.retry_at = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = self.config
+        scheme = conn["port"] == "443" and "https" or "http"
+        uri = "%s://%s:%s" % (scheme, conn["ip_address"], conn["port"])
+        return aiclib.nvp.Connection(uri,
+                                     username=conn["username"],
+                                     password=conn["password"],
+                                     timeout=conn["http_timeout"],
+                                     retries=conn["retries"],
+                                     backoff=conn["backoff"])
+
+    def broken(self):
+        return self.failures >= CONF.NVP.controller_failure_threshold
+
+    def request(self, entity, method, resource):
+        connection = None
+        failed = True
+        with self._lock:
+            self.outstanding += 1
+            if self._idle:
+                connection = self._idle.pop()
+        try:
+            with metrics.timer("%s.request" % self.metric):
+                if connection is None:
+                    connection = self._connect()
+                result = connection._action(entity, method, resource)
+            failed = False
+            return result
+        except Exception as e:
+            failed = is_controller_failure(e)
+            raise
+        finally:
+            self._finished(connection, failed)
+
+    def _finished(self, connection, failed):
+        with self._lock:
+            self.outstanding -= 1
+            if failed:
+                # NOTE: the connection may be what's broken, so it's dropped
+                self.failures += 1
+                if self.failures == CONF.NVP.controller_failure_threshold:
+                    LOG.error("NVP controller %s failed %d requests in a"
+                              " row, leaving it alone for %d seconds" %
+                              (self.name, self.failures,
+                               CONF.NVP.controller_retry_seconds))
+                if self.broken():
+                    self.retry_at = (time.time() +
+                                     CONF.NVP.controller_retry_seconds)
+                return
+            if self.broken():
+                LOG.info("NVP controller %s has recovered" % self.name)
+            self.failures = 0
+            self.retry_at = 0
+            if (connection is not None and
+                    len(self._idle) < CONF.NVP.connections_per_controller):
+                self._idle.append(connection)
+
+
+class ControllerPool(object):
+    """Spreads requests over the controllers, failing over between them."""
+
+    def __init__(self, configs):
+        self.controllers = [Controller(config) for config in configs]
+        self._next = 0
+        self._lock = threading.Lock()
+        for controller in self.controllers:
+            metrics.REGISTRY.gauge("%s.outstanding" % controller.metric,
+                                   lambda c=controller: c.outstanding)
+            metrics.REGISTRY.gauge("%s.broken" % controller.metric,
+                                   lambda c=controller: int(c.broken()))
+
+    def select(self, tried=()):
+        """Returns the controller the next request should go to."""
+        with self._lock:
+            now = time.time()
+            # NOTE: starting the search one further along each time breaks
+            #       ties between equally busy controllers round robin
+            start = self._next % len(self.controllers)
+            self._next += 1
+            candidates = [c for c in (self.controllers[start:] +
+                                      self.controllers[:start])
+                          if c not in tried]
+            ready = [c for c in candidates if c.retry_at <= now]
+            if not ready:
+                # NOTE: with every controller failing, the one left alone
+                #       the longest is tried rather than failing outright
+                chosen = min(candidates, key=lambda c: c.retry_at)
+            elif CONF.NVP.controller_selection == "round_robin":
+                chosen = ready[0]
+            else:
+                chosen = min(ready, key=lambda c: c.outstanding)
+            if chosen.broken():
+                # NOTE: this request finds out whether it has recovered,
+                #       the rest keep away until it has
+                chosen.retry_at = now + CONF.NVP.controller_retry_seconds
+            return chosen
+
+    def request(self, entity, method, resource):
+        if not self.controllers:
+            raise aiclib.core.AICException(503, "No NVP controllers are"
+                                                " configured")
+        tried = []
+        while True:
+            controller = self.select(tried)
+            tried.append(controller)
+            try:
+                return controller.request(entity, method, resource)
+            except Exception as e:
+                if (method not in _FAILOVER_METHODS or
+                        not is_controller_failure(e) or
+                        len(tried) == len(self.controllers)):
+                    raise
+                LOG.warning("NVP controller %s failed %s %s, trying"
+                            " another: %s" % (controller.name, method,
+                                              resource, e))
+
+
+class PooledConnection(aiclib.nvp.Connection):
+    """An aiclib connection whose requests go through a ControllerPool.
+
+    Every entity and query made from it sends its requests through
+    _action, which hands them to the pool. Each request checks out an
+    aiclib connection of its own for as long as it runs, so greenthreads
+    can share one PooledConnection. aiclib doesn't offer a public
+    way in, so requirements.txt pins the aiclib this was written against
+    and test_nvp_pool checks _action is still called the same way.
+    """
+
+    def __init__(self, pool):
+        # NOTE: aiclib's constructor opens a connection to one controller,
+        #       which the pool does for each controller instead
+        self.pool = pool
+
+    def _action(self, entity, method, resource):
+        return self.pool.request(entity, method, resource)
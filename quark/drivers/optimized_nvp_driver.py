@@ -18,7 +18,9 @@ Optimized NVP client for Quark
 """
 
 import aiclib
+import eventlet
 from neutron.openstack.common import log as logging
+from oslo.config import cfg
 
 from quark.db import models
 from quark.drivers.nvp_driver import NVPDriver
@@ -26,6 +28,7 @@ from quark.drivers.nvp_driver import NVPDriver
 import sqlalchemy as sa
 from sqlalchemy import orm
 
+CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
 
 
@@ -68,11 +71,12 @@ class OptimizedNVPDriver(NVPDriver):
 
     def create_port(self, context, network_id, port_id,
                     status=True, security_groups=None,
-                    device_id=""):
+                    device_id="", security_group_models=None):
         security_groups = security_groups or []
         nvp_port = super(OptimizedNVPDriver, self).create_port(
             context, network_id, port_id, status=status,
-            security_groups=security_groups, device_id=device_id)
+            security_groups=security_groups, device_id=device_id,
+            security_group_models=security_group_models)
         switch_nvp_id = nvp_port["lswitch"]
 
         # slightly inefficient for the sake of brevity. Lets the
@@ -84,18 +88,25 @@ class OptimizedNVPDriver(NVPDriver):
 
         new_port = LSwitchPort(port_id=nvp_port["uuid"],
                                switch_id=switch.id)
+        if security_groups:
+            self._lport_set_profiles(context, new_port, security_groups)
         context.session.add(new_port)
         switch.port_count = switch.port_count + 1
         return nvp_port
 
     def update_port(self, context, port_id,
-                    status=True, security_groups=None):
+                    status=True, security_groups=None,
+                    security_group_models=None):
         security_groups = security_groups or []
         nvp_port = super(OptimizedNVPDriver, self).update_port(
             context, port_id, status=status,
-            security_groups=security_groups)
+            security_groups=security_groups,
+            security_group_models=security_group_models)
         port = self._lport_select_by_id(context, port_id)
         port.update(nvp_port)
+        # NOTE: like the parent, no groups leaves the port's profiles alone
+        if security_groups:
+            self._lport_set_profiles(context, port, security_groups)
 
     def delete_port(self, context, port_id):
         port = self._lport_select_by_id(context, port_id)
@@ -129,6 +140,75 @@ class OptimizedNVPDriver(NVPDriver):
             if len(switches) > 1:
                 self._lswitch_delete(context, switch.nvp_id)
 
+    def delete_ports(self, context, port_ids):
+        """Deletes many ports, port_delete_concurrency of them at once.
+
+        Their switches come from one query and the ports are deleted from
+        NVP concurrently. The bookkeeping rows, switch counts and orphans
+        are updated together once every delete has finished.
+        """
+        lports = context.session.query(LSwitchPort).options(
+            orm.joinedload(LSwitchPort.switch)).filter(
+            LSwitchPort.port_id.in_(port_ids)).all()
+        if not lports:
+            return
+        switches = {}
+        for lport in lports:
+            switches.setdefault(lport.switch, []).append(lport)
+
+        # NOTE: only NVP is called from the greenthreads, the session
+        #       stays with this one
+        pool = eventlet.GreenPool(CONF.NVP.port_delete_concurrency)
+        errors = pool.imap(
+            lambda lport: self._nvp_lport_delete(lport["port_id"],
+                                                 lport["switch_id"]),
+            [dict(port_id=lport.port_id, switch_id=lport.switch.nvp_id)
+             for lport in lports])
+        orphans = []
+        for lport, error in zip(lports, errors):
+            if isinstance(error, aiclib.core.AICException):
+                if error.code == 404:
+                    LOG.info("LSwitchPort/Port %s not found in NVP."
+                             % lport.port_id)
+                else:
+                    LOG.info("LSwitchPort/Port %s was found in NVP."
+                             " Adding to orphaned table for later cleanup."
+                             " Code: %s, Message: %s"
+                             % (lport.port_id, error.code, error.args[0]))
+                    orphans.append(OrphanedLSwitchPort(port_id=lport.port_id))
+            elif error is not None:
+                LOG.info("Failed to delete LSwitchPort/Port %s from "
+                         " NVP (optimized). Message: %s"
+                         % (lport.port_id, error))
+        context.session.add_all(orphans)
+
+        ids = [lport.id for lport in lports]
+        assoc = lport_profile_association_table
+        context.session.execute(assoc.delete().where(
+            assoc.c.lswitchport_id.in_(ids)))
+        context.session.query(LSwitchPort).filter(
+            LSwitchPort.id.in_(ids)).delete(synchronize_session=False)
+        for lport in lports:
+            context.session.expunge(lport)
+
+        for switch, deleted in switches.items():
+            switch.port_count = switch.port_count - len(deleted)
+            if switch.port_count <= 0:
+                others = self._lswitches_for_network(
+                    context, switch.network_id)
+                if len(others) > 1:
+                    self._lswitch_delete(context, switch.nvp_id)
+
+    def _nvp_lport_delete(self, port_id, lswitch_uuid):
+        """Deletes an lport from NVP and returns the error, if any."""
+        connection = self.get_connection()
+        try:
+            LOG.debug("Deleting port %s from lswitch %s"
+                      % (port_id, lswitch_uuid))
+            connection.lswitch_port(lswitch_uuid, port_id).delete()
+        except Exception as e:
+            return e
+
     def _lport_delete(self, context, port_id, switch=None):
         if switch is None:
             port = self._lport_select_by_id(context, port_id)
@@ -140,7 +220,10 @@ class OptimizedNVPDriver(NVPDriver):
         nvp_group = super(OptimizedNVPDriver, self).create_security_group(
             context, group_name, **group)
         group_id = group.get('group_id')
-        profile = SecurityProfile(id=group_id, nvp_id=nvp_group['uuid'])
+        rule_count = (len(group.get('port_ingress_rules', [])) +
+                      len(group.get('port_egress_rules', [])))
+        profile = SecurityProfile(id=group_id, nvp_id=nvp_group['uuid'],
+                                  rule_count=rule_count)
         context.session.add(profile)
 
     def delete_security_group(self, context, group_id):
@@ -149,6 +232,46 @@ class OptimizedNVPDriver(NVPDriver):
         group = self._query_security_group(context, group_id)
         context.session.delete(group)
 
+    def _security_profile_updated(self, context, group_id, profile):
+        super(OptimizedNVPDriver, self)._security_profile_updated(
+            context, group_id, profile)
+        rule_count = (len(profile.get('logical_port_ingress_rules') or []) +
+                      len(profile.get('logical_port_egress_rules') or []))
+        profiles = SecurityProfile.__table__
+        result = context.session.execute(
+            profiles.update().
+            where(profiles.c.id == group_id).
+            where(profiles.c.rule_count != rule_count).
+            values(rule_count=rule_count))
+        if not result.rowcount:
+            return
+
+        # NOTE: recounted rather than adjusted by the difference, so
+        #       concurrent updates to the port's other groups can't leave
+        #       its count wrong
+        lports = LSwitchPort.__table__
+        assoc = lport_profile_association_table
+        lport_ids = sa.select([assoc.c.lswitchport_id]).where(
+            assoc.c.security_profile_id == group_id)
+        context.session.execute(
+            lports.update().
+            where(lports.c.id.in_(lport_ids)).
+            values(rule_count=self._lport_rule_count_query(lports.c.id)))
+
+    def _lport_rule_count_query(self, lport_id):
+        assoc = lport_profile_association_table
+        profiles = SecurityProfile.__table__
+        return sa.select(
+            [sa.func.coalesce(sa.func.sum(profiles.c.rule_count), 0)]).where(
+            assoc.c.lswitchport_id == lport_id).where(
+            assoc.c.security_profile_id == profiles.c.id).as_scalar()
+
+    def _lport_set_profiles(self, context, port, security_groups):
+        profiles = context.session.query(SecurityProfile).filter(
+            SecurityProfile.id.in_(security_groups)).all()
+        port.security_profiles = profiles
+        port.rule_count = sum(profile.rule_count for profile in profiles)
+
     def _lport_select_by_id(self, context, port_id):
         query = context.session.query(LSwitchPort)
         query = query.filter(LSwitchPort.port_id == port_id)
@@ -249,9 +372,10 @@ class OptimizedNVPDriver(NVPDriver):
                 res.pop(key)
         return res
 
-    def _get_security_group(self, context, group_id):
-        group = context.session.query(models.SecurityGroup).filter(
-            models.SecurityGroup.id == group_id).first()
+    def _get_security_group(self, context, group_id, group=None):
+        if group is None:
+            group = context.session.query(models.SecurityGroup).filter(
+                models.SecurityGroup.id == group_id).first()
         rulelist = {'ingress': [], 'egress': []}
         for rule in group.rules:
             rulelist[rule.direction].append(
@@ -261,13 +385,11 @@ class OptimizedNVPDriver(NVPDriver):
                 'logical_port_egress_rules': rulelist['egress']}
 
     def _check_rule_count_per_port(self, context, group_id):
-        ports = context.session.query(models.SecurityGroup).filter(
-            models.SecurityGroup.id == group_id).first().get('ports', [])
-        groups = (set(group.id for group in port.get('security_groups', []))
-                  for port in ports)
-        return max(self._check_rule_count_for_groups(
-            context, (self._get_security_group(context, id) for id in g))
-            for g in groups)
+        assoc = lport_profile_association_table
+        query = context.session.query(sa.func.max(LSwitchPort.rule_count))
+        query = query.join(assoc, assoc.c.lswitchport_id == LSwitchPort.id)
+        query = query.filter(assoc.c.security_profile_id == group_id)
+        return query.scalar() or 0
 
 
 class LSwitchPort(models.BASEV2, models.HasId):
@@ -276,6 +398,9 @@ class LSwitchPort(models.BASEV2, models.HasId):
     switch_id = sa.Column(sa.String(36),
                           sa.ForeignKey("quark_nvp_driver_lswitch.id"),
                           nullable=False)
+    # NOTE: the rules of all of the port's security profiles together
+    rule_count = sa.Column(sa.Integer(), nullable=False, default=0,
+                           server_default="0")
 
 
 class LSwitch(models.BASEV2, models.HasId):
@@ -297,9 +422,27 @@ class QOS(models.BASEV2, models.HasId):
     min_bandwidth_rate = sa.Column(sa.Integer(), nullable=False)
 
 
+# NOTE: keyed by profile first, for finding the ports a profile is on
+lport_profile_association_table = sa.Table(
+    "quark_nvp_driver_lswitchport_security_profiles",
+    models.BASEV2.metadata,
+    sa.Column("security_profile_id", sa.String(36),
+              sa.ForeignKey("quark_nvp_driver_security_profile.id"),
+              primary_key=True),
+    sa.Column("lswitchport_id", sa.String(36),
+              sa.ForeignKey("quark_nvp_driver_lswitchport.id"),
+              primary_key=True),
+    **models.TABLE_KWARGS)
+
+
 class SecurityProfile(models.BASEV2, models.HasId):
     __tablename__ = "quark_nvp_driver_security_profile"
     nvp_id = sa.Column(sa.String(36), nullable=False, index=True)
+    rule_count = sa.Column(sa.Integer(), nullable=False, default=0,
+                           server_default="0")
+    lswitch_ports = orm.relationship(
+        LSwitchPort, secondary=lport_profile_association_table,
+        backref="security_profiles")
 
 
 class OrphanedLSwitch(models.BASEV2, models.HasId):
@@ -16,6 +16,7 @@
 from quark.drivers import base
 from quark.drivers import optimized_nvp_driver as optnvp
 from quark.drivers import unmanaged
+from quark import metrics
 
 
 class DriverRegistry(object):
@@ -27,7 +28,7 @@ class DriverRegistry(object):
 
     def get_driver(self, driver_name):
         if driver_name in self.drivers:
-            return self.drivers[driver_name]
+            return metrics.TimedDriver(self.drivers[driver_name])
         raise Exception("Driver %s is not registered." % driver_name)
 
 
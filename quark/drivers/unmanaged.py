@@ -64,6 +64,9 @@ class UnmanagedDriver(object):
     def delete_port(self, context, port_id, **kwargs):
         LOG.info("delete_port %s %s" % (context.tenant_id, port_id))
 
+    def delete_ports(self, context, port_ids):
+        LOG.info("delete_ports %s %s" % (context.tenant_id, port_ids))
+
     def diag_port(self, context, network_id, **kwargs):
         LOG.info("diag_port %s" % network_id)
         return {}
@@ -101,3 +101,7 @@ class IPPolicyInUse(exceptions.InUse):
 
 class DriverLimitReached(exceptions.InvalidInput):
     message = _("Driver has reached limit on resource '%(limit)s'")
+
+
+class InvalidSortKey(exceptions.InvalidInput):
+    message = _("Cannot sort %(resource)s by '%(key)s'")
@@ -0,0 +1,195 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Integer range structures used by IPAM
+"""
+
+import bisect
+
+import netaddr
+
+# NOTE: IPv4 addresses are stored as IPv4-mapped IPv6 (::ffff:a.b.c.d)
+_V4_MAPPED = 0xffff00000000
+
+
+def ip_value(ip):
+    """Returns ip as an integer in the same space as IPAddress.address."""
+    if ip.version == 4:
+        return ip.value | _V4_MAPPED
+    return ip.value
+
+
+class IntervalSet(object):
+    """Immutable set of integers stored as sorted, merged inclusive runs.
+
+    Membership is a bisect over the run starts, so a lookup costs the
+    same whether the set came from one CIDR or a few hundred.
+    """
+
+    def __init__(self, intervals=None):
+        self._firsts = []
+        self._lasts = []
+        self.size = 0
+        for first, last in _merge(intervals or []):
+            self._firsts.append(first)
+            self._lasts.append(last)
+            self.size += last - first + 1
+
+    @classmethod
+    def from_cidrs(cls, cidrs):
+        """Builds a set from CIDRs, IPv4 ones mapped into IPv6."""
+        intervals = []
+        for cidr in cidrs:
+            net = netaddr.IPNetwork(cidr).ipv6()
+            intervals.append((net.first, net.last))
+        return cls(intervals)
+
+    def __nonzero__(self):
+        return self.size > 0
+
+    def __contains__(self, value):
+        if not isinstance(value, (int, long)):
+            value = ip_value(netaddr.IPAddress(value))
+        idx = bisect.bisect_right(self._firsts, value) - 1
+        return idx >= 0 and value <= self._lasts[idx]
+
+    def __eq__(self, other):
+        return (isinstance(other, IntervalSet) and
+                self.ranges() == other.ranges())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def ranges(self):
+        return zip(self._firsts, self._lasts)
+
+    def union(self, intervals):
+        return IntervalSet(self.ranges() + list(intervals))
+
+    def iter_cidrs(self, version=6):
+        """Yields the set as netaddr.IPNetworks of the given version."""
+        for first, last in self.ranges():
+            first = netaddr.IPAddress(first, version=6)
+            last = netaddr.IPAddress(last, version=6)
+            if version == 4:
+                first, last = first.ipv4(), last.ipv4()
+            for cidr in netaddr.iprange_to_cidrs(first, last):
+                yield cidr
+
+
+class FreeRanges(object):
+    """Run-length encoded set of free integers in [first, last].
+
+    Free addresses are kept as a sorted list of inclusive (first, last)
+    runs, so a nearly-full subnet with a handful of holes costs a handful
+    of runs rather than one entry per address. Handing out the lowest
+    free value is O(1); discarding an arbitrary value is a bisect.
+    """
+
+    def __init__(self, first, last, excluded=None):
+        self._firsts = []
+        self._lasts = []
+        self._size = 0
+
+        cursor = first
+        for ex_first, ex_last in _merge(excluded or []):
+            if ex_last < cursor:
+                continue
+            if ex_first > last:
+                break
+            if ex_first > cursor:
+                self._append(cursor, ex_first - 1)
+            cursor = max(cursor, ex_last + 1)
+        if cursor <= last:
+            self._append(cursor, last)
+
+    def _append(self, first, last):
+        self._firsts.append(first)
+        self._lasts.append(last)
+        self._size += last - first + 1
+
+    def __len__(self):
+        return self._size
+
+    def __nonzero__(self):
+        return self._size > 0
+
+    def __contains__(self, value):
+        idx = bisect.bisect_right(self._firsts, value) - 1
+        return idx >= 0 and value <= self._lasts[idx]
+
+    def __iter__(self):
+        for first, last in zip(self._firsts, self._lasts):
+            for value in xrange(first, last + 1):
+                yield value
+
+    def ranges(self):
+        return zip(self._firsts, self._lasts)
+
+    def peek(self):
+        """Returns the lowest free value without removing it, or None."""
+        if not self._size:
+            return None
+        return self._firsts[0]
+
+    def pop(self):
+        """Removes and returns the lowest free value, or None if empty."""
+        if not self._size:
+            return None
+        value = self._firsts[0]
+        if value == self._lasts[0]:
+            del self._firsts[0]
+            del self._lasts[0]
+        else:
+            self._firsts[0] = value + 1
+        self._size -= 1
+        return value
+
+    def discard(self, value):
+        """Removes value from the free set if present.
+
+        Returns True if the value was free.
+        """
+        idx = bisect.bisect_right(self._firsts, value) - 1
+        if idx < 0 or value > self._lasts[idx]:
+            return False
+
+        first, last = self._firsts[idx], self._lasts[idx]
+        if first == last:
+            del self._firsts[idx]
+            del self._lasts[idx]
+        elif value == first:
+            self._firsts[idx] = value + 1
+        elif value == last:
+            self._lasts[idx] = value - 1
+        else:
+            self._lasts[idx] = value - 1
+            self._firsts.insert(idx + 1, value + 1)
+            self._lasts.insert(idx + 1, last)
+        self._size -= 1
+        return True
+
+
+def _merge(intervals):
+    """Sorts and coalesces overlapping or adjacent inclusive intervals."""
+    merged = []
+    for first, last in sorted(intervals):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1][1] = last
+            continue
+        merged.append([first, last])
+    return merged
@@ -17,12 +17,17 @@
 Quark Pluggable IPAM
 """
 
+import atexit
+import datetime
+import itertools
+import os
 import random
 import uuid
 
 import netaddr
 from neutron.common import exceptions
 from neutron.common import rpc as n_rpc
+from neutron import context as neutron_context
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import timeutils
 from oslo.config import cfg
@@ -31,6 +36,8 @@ from oslo.db import exception as db_exception
 from quark.db import api as db_api
 from quark.db import models
 from quark import exceptions as q_exc
+from quark import ip_ranges
+from quark import metrics
 
 LOG = logging.getLogger(__name__)
 CONF = cfg.CONF
@@ -49,7 +56,23 @@ quark_opts = [
     cfg.IntOpt("ip_address_retry_max",
                default=20,
                help=_("Number of times to attempt to allocate a new IP"
-                      " address before giving up."))
+                      " address before giving up.")),
+    cfg.IntOpt("ipam_reuse_window",
+               default=10,
+               help=_("Number of the oldest reusable IP addresses, beyond"
+                      " the ones needed, that an allocation picks from at"
+                      " random so concurrent workers don't contend for the"
+                      " same address.")),
+    cfg.IntOpt("mac_address_block_size",
+               default=64,
+               help=_("Number of MAC addresses each worker reserves from a"
+                      " MAC address range at a time. 1 reserves a single"
+                      " MAC per allocation.")),
+    cfg.IntOpt("ipam_availability_cache_ttl",
+               default=10,
+               help=_("Seconds each worker trusts its summary of which"
+                      " subnets in a network are full before reading it"
+                      " again. 0 disables the summary."))
 ]
 
 CONF.register_opts(quark_opts, "QUARK")
@@ -59,6 +82,10 @@ CONF.register_opts(quark_opts, "QUARK")
 # netaddr.IPAddress("::0200:0:0:0").value
 MAGIC_INT = 144115188075855872
 
+# NOTE: kept apart from the per-port generators in rfc3041_ip, which are
+#       seeded with the port id and so entirely predictable.
+_reuse_random = random.Random()
+
 
 def rfc2462_ip(mac, cidr):
     # NOTE(mdietz): see RFC2462
@@ -70,10 +97,12 @@ def rfc2462_ip(mac, cidr):
 
 
 def rfc3041_ip(port_id, cidr):
-    random.seed(int(uuid.UUID(port_id)))
+    # NOTE: a private generator, so seeding with the port id doesn't reset
+    #       the module-level random for everyone else in the process.
+    rand = random.Random(int(uuid.UUID(port_id)))
     int_val = netaddr.IPNetwork(cidr).value
     while True:
-        val = int_val + random.getrandbits(64)
+        val = int_val + rand.getrandbits(64)
         val ^= MAGIC_INT
         yield val
 
@@ -84,6 +113,220 @@ def generate_v6(mac, port_id, cidr):
         yield addr
 
 
+class MacAddressBlocks(object):
+    """Per-worker cache of MAC addresses reserved from ranges in blocks.
+
+    A refill moves the busiest range's next_auto_assign_mac forward by
+    mac_address_block_size in one locked update, after which the worker
+    hands the block out without touching the range row again. Whatever is
+    left when the worker exits is given back by release().
+    """
+
+    def __init__(self):
+        self._pid = os.getpid()
+        # NOTE: [range_id, next_address, last_address]
+        self._blocks = []
+        self.refills = 0
+        self.reserved = 0
+        self.released = 0
+
+    def _check_pid(self):
+        # NOTE: a forked worker must not hand out its parent's reservations
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._blocks = []
+
+    def __len__(self):
+        self._check_pid()
+        return sum(last - next_address + 1
+                   for _, next_address, last in self._blocks)
+
+    def clear(self):
+        self._blocks = []
+
+    def pop(self):
+        """Returns the next reserved (range_id, address), or None."""
+        self._check_pid()
+        while self._blocks:
+            block = self._blocks[0]
+            if block[1] > block[2]:
+                self._blocks.pop(0)
+                continue
+            address = block[1]
+            block[1] += 1
+            return block[0], address
+        return None
+
+    def refill(self, context, size):
+        """Reserves up to size MACs from a range.
+
+        Returns False if there is no range left to reserve from.
+        """
+        with context.session.begin():
+            fn = db_api.mac_address_range_find_allocation_counts
+            mac_range = fn(context)
+            if not mac_range:
+                return False
+
+            rng, addr_count = mac_range
+            first = rng["next_auto_assign_mac"]
+            last = rng["last_address"]
+            if (last - rng["first_address"] + 1) <= addr_count:
+                rng["next_auto_assign_mac"] = -1
+                context.session.add(rng)
+                return True
+
+            last = min(last, first + size - 1)
+            next_auto = last + 1
+            if next_auto > rng["last_address"]:
+                next_auto = -1
+            db_api.mac_address_range_update(
+                context, rng, next_auto_assign_mac=next_auto)
+
+        self._check_pid()
+        self._blocks.append([rng["id"], first, last])
+        self.refills += 1
+        self.reserved += last - first + 1
+        LOG.debug("Reserved MAC block %s-%s from range %s (refills: %s, "
+                  "reserved: %s)" % (first, last, rng["id"], self.refills,
+                                     self.reserved))
+        return True
+
+    def release(self, context=None):
+        """Gives unused reservations back to their ranges.
+
+        A block is rewound into its range if nothing was reserved after it,
+        otherwise its addresses are stored as deallocated MACs that are
+        immediately reusable.
+        """
+        self._check_pid()
+        blocks = [block for block in self._blocks if block[1] <= block[2]]
+        self._blocks = []
+        if not blocks:
+            return
+
+        context = context or neutron_context.get_admin_context()
+        reclaim_at = timeutils.utcnow() - datetime.timedelta(
+            seconds=CONF.QUARK.ipam_reuse_after)
+        for range_id, first, last in reversed(blocks):
+            try:
+                with context.session.begin():
+                    rewound = db_api.mac_address_range_release_block(
+                        context, range_id, first, last)
+            except Exception:
+                LOG.exception("Error in rewinding mac range %s" % range_id)
+                rewound = 0
+
+            if rewound:
+                self.released += last - first + 1
+                continue
+
+            for address in xrange(first, last + 1):
+                try:
+                    with context.session.begin():
+                        mac = db_api.mac_address_create(
+                            context, address=address,
+                            mac_address_range_id=range_id)
+                        db_api.mac_address_update(
+                            context, mac, deallocated=True,
+                            deallocated_at=reclaim_at)
+                    self.released += 1
+                except Exception:
+                    LOG.exception("Error in releasing mac %s. MAC possibly"
+                                  " duplicate" % address)
+
+
+MAC_BLOCKS = MacAddressBlocks()
+atexit.register(MAC_BLOCKS.release)
+metrics.REGISTRY.gauge("ipam.mac_blocks.available", lambda: len(MAC_BLOCKS))
+metrics.REGISTRY.gauge("ipam.mac_blocks.refills", lambda: MAC_BLOCKS.refills)
+metrics.REGISTRY.gauge("ipam.mac_blocks.reserved",
+                       lambda: MAC_BLOCKS.reserved)
+metrics.REGISTRY.gauge("ipam.mac_blocks.released",
+                       lambda: MAC_BLOCKS.released)
+
+
+class SubnetAvailability(object):
+    """Per-worker summary of which subnets in a network are full.
+
+    Loaded with one unlocked, column-only query per network and trusted for
+    ipam_availability_cache_ttl seconds, during which the worker keeps it
+    up to date with its own allocations. select_subnet only counts and
+    locks the subnets the summary says have room, so full subnets, and
+    networks made up of nothing else, cost no subnet row reads at all.
+
+    Full means exactly what it does to select_subnet: either the cursor is
+    spent or the generated addresses and the policy cover the subnet.
+    """
+
+    def __init__(self):
+        # NOTE: net_id -> (expires_at, {subnet_id: summary dict})
+        self._networks = {}
+
+    def clear(self):
+        self._networks.clear()
+
+    def invalidate(self, net_id):
+        self._networks.pop(net_id, None)
+
+    def _summary(self, context, net_id):
+        now = timeutils.utcnow()
+        cached = self._networks.get(net_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        summary = {}
+        for row in db_api.subnet_find_availability(context, net_id):
+            summary[row.id] = dict(
+                ip_version=row.ip_version, segment_id=row.segment_id,
+                size=row.last_ip - row.first_ip + 1,
+                policy_size=row.size or 0, generated=row.generated_count,
+                exhausted=row.next_auto_assign_ip == -1)
+        expires_at = now + datetime.timedelta(
+            seconds=CONF.QUARK.ipam_availability_cache_ttl)
+        self._networks[net_id] = (expires_at, summary)
+        return summary
+
+    def available(self, context, net_id, ip_version=None, segment_id=None,
+                  subnet_ids=None):
+        """Returns ids of the matching subnets that aren't full.
+
+        Returns None when the summary is disabled.
+        """
+        if CONF.QUARK.ipam_availability_cache_ttl <= 0:
+            return None
+        available = []
+        for subnet_id, subnet in self._summary(context, net_id).items():
+            if subnet["exhausted"]:
+                continue
+            if ip_version and subnet["ip_version"] != ip_version:
+                continue
+            if segment_id and subnet["segment_id"] != segment_id:
+                continue
+            if subnet_ids and subnet_id not in subnet_ids:
+                continue
+            if subnet["size"] <= (subnet["generated"] +
+                                  subnet["policy_size"] - 1):
+                subnet["exhausted"] = True
+                continue
+            available.append(subnet_id)
+        return available
+
+    def allocated(self, net_id, subnet_id, count=1):
+        """Accounts for count new addresses allocated from a subnet."""
+        subnet = self._networks.get(net_id, (None, {}))[1].get(subnet_id)
+        if subnet:
+            subnet["generated"] += count
+
+    def exhausted(self, net_id, subnet_id):
+        subnet = self._networks.get(net_id, (None, {}))[1].get(subnet_id)
+        if subnet:
+            subnet["exhausted"] = True
+
+
+SUBNET_AVAILABILITY = SubnetAvailability()
+
+
 class QuarkIpam(object):
 
     def allocate_mac_address(self, context, net_id, port_id, reuse_after,
@@ -107,6 +350,28 @@ class QuarkIpam(object):
                 LOG.exception("Error in mac reallocate...")
                 continue
 
+        block_size = CONF.QUARK.mac_address_block_size
+        if not mac_address and block_size > 1:
+            for retry in xrange(cfg.CONF.QUARK.mac_address_retry_max):
+                reserved = MAC_BLOCKS.pop()
+                if reserved is None:
+                    try:
+                        if not MAC_BLOCKS.refill(context, block_size):
+                            break
+                    except Exception:
+                        LOG.exception("Error in reserving mac block")
+                    continue
+
+                range_id, next_address = reserved
+                try:
+                    with context.session.begin():
+                        return db_api.mac_address_create(
+                            context, address=next_address,
+                            mac_address_range_id=range_id)
+                except Exception:
+                    LOG.exception("Error in creating mac. MAC possibly"
+                                  " duplicate")
+
         # This could fail if a large chunk of MACs were chosen explicitly,
         # but under concurrent load enough MAC creates should iterate without
         # any given thread exhausting its retry count.
@@ -162,6 +427,61 @@ class QuarkIpam(object):
 
         raise exceptions.MacAddressGenerationFailure(net_id=net_id)
 
+    def allocate_mac_addresses(self, context, macs, net_id, port_ids,
+                               reuse_after):
+        """Allocates one MAC address for each of port_ids into macs.
+
+        Reusable MACs are claimed with a single locked query and the rest
+        are reserved from a range with a single range update. Whatever the
+        batch can't cover falls back to allocate_mac_address.
+        """
+        start = len(macs)
+        try:
+            with context.session.begin():
+                deallocated_macs = db_api.mac_address_find(
+                    context, lock_mode=True, reuse_after=reuse_after,
+                    deallocated=True,
+                    order_by="address ASC").limit(len(port_ids))
+                reused = [db_api.mac_address_update(context, mac,
+                                                    deallocated=False,
+                                                    deallocated_at=None)
+                          for mac in deallocated_macs]
+            macs.extend(reused)
+        except Exception:
+            LOG.exception("Error in bulk mac reallocate...")
+
+        while len(macs) - start < len(port_ids):
+            try:
+                with context.session.begin():
+                    fn = db_api.mac_address_range_find_allocation_counts
+                    mac_range = fn(context)
+                    if not mac_range:
+                        break
+
+                    rng, addr_count = mac_range
+                    first = rng["next_auto_assign_mac"]
+                    wanted = len(port_ids) - (len(macs) - start)
+                    last = min(rng["last_address"], first + wanted - 1)
+                    next_auto = last + 1
+                    if next_auto > rng["last_address"]:
+                        next_auto = -1
+                    db_api.mac_address_range_update(
+                        context, rng, next_auto_assign_mac=next_auto)
+
+                    block = [db_api.mac_address_create(
+                        context, address=address,
+                        mac_address_range_id=rng["id"])
+                        for address in xrange(first, last + 1)]
+            except Exception:
+                LOG.exception("Error in reserving mac block. MAC possibly"
+                              " duplicate, falling back to single MACs")
+                break
+            macs.extend(block)
+
+        for port_id in port_ids[len(macs) - start:]:
+            macs.append(self.allocate_mac_address(context, net_id, port_id,
+                                                  reuse_after))
+
     def attempt_to_reallocate_ip(self, context, net_id, port_id, reuse_after,
                                  version=None, ip_address=None,
                                  segment_id=None, subnets=None, **kwargs):
@@ -198,6 +518,11 @@ class QuarkIpam(object):
                     raise exceptions.IpAddressGenerationFailure(
                         net_id=net_id)
 
+        if not ip_address:
+            return self._claim_reusable_ips(context, net_id, 1, reuse_after,
+                                            version=version,
+                                            subnet_ids=sub_ids)
+
         ip_kwargs = {
             "network_id": net_id, "reuse_after": reuse_after,
             "deallocated": True, "scope": db_api.ONE,
@@ -212,8 +537,6 @@ class QuarkIpam(object):
         # we'll clean up multiple bad IPs if we find them (assuming something
         # is really wrong)
         for retry in xrange(cfg.CONF.QUARK.ip_address_retry_max):
-            get_policy = models.IPPolicy.get_ip_policy_cidrs
-
             try:
                 with context.session.begin():
                     # NOTE(mdietz): Before I removed the lazy=joined, this
@@ -226,20 +549,9 @@ class QuarkIpam(object):
                         #              also said that before :-/
                         subnet = address.get('subnet')
                         if subnet:
-                            policy = get_policy(subnet)
-
-                            cidr = netaddr.IPNetwork(address["subnet"]["cidr"])
-                            addr = netaddr.IPAddress(int(address["address"]))
-                            if address["subnet"]["ip_version"] == 4:
-                                addr = addr.ipv4()
-                            else:
-                                addr = addr.ipv6()
-
-                            if policy is not None and addr in policy:
-                                context.session.delete(address)
-                                continue
-
-                            if addr in cidr:
+                            if self._is_reusable(address):
+                                db_api.ip_address_reuse_claim(elevated,
+                                                              address["id"])
                                 updated_address = db_api.ip_address_update(
                                     elevated, address, deallocated=False,
                                     deallocated_at=None,
@@ -255,12 +567,73 @@ class QuarkIpam(object):
                 LOG.exception("Error in reallocate ip...")
         return []
 
+    def _claim_reusable_ips(self, context, net_id, count, reuse_after,
+                            version=None, subnet_ids=None):
+        """Claims up to count addresses off the network's reuse queue.
+
+        Candidates are the oldest count + ipam_reuse_window queued addresses
+        tried in random order, so concurrent workers rarely go for the same
+        row, and each claim is a primary key DELETE instead of a locked scan
+        of quark_ip_addresses.
+        """
+        if version and not isinstance(version, list):
+            version = [version]
+        elevated = context.elevated()
+        candidates = db_api.ip_address_reuse_find(
+            elevated, net_id, reuse_after, version=version,
+            subnet_id=subnet_ids,
+            limit=count + CONF.QUARK.ipam_reuse_window)
+        _reuse_random.shuffle(candidates)
+
+        claimed = []
+        for ip_address_id in candidates:
+            if len(claimed) >= count:
+                break
+            try:
+                with context.session.begin():
+                    if not db_api.ip_address_reuse_claim(elevated,
+                                                         ip_address_id):
+                        continue
+                    address = db_api.ip_address_find(
+                        elevated, id=ip_address_id, deallocated=True,
+                        lock_mode=True, scope=db_api.ONE)
+                    if not address or not address.get("subnet"):
+                        continue
+                    if not self._is_reusable(address):
+                        # NOTE: the policy changed after it was queued, make
+                        #       sure we never find it again
+                        context.session.delete(address)
+                        continue
+                    claimed.append(db_api.ip_address_update(
+                        elevated, address, deallocated=False,
+                        deallocated_at=None,
+                        used_by_tenant_id=context.tenant_id,
+                        allocated_at=timeutils.utcnow()))
+            except Exception:
+                LOG.exception("Error in reallocate ip...")
+        return claimed
+
+    def _is_reusable(self, address):
+        """Whether a deallocated address is still valid in its subnet."""
+        policy = models.IPPolicy.get_ip_policy_ranges(address["subnet"])
+
+        cidr = netaddr.IPNetwork(address["subnet"]["cidr"])
+        addr = netaddr.IPAddress(int(address["address"]))
+        if address["subnet"]["ip_version"] == 4:
+            addr = addr.ipv4()
+        else:
+            addr = addr.ipv6()
+
+        if policy is not None and addr in policy:
+            return False
+        return addr in cidr
+
     def is_strategy_satisfied(self, ip_addresses, allocate_complete=False):
         return ip_addresses
 
     def _allocate_from_subnet(self, context, net_id, subnet,
                               port_id, reuse_after, ip_address=None, **kwargs):
-        ip_policy_cidrs = models.IPPolicy.get_ip_policy_cidrs(subnet)
+        ip_policy_cidrs = models.IPPolicy.get_ip_policy_ranges(subnet)
         next_ip = ip_address
         if not next_ip:
             if subnet["next_auto_assign_ip"] != -1:
@@ -293,6 +666,51 @@ class QuarkIpam(object):
 
         return address
 
+    def _allocate_block_from_subnet(self, context, net_id, subnet, count):
+        """Allocates up to count new addresses from a v4 subnet.
+
+        Walks the subnet's next_auto_assign_ip cursor under a single row
+        lock and inserts the whole block in one transaction. Any conflict
+        fails the block as a whole.
+        """
+        ip_policy_cidrs = models.IPPolicy.get_ip_policy_ranges(subnet)
+        addresses = []
+        next_ip = None
+        try:
+            with context.session.begin():
+                subnet = db_api.subnet_find(context, id=subnet["id"],
+                                            scope=db_api.ONE, lock_mode=True)
+                if subnet["next_auto_assign_ip"] == -1:
+                    return addresses
+
+                # NOTE: select_subnet already moved the cursor one past the
+                #       address it reserved for us.
+                next_ip = max(subnet["next_auto_assign_ip"] - 1,
+                              subnet["first_ip"])
+                while len(addresses) < count and next_ip <= subnet["last_ip"]:
+                    ip = netaddr.IPAddress(next_ip).ipv4()
+                    next_ip += 1
+                    if ip_policy_cidrs is not None and ip in ip_policy_cidrs:
+                        continue
+                    address = db_api.ip_address_create(
+                        context, address=ip, subnet_id=subnet["id"],
+                        deallocated=0, version=subnet["ip_version"],
+                        network_id=net_id)
+                    address["deallocated"] = 0
+                    addresses.append(address)
+
+                if next_ip > subnet["last_ip"]:
+                    next_ip = -1
+                db_api.subnet_update(context, subnet,
+                                     next_auto_assign_ip=next_ip)
+        except Exception:
+            LOG.exception("Error in allocating block from subnet")
+            raise q_exc.IPAddressRetryableFailure(
+                ip_addr=netaddr.IPAddress(max(next_ip, 0)).ipv4(),
+                net_id=net_id)
+
+        return addresses
+
     def _allocate_from_v6_subnet(self, context, net_id, subnet,
                                  port_id, reuse_after, ip_address=None,
                                  **kwargs):
@@ -306,7 +724,10 @@ class QuarkIpam(object):
 
         This should provide a performance boost over attempting to check
         each and every subnet in the existing reallocate logic, as we'd
-        have to iterate over each and every subnet returned
+        have to iterate over each and every subnet returned.
+
+        All v6_allocation_attempts candidates are generated up front and
+        probed with a single query, then the first free one is claimed.
         """
 
         if not (ip_address is None and "mac_address" in kwargs and
@@ -315,50 +736,55 @@ class QuarkIpam(object):
                                               reuse_after, ip_address,
                                               **kwargs)
         else:
-            ip_policy_cidrs = models.IPPolicy.get_ip_policy_cidrs(subnet)
-            for tries, ip_address in enumerate(
-                generate_v6(kwargs["mac_address"]["address"], port_id,
-                            subnet["cidr"])):
-
-                if tries > CONF.QUARK.v6_allocation_attempts - 1:
-                    raise exceptions.IpAddressGenerationFailure(
-                        net_id=net_id)
-
-                ip_address = netaddr.IPAddress(ip_address)
-
-                # NOTE(mdietz): treating the IPSet as a boolean caused netaddr
-                #               to attempt to enumerate the entire set!
+            ip_policy_cidrs = models.IPPolicy.get_ip_policy_ranges(subnet)
+            candidates = []
+            for ip_address in itertools.islice(
+                    generate_v6(kwargs["mac_address"]["address"], port_id,
+                                subnet["cidr"]),
+                    CONF.QUARK.v6_allocation_attempts):
+                ip_address = netaddr.IPAddress(ip_address, version=6)
                 if (ip_policy_cidrs is not None and
                         ip_address in ip_policy_cidrs):
                     continue
+                if ip_address not in candidates:
+                    candidates.append(ip_address)
+
+            # NOTE: one round trip tells us which candidates already have a
+            #       row, so each remaining one costs exactly one INSERT or
+            #       one conditional UPDATE.
+            existing = db_api.ip_address_find_existing(
+                context, subnet["id"], candidates)
+
+            for ip_address in candidates:
+                found = existing.get(ip_address.value)
+                if found is None:
+                    # This triggers when the IP was allocated since the
+                    # probe above, most likely by another worker.
+                    try:
+                        with context.session.begin():
+                            return db_api.ip_address_create(
+                                context, address=ip_address,
+                                subnet_id=subnet["id"],
+                                version=subnet["ip_version"],
+                                network_id=net_id)
+                    except db_exception.DBDuplicateEntry:
+                        LOG.debug("Duplicate entry found when inserting "
+                                  "subnet_id %s ip_address %s",
+                                  subnet["id"], ip_address)
+                    continue
 
-                # TODO(mdietz): replace this with a compare-and-swap loop
+                ip_address_id, deallocated = found
+                if not deallocated:
+                    continue
                 with context.session.begin():
-                    address = db_api.ip_address_find(
-                        context, network_id=net_id, ip_address=ip_address,
-                        scope=db_api.ONE, reuse_after=reuse_after,
-                        deallocated=True, subnet_id=subnet["id"],
-                        lock_mode=True)
+                    if db_api.ip_address_reallocate(context, subnet["id"],
+                                                    ip_address_id,
+                                                    reuse_after):
+                        db_api.ip_address_reuse_claim(context, ip_address_id)
+                        return db_api.ip_address_find(
+                            context, id=ip_address_id, scope=db_api.ONE)
 
-                    if address:
-                        return db_api.ip_address_update(
-                            context, address, deallocated=False,
-                            deallocated_at=None,
-                            used_by_tenant_id=context.tenant_id,
-                            allocated_at=timeutils.utcnow())
-
-                # This triggers when the IP is allocated to another tenant,
-                # either because we missed it due to our filters above, or
-                # in an extremely unlikely race between the find and here.
-                try:
-                    with context.session.begin():
-                        return db_api.ip_address_create(
-                            context, address=ip_address,
-                            subnet_id=subnet["id"],
-                            version=subnet["ip_version"], network_id=net_id)
-                except db_exception.DBDuplicateEntry:
-                    LOG.debug("Duplicate entry found when inserting subnet_id"
-                              " %s ip_address %s", subnet["id"], ip_address)
+            raise exceptions.IpAddressGenerationFailure(net_id=net_id)
 
     def _allocate_ips_from_subnets(self, context, new_addresses, net_id,
                                    subnets, port_id, reuse_after,
@@ -381,6 +807,7 @@ class QuarkIpam(object):
                                                         ip_address, **kwargs)
             if address:
                 new_addresses.append(address)
+                SUBNET_AVAILABILITY.allocated(net_id, subnet["id"])
 
         return new_addresses
 
@@ -402,29 +829,33 @@ class QuarkIpam(object):
         if ip_address:
             ip_address = netaddr.IPAddress(ip_address)
 
-        new_addresses.extend(self.attempt_to_reallocate_ip(
-            context, net_id, port_id, reuse_after, version=None,
-            ip_address=ip_address, segment_id=segment_id, subnets=subnets,
-            **kwargs))
+        with metrics.timer("ipam.reallocate"):
+            new_addresses.extend(self.attempt_to_reallocate_ip(
+                context, net_id, port_id, reuse_after, version=None,
+                ip_address=ip_address, segment_id=segment_id,
+                subnets=subnets, **kwargs))
 
         if self.is_strategy_satisfied(new_addresses):
             return
 
         for retry in xrange(cfg.CONF.QUARK.ip_address_retry_max):
-            if not subnets:
-                subs = self._choose_available_subnet(
-                    elevated, net_id, version, segment_id=segment_id,
-                    ip_address=ip_address, reallocated_ips=new_addresses)
-            else:
-                subs = [self.select_subnet(context, net_id, ip_address,
-                                           segment_id, subnet_ids=subnets)]
+            with metrics.timer("ipam.select_subnet"):
+                if not subnets:
+                    subs = self._choose_available_subnet(
+                        elevated, net_id, version, segment_id=segment_id,
+                        ip_address=ip_address, reallocated_ips=new_addresses)
+                else:
+                    subs = [self.select_subnet(context, net_id, ip_address,
+                                               segment_id, subnet_ids=subnets)]
 
             try:
-                self._allocate_ips_from_subnets(context, new_addresses, net_id,
-                                                subs, port_id, reuse_after,
-                                                ip_address, **kwargs)
+                with metrics.timer("ipam.insert"):
+                    self._allocate_ips_from_subnets(
+                        context, new_addresses, net_id, subs, port_id,
+                        reuse_after, ip_address, **kwargs)
             except q_exc.IPAddressRetryableFailure:
                 LOG.exception("Error in allocating IP")
+                metrics.incr("ipam.retries")
                 continue
 
             break
@@ -435,8 +866,115 @@ class QuarkIpam(object):
 
         raise exceptions.IpAddressGenerationFailure(net_id=net_id)
 
+    def _bulk_versions(self):
+        """IP versions every port needs, None meaning any version."""
+        return [None]
+
+    def _reallocate_ips(self, context, net_id, count, reuse_after,
+                        version=None, segment_id=None):
+        """Claims up to count reusable addresses off the reuse queue."""
+        if not count:
+            return []
+        elevated = context.elevated()
+        sub_ids = None
+        if segment_id:
+            subnets = db_api.subnet_find(elevated, network_id=net_id,
+                                         segment_id=segment_id)
+            sub_ids = [s["id"] for s in subnets]
+            if not sub_ids:
+                return []
+
+        return self._claim_reusable_ips(context, net_id, count, reuse_after,
+                                        version=version or [4, 6],
+                                        subnet_ids=sub_ids)
+
+    def allocate_ip_addresses(self, context, allocated, net_id, port_ids,
+                              reuse_after, segment_id=None,
+                              mac_addresses=None):
+        """Allocates addresses for each of port_ids in as few passes as we can.
+
+        Each required version is satisfied first from reusable addresses in
+        a single query, then from new blocks carved out of one subnet at a
+        time. Ports left without any address fall back to
+        allocate_ip_address. Addresses are appended to allocated, a dict of
+        port id to address list, as soon as they exist.
+        """
+        mac_addresses = mac_addresses or {}
+        for port_id in port_ids:
+            allocated.setdefault(port_id, [])
+        new_addresses = []
+
+        for version in self._bulk_versions():
+            needy = [p for p in port_ids
+                     if not [a for a in allocated[p]
+                             if version in (None, a["version"])]]
+
+            # NOTE(mdietz): v6 reuse is deferred to the create path, as in
+            #               attempt_to_reallocate_ip
+            if version != 6:
+                with metrics.timer("ipam.reallocate"):
+                    reused = self._reallocate_ips(context, net_id,
+                                                  len(needy), reuse_after,
+                                                  version, segment_id)
+                for port_id, address in zip(needy, reused):
+                    allocated[port_id].append(address)
+                needy = needy[len(reused):]
+
+            for retry in xrange(cfg.CONF.QUARK.ip_address_retry_max):
+                if not needy:
+                    break
+
+                filters = {}
+                if version:
+                    filters["ip_version"] = version
+                with metrics.timer("ipam.select_subnet"):
+                    subnet = self.select_subnet(context, net_id, None,
+                                                segment_id, **filters)
+                if not subnet:
+                    break
+
+                block = []
+                try:
+                    with metrics.timer("ipam.insert"):
+                        if int(subnet["ip_version"]) == 4:
+                            block = self._allocate_block_from_subnet(
+                                context, net_id, subnet, len(needy))
+                        else:
+                            for port_id in needy:
+                                block.append(self._allocate_from_v6_subnet(
+                                    context, net_id, subnet, port_id,
+                                    reuse_after,
+                                    mac_address=mac_addresses.get(port_id)))
+                except (q_exc.IPAddressRetryableFailure,
+                        exceptions.IpAddressGenerationFailure):
+                    LOG.exception("Error in allocating IP block")
+                    metrics.incr("ipam.retries")
+
+                for port_id, address in zip(needy, block):
+                    allocated[port_id].append(address)
+                new_addresses.extend(block)
+                SUBNET_AVAILABILITY.allocated(net_id, subnet["id"],
+                                              len(block))
+                needy = needy[len(block):]
+
+        self._notify_new_addresses(context, new_addresses)
+
+        for port_id in port_ids:
+            if not allocated[port_id]:
+                self.allocate_ip_address(
+                    context, allocated[port_id], net_id, port_id,
+                    reuse_after, segment_id=segment_id,
+                    mac_address=mac_addresses.get(port_id))
+            elif not self.is_strategy_satisfied(allocated[port_id],
+                                                allocate_complete=True):
+                raise exceptions.IpAddressGenerationFailure(net_id=net_id)
+
     def deallocate_ip_address(self, context, address):
         address["deallocated"] = 1
+        # NOTE: addresses the subnet's policy excludes are never reused, so
+        #       this is the one place they get filtered out.
+        if address.get("subnet") and self._is_reusable(address):
+            db_api.ip_address_reuse_enqueue(context, address)
         payload = dict(used_by_tenant_id=address["used_by_tenant_id"],
                        ip_block_id=address["subnet_id"],
                        ip_address=address["address_readable"],
@@ -478,6 +1016,23 @@ class QuarkIpam(object):
     # - fix off-by-one error and overflow
     def select_subnet(self, context, net_id, ip_address, segment_id,
                       subnet_ids=None, **filters):
+        if not ip_address:
+            available = SUBNET_AVAILABILITY.available(
+                context, net_id, ip_version=filters.get("ip_version"),
+                segment_id=segment_id, subnet_ids=subnet_ids)
+            if available == []:
+                # NOTE: the summary may predate a subnet being added or
+                #       freed by another worker, so reload it once before
+                #       reporting the network full
+                SUBNET_AVAILABILITY.invalidate(net_id)
+                available = SUBNET_AVAILABILITY.available(
+                    context, net_id, ip_version=filters.get("ip_version"),
+                    segment_id=segment_id, subnet_ids=subnet_ids)
+            if available is not None:
+                if not available:
+                    return None
+                subnet_ids = available
+
         subnets = db_api.subnet_find_allocation_counts(
             context, net_id, segment_id=segment_id, scope=db_api.ALL,
             subnet_id=subnet_ids, **filters)
@@ -508,10 +1063,14 @@ class QuarkIpam(object):
                     # -1 to be safe
                     if ip < subnet["first_ip"] or ip > subnet["last_ip"]:
                         ip = -1
+                        SUBNET_AVAILABILITY.exhausted(net_id, subnet["id"])
                     db_api.subnet_update(context, subnet,
                                          next_auto_assign_ip=ip)
                 return subnet
 
+            if not ip_address:
+                SUBNET_AVAILABILITY.exhausted(net_id, subnet["id"])
+
 
 class QuarkIpamANY(QuarkIpam):
     @classmethod
@@ -536,6 +1095,9 @@ class QuarkIpamBOTH(QuarkIpam):
     def get_name(self):
         return "BOTH"
 
+    def _bulk_versions(self):
+        return [4, 6]
+
     def is_strategy_satisfied(self, reallocated_ips, allocate_complete=False):
         req = [4, 6]
         for ip in reallocated_ips:
@@ -610,12 +1172,282 @@ class QuarkIpamBOTHREQ(QuarkIpamBOTH):
         return subnets
 
 
+class QuarkIpamANYFreeRange(QuarkIpamANY):
+    """ANY strategy handing out v4 addresses from cached free ranges.
+
+    Each worker keeps a FreeRanges per v4 subnet, built lazily from the
+    addresses already generated in quark_ip_addresses minus the subnet's
+    IP policy. Allocating locks only the chosen subnet row, confirms the
+    cached candidate is still unused and inserts it, so there is no
+    aggregate over every subnet and no collide-and-retry loop. Explicit
+    addresses and v6 subnets take the regular QuarkIpam paths.
+    """
+    def __init__(self):
+        super(QuarkIpamANYFreeRange, self).__init__()
+        # NOTE: subnet_id -> (subnet_key, FreeRanges)
+        self._free_ranges = {}
+
+    @classmethod
+    def get_name(self):
+        return "ANY_FREE_RANGE"
+
+    def _subnet_key(self, subnet):
+        ip_policy = subnet["ip_policy"] or {}
+        policy_cidrs = sorted(ip_policy_cidr["cidr"] for ip_policy_cidr
+                              in ip_policy.get("exclude", []))
+        return (subnet["first_ip"], subnet["last_ip"], tuple(policy_cidrs))
+
+    def _get_free_ranges(self, context, subnets, rebuild=False):
+        stale = []
+        for subnet in subnets:
+            cached = self._free_ranges.get(subnet["id"])
+            if (rebuild or not cached or
+                    cached[0] != self._subnet_key(subnet)):
+                stale.append(subnet)
+
+        if stale:
+            generated = dict((subnet["id"], []) for subnet in stale)
+            for subnet_id, address in db_api.ip_address_find_generated(
+                    context, generated.keys()):
+                generated[subnet_id].append((address, address))
+
+            for subnet in stale:
+                excluded = generated[subnet["id"]]
+                policy = models.IPPolicy.get_ip_policy_ranges(subnet)
+                excluded.extend(policy.ranges())
+                free = ip_ranges.FreeRanges(subnet["first_ip"],
+                                            subnet["last_ip"], excluded)
+                self._free_ranges[subnet["id"]] = (self._subnet_key(subnet),
+                                                   free)
+
+        return dict((subnet["id"], self._free_ranges[subnet["id"]][1])
+                    for subnet in subnets)
+
+    def select_subnet(self, context, net_id, ip_address, segment_id,
+                      subnet_ids=None, **filters):
+        if ip_address or filters.get("ip_version") == 6:
+            return super(QuarkIpamANYFreeRange, self).select_subnet(
+                context, net_id, ip_address, segment_id,
+                subnet_ids=subnet_ids, **filters)
+
+        subnets = db_api.subnet_find_allocatable(
+            context, net_id, segment_id=segment_id, subnet_id=subnet_ids,
+            **filters)
+        v4_subnets = [s for s in subnets if int(s["ip_version"]) == 4]
+        free_ranges = self._get_free_ranges(context, v4_subnets)
+
+        # NOTE: Same preference as the counting query, most full
+        #       first, just without touching every row to get it.
+        candidates = [s for s in v4_subnets if free_ranges[s["id"]]]
+        if candidates:
+            return min(candidates, key=lambda s: len(free_ranges[s["id"]]))
+
+        if "ip_version" not in filters and len(v4_subnets) < len(subnets):
+            filters["ip_version"] = 6
+            return super(QuarkIpamANYFreeRange, self).select_subnet(
+                context, net_id, ip_address, segment_id,
+                subnet_ids=subnet_ids, **filters)
+
+    def _allocate_from_subnet(self, context, net_id, subnet,
+                              port_id, reuse_after, ip_address=None, **kwargs):
+        if ip_address:
+            address = super(QuarkIpamANYFreeRange, self)._allocate_from_subnet(
+                context, net_id, subnet, port_id, reuse_after, ip_address,
+                **kwargs)
+            cached = self._free_ranges.get(subnet["id"])
+            if cached:
+                cached[1].discard(address["address"])
+            return address
+
+        subnet_id = subnet["id"]
+        next_ip = None
+        address = None
+        try:
+            with context.session.begin():
+                subnet = db_api.subnet_find(context, id=subnet_id,
+                                            scope=db_api.ONE, lock_mode=True)
+                fresh = subnet_id not in self._free_ranges
+                free = self._get_free_ranges(context, [subnet])[subnet_id]
+                next_ip = free.pop()
+
+                # NOTE: Another worker may have allocated from this
+                #       subnet since we built our ranges. We hold
+                #       the subnet lock, so rebuilding here yields
+                #       an exact answer and we never need to retry.
+                if not fresh and (next_ip is None or db_api.ip_address_find(
+                        context, subnet_id=subnet_id, address=next_ip,
+                        scope=db_api.ONE)):
+                    free = self._get_free_ranges(context, [subnet],
+                                                 rebuild=True)[subnet_id]
+                    next_ip = free.pop()
+
+                if not free:
+                    db_api.subnet_update(context, subnet,
+                                         next_auto_assign_ip=-1)
+                if next_ip is not None:
+                    address = db_api.ip_address_create(
+                        context, address=netaddr.IPAddress(next_ip).ipv4(),
+                        subnet_id=subnet_id, deallocated=0,
+                        version=subnet["ip_version"], network_id=net_id)
+                    address["deallocated"] = 0
+        except Exception:
+            # NOTE: Only a writer that doesn't take the subnet lock
+            #       can get here, so forget what we know about the
+            #       subnet and let the caller pick again.
+            LOG.exception("Error allocating from subnet %s" % subnet_id)
+            self._free_ranges.pop(subnet_id, None)
+            raise q_exc.IPAddressRetryableFailure(
+                ip_addr=netaddr.IPAddress(next_ip or 0).ipv4(), net_id=net_id)
+
+        if address is None:
+            # NOTE: The subnet is exhausted and now marked as such,
+            #       so the next pass won't select it.
+            raise q_exc.IPAddressRetryableFailure(
+                ip_addr=netaddr.IPAddress(subnet["last_ip"]).ipv4(),
+                net_id=net_id)
+        return address
+
+    def _allocate_block_from_subnet(self, context, net_id, subnet, count):
+        subnet_id, first_ip = subnet["id"], subnet["first_ip"]
+        addresses = []
+        try:
+            with context.session.begin():
+                subnet = db_api.subnet_find(context, id=subnet_id,
+                                            scope=db_api.ONE, lock_mode=True)
+                # NOTE: One exact rebuild under the lock is cheap next to a
+                #       batch of inserts, and spares a check per address.
+                free = self._get_free_ranges(context, [subnet],
+                                             rebuild=True)[subnet_id]
+                while free and len(addresses) < count:
+                    address = db_api.ip_address_create(
+                        context, address=netaddr.IPAddress(free.pop()).ipv4(),
+                        subnet_id=subnet_id, deallocated=0,
+                        version=subnet["ip_version"], network_id=net_id)
+                    address["deallocated"] = 0
+                    addresses.append(address)
+                if not free:
+                    db_api.subnet_update(context, subnet,
+                                         next_auto_assign_ip=-1)
+        except Exception:
+            LOG.exception("Error allocating block from subnet %s" % subnet_id)
+            self._free_ranges.pop(subnet_id, None)
+            raise q_exc.IPAddressRetryableFailure(
+                ip_addr=netaddr.IPAddress(first_ip).ipv4(), net_id=net_id)
+        return addresses
+
+
+class QuarkIpamANYOptimistic(QuarkIpamANY):
+    """ANY strategy that never holds a subnet row lock across statements.
+
+    New addresses are claimed by moving next_auto_assign_ip with a
+    compare-and-swap UPDATE and then inserting them, each in a transaction
+    of its own. Losing the swap to another worker just means reading the
+    cursor again, and an address that turns out to be taken is caught by
+    the subnet_id_address unique constraint and skipped.
+    """
+    @classmethod
+    def get_name(self):
+        return "ANY_OPTIMISTIC"
+
+    def select_subnet(self, context, net_id, ip_address, segment_id,
+                      subnet_ids=None, **filters):
+        if ip_address:
+            return super(QuarkIpamANYOptimistic, self).select_subnet(
+                context, net_id, ip_address, segment_id,
+                subnet_ids=subnet_ids, **filters)
+
+        subnets = db_api.subnet_find_allocatable(
+            context, net_id, segment_id=segment_id, subnet_id=subnet_ids,
+            **filters)
+
+        # NOTE: Same preference as the counting query, most full first,
+        #       but the cursor is left for _allocate_block_from_subnet.
+        for subnet in sorted(subnets, key=lambda s: s["generated_count"],
+                             reverse=True):
+            ip_policy = subnet.get("ip_policy")
+            policy_size = ip_policy["size"] if ip_policy else 0
+            ipnet = netaddr.IPNetwork(subnet["cidr"])
+            if ipnet.size > (subnet["generated_count"] + policy_size - 1):
+                return subnet
+
+    def _allocate_from_subnet(self, context, net_id, subnet,
+                              port_id, reuse_after, ip_address=None, **kwargs):
+        if ip_address:
+            return super(QuarkIpamANYOptimistic, self)._allocate_from_subnet(
+                context, net_id, subnet, port_id, reuse_after, ip_address,
+                **kwargs)
+
+        addresses = self._allocate_block_from_subnet(context, net_id,
+                                                     subnet, 1)
+        if not addresses:
+            raise q_exc.IPAddressRetryableFailure(
+                ip_addr=netaddr.IPAddress(subnet["last_ip"]), net_id=net_id)
+        return addresses[0]
+
+    def _allocate_block_from_subnet(self, context, net_id, subnet, count):
+        subnet_id = subnet["id"]
+        first_ip, last_ip = subnet["first_ip"], subnet["last_ip"]
+        ip_policy_cidrs = models.IPPolicy.get_ip_policy_ranges(subnet)
+        current = subnet["next_auto_assign_ip"]
+        addresses = []
+
+        for retry in xrange(CONF.QUARK.ip_address_retry_max):
+            if len(addresses) >= count:
+                break
+            if current is None or current < first_ip or current > last_ip:
+                if current != -1:
+                    with context.session.begin():
+                        db_api.subnet_advance_next_auto_assign_ip(
+                            context, subnet_id, current, -1)
+                break
+
+            following = current + count - len(addresses)
+            if following > last_ip:
+                following = -1
+            with context.session.begin():
+                advanced = db_api.subnet_advance_next_auto_assign_ip(
+                    context, subnet_id, current, following)
+            if not advanced:
+                current = db_api.subnet_find_next_auto_assign_ip(context,
+                                                                 subnet_id)
+                continue
+
+            end = last_ip if following == -1 else following - 1
+            while current <= end:
+                ip = netaddr.IPAddress(current)
+                if subnet["ip_version"] == 4:
+                    ip = ip.ipv4()
+                current += 1
+                if ip_policy_cidrs is not None and ip in ip_policy_cidrs:
+                    continue
+                try:
+                    with context.session.begin():
+                        address = db_api.ip_address_create(
+                            context, address=ip, subnet_id=subnet_id,
+                            deallocated=0, version=subnet["ip_version"],
+                            network_id=net_id)
+                        address["deallocated"] = 0
+                except Exception:
+                    # NOTE: as in QuarkIpam._allocate_from_subnet, a
+                    #       conflict doesn't reliably surface as
+                    #       DBDuplicateEntry.
+                    LOG.debug("Address %s in subnet %s is already taken",
+                              ip, subnet_id)
+                    continue
+                addresses.append(address)
+            current = following
+
+        return addresses
+
+
 class IpamRegistry(object):
     def __init__(self):
         self.strategies = {
             QuarkIpamANY.get_name(): QuarkIpamANY(),
             QuarkIpamBOTH.get_name(): QuarkIpamBOTH(),
-            QuarkIpamBOTHREQ.get_name(): QuarkIpamBOTHREQ()}
+            QuarkIpamBOTHREQ.get_name(): QuarkIpamBOTHREQ(),
+            QuarkIpamANYFreeRange.get_name(): QuarkIpamANYFreeRange(),
+            QuarkIpamANYOptimistic.get_name(): QuarkIpamANYOptimistic()}
 
     def is_valid_strategy(self, strategy_name):
         if strategy_name in self.strategies:
@@ -0,0 +1,289 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-process timers and counters, pushed to statsd or served as /metrics
+
+Timings are aggregated per worker into a count, a total and a maximum, so
+recording one costs a lock and a few additions. They're read back either
+by quark.api.metrics.MetricsMiddleware, in Prometheus' text format, or
+pushed as deltas to statsd every metrics_statsd_interval seconds.
+"""
+
+import contextlib
+import socket
+import threading
+import time
+
+from neutron.openstack.common import log as logging
+from oslo.config import cfg
+from sqlalchemy.engine import Engine
+from sqlalchemy import event
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+quark_opts = [
+    cfg.BoolOpt("metrics_enabled",
+                default=False,
+                help=_("Time plugin calls, IPAM phases, driver calls and"
+                       " database statements.")),
+    cfg.StrOpt("metrics_prefix",
+               default="quark",
+               help=_("Prefix of every metric name.")),
+    cfg.StrOpt("metrics_statsd_host",
+               help=_("statsd host metrics are pushed to. Unset, they're"
+                      " only served by the metrics middleware.")),
+    cfg.IntOpt("metrics_statsd_port",
+               default=8125,
+               help=_("statsd port metrics are pushed to.")),
+    cfg.IntOpt("metrics_statsd_interval",
+               default=10,
+               help=_("Seconds between pushes to statsd."))
+]
+
+CONF.register_opts(quark_opts, "QUARK")
+
+# NOTE: 2.7 has no monotonic clock in the standard library, so elapsed
+#       times are clamped at 0 in case the wall clock steps back
+_clock = getattr(time, "monotonic", time.time)
+
+# NOTE: keeps statsd packets under a typical MTU
+_STATSD_PACKET_SIZE = 1400
+
+
+def enabled():
+    return CONF.QUARK.metrics_enabled
+
+
+class Registry(object):
+    """Thread safe counters, timers and gauges for one worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        # NOTE: name -> [count, total seconds, max seconds]
+        self._timers = {}
+        self._gauges = {}
+        self._pushed = {}
+        self._pushed_at = _clock()
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        seconds = max(seconds, 0)
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                self._timers[name] = [1, seconds, seconds]
+                return
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+    def gauge(self, name, fn):
+        """Registers fn to be called for name's value when it's read."""
+        self._gauges[name] = fn
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+            self._pushed.clear()
+
+    def snapshot(self):
+        """Returns (counters, timers, gauges) as they are now."""
+        with self._lock:
+            counters = dict(self._counters)
+            timers = dict((name, tuple(timer))
+                          for name, timer in self._timers.items())
+        gauges = {}
+        for name, fn in self._gauges.items():
+            try:
+                gauges[name] = fn()
+            except Exception:
+                LOG.exception("Error reading gauge %s" % name)
+        return counters, timers, gauges
+
+    def render(self, prefix):
+        """Returns every metric in Prometheus' text exposition format."""
+        counters, timers, gauges = self.snapshot()
+        lines = []
+        for name, value in sorted(counters.items()):
+            name = _prometheus_name(prefix, name) + "_total"
+            lines.append("# TYPE %s counter" % name)
+            lines.append("%s %s" % (name, value))
+        for name, (count, total, longest) in sorted(timers.items()):
+            name = _prometheus_name(prefix, name) + "_seconds"
+            lines.append("# TYPE %s summary" % name)
+            lines.append("%s_count %s" % (name, count))
+            lines.append("%s_sum %.6f" % (name, total))
+            lines.append("# TYPE %s_max gauge" % name)
+            lines.append("%s_max %.6f" % (name, longest))
+        for name, value in sorted(gauges.items()):
+            name = _prometheus_name(prefix, name)
+            lines.append("# TYPE %s gauge" % name)
+            lines.append("%s %s" % (name, value))
+        return "\n".join(lines) + "\n"
+
+    def statsd_lines(self, prefix):
+        """Returns what changed since the last call as statsd lines.
+
+        Counters and timer counts and totals go out as counter deltas, so
+        statsd can sum them across workers. Maxima and gauges go out as
+        gauges.
+        """
+        counters, timers, gauges = self.snapshot()
+        current = dict(counters)
+        for name, (count, total, longest) in timers.items():
+            current[name + ".count"] = count
+            current[name + ".total_ms"] = total * 1000
+        with self._lock:
+            pushed, self._pushed = self._pushed, current
+
+        lines = []
+        for name, value in sorted(current.items()):
+            delta = value - pushed.get(name, 0)
+            if delta:
+                lines.append("%s.%s:%s|c" % (prefix, name, _number(delta)))
+        for name, (count, total, longest) in sorted(timers.items()):
+            lines.append("%s.%s.max_ms:%s|g" % (prefix, name,
+                                                _number(longest * 1000)))
+        for name, value in sorted(gauges.items()):
+            lines.append("%s.%s:%s|g" % (prefix, name, _number(value)))
+        return lines
+
+    def maybe_push(self):
+        """Pushes to statsd if it's configured and the interval is up."""
+        host = CONF.QUARK.metrics_statsd_host
+        if not host or not enabled():
+            return
+        now = _clock()
+        with self._lock:
+            if now - self._pushed_at < CONF.QUARK.metrics_statsd_interval:
+                return
+            self._pushed_at = now
+        lines = self.statsd_lines(CONF.QUARK.metrics_prefix)
+        try:
+            _send(host, CONF.QUARK.metrics_statsd_port, lines)
+        except Exception:
+            LOG.exception("Error pushing metrics to statsd at %s" % host)
+
+
+def _prometheus_name(prefix, name):
+    return ("%s_%s" % (prefix, name)).replace(".", "_").replace("-", "_")
+
+
+def _number(value):
+    if isinstance(value, float):
+        return "%.3f" % value
+    return str(value)
+
+
+def _send(host, port, lines):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        packet = []
+        size = 0
+        for line in lines:
+            if packet and size + len(line) + 1 > _STATSD_PACKET_SIZE:
+                sock.sendto("\n".join(packet), (host, port))
+                packet, size = [], 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            sock.sendto("\n".join(packet), (host, port))
+    finally:
+        sock.close()
+
+
+REGISTRY = Registry()
+
+
+def incr(name, amount=1):
+    if enabled():
+        REGISTRY.incr(name, amount)
+
+
+@contextlib.contextmanager
+def timer(name):
+    """Times the block as name, counting name.errors if it raises."""
+    if not enabled():
+        yield
+        return
+    began = _clock()
+    try:
+        yield
+    except Exception:
+        REGISTRY.incr(name + ".errors")
+        raise
+    finally:
+        REGISTRY.observe(name, _clock() - began)
+
+
+def timed(name):
+    def _inner(fn):
+        def _wrapped(*args, **kwargs):
+            with timer(name):
+                return fn(*args, **kwargs)
+        return _wrapped
+    return _inner
+
+
+def maybe_push():
+    REGISTRY.maybe_push()
+
+
+class TimedDriver(object):
+    """Times the network driver calls made through it.
+
+    Attributes are looked up on the driver at call time, so patching the
+    driver's class still takes effect.
+    """
+
+    CALLS = ("create_network", "delete_network", "diag_network",
+             "create_port", "update_port", "delete_port", "delete_ports",
+             "diag_port",
+             "create_security_group", "delete_security_group",
+             "update_security_group", "create_security_group_rule",
+             "delete_security_group_rule")
+
+    def __init__(self, driver):
+        self._driver = driver
+
+    def __getattr__(self, name):
+        attr = getattr(self._driver, name)
+        if name not in self.CALLS or not enabled():
+            return attr
+        return timed("driver.%s.%s" % (self._driver.get_name(), name))(attr)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if enabled():
+        conn.info["quark_metrics_began"] = _clock()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    began = conn.info.pop("quark_metrics_began", None)
+    if began is not None:
+        REGISTRY.observe("db.statement", _clock() - began)
+
+event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
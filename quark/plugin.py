@@ -16,6 +16,9 @@
 """
 v2 Neutron Plug-in API Quark Implementation
 """
+import contextlib
+import types
+
 from neutron.extensions import securitygroup as sg_ext
 from neutron import neutron_plugin_base_v2
 from neutron.openstack.common import log as logging
@@ -23,6 +26,10 @@ from neutron import quota
 from oslo.config import cfg
 
 from quark.api import extensions
+from quark.db import api as db_api
+from quark.db import audit
+from quark.db import replica
+from quark import metrics
 from quark.plugin_modules import ip_addresses
 from quark.plugin_modules import ip_policies
 from quark.plugin_modules import mac_address_ranges
@@ -31,6 +38,8 @@ from quark.plugin_modules import ports
 from quark.plugin_modules import routes
 from quark.plugin_modules import security_groups
 from quark.plugin_modules import subnets
+from quark import profiling
+from quark import utils
 
 LOG = logging.getLogger(__name__)
 
@@ -72,18 +81,73 @@ CONF.register_opts(quark_quota_opts, "QUOTAS")
 quota.QUOTAS.register_resources(quark_resources)
 
 
+@contextlib.contextmanager
+def _instrumented(name, context):
+    with metrics.timer("plugin.%s" % name):
+        with profiling.profile(name, context):
+            with audit.audited(name):
+                yield
+
+
 def sessioned(func):
     def _wrapped(self, context, *args, **kwargs):
-        res = func(self, context, *args, **kwargs)
-        context.session.close()
+        try:
+            with _instrumented(func.__name__, context):
+                return func(self, context, *args, **kwargs)
+        finally:
+            db_api.find_cache_clear(context)
+            context.session.close()
+
+            # NOTE(mdietz): Forces neutron to get a fresh session
+            #              if it needs it after our call
+            context._session = None
+            # NOTE: a call that fails part way may still have committed
+            #       some of its writes
+            replica.RECENT_WRITERS.wrote(context.tenant_id)
+            metrics.maybe_push()
+    return _wrapped
 
-        # NOTE(mdietz): Forces neutron to get a fresh session
-        #              if it needs it after our call
-        context._session = None
+
+def read_sessioned(func):
+    """Like sessioned, for calls that only read.
+
+    They're given a session on the read replica when there is one, unless
+    the tenant wrote within QUARK.read_after_write_window. A generator they
+    return, like an unlimited listing, keeps that session until the caller
+    has read it to the end.
+    """
+    def _wrapped(self, context, *args, **kwargs):
+        session = replica.get_session(context)
+        if session is not None:
+            context._session = session
+        reads = _read(func, self, context, *args, **kwargs)
+        res = next(reads)
+        if isinstance(res, types.GeneratorType):
+            return reads
+        # NOTE: run the rest of _read rather than close it, or the
+        #       instrumentation would see GeneratorExit instead of a return
+        for _ in reads:
+            pass
         return res
     return _wrapped
 
 
+def _read(func, self, context, *args, **kwargs):
+    """Yields a read_sessioned call's result, then its items if it streams."""
+    try:
+        with _instrumented(func.__name__, context):
+            res = func(self, context, *args, **kwargs)
+            yield res
+            if isinstance(res, types.GeneratorType):
+                for item in res:
+                    yield item
+    finally:
+        db_api.find_cache_clear(context)
+        context.session.close()
+        context._session = None
+        metrics.maybe_push()
+
+
 class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
              sg_ext.SecurityGroupPluginBase):
     supported_extension_aliases = ["mac_address_ranges", "routes",
@@ -92,6 +156,9 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
                                    "subnets_quark", "provider",
                                    "ip_policies", "quotas",
                                    "networks_quark", "router"]
+    __native_bulk_support = True
+    __native_pagination_support = True
+    __native_sorting_support = True
 
     def __init__(self):
         LOG.info("Starting quark plugin")
@@ -105,11 +172,34 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         if context.tenant_id is None:
             context.tenant_id = resource["tenant_id"]
 
-    @sessioned
+    def _create_bulk(self, context, resource, body, create, delete):
+        """Creates each resource in body, deleting them all if one fails.
+
+        Native bulk support is declared for the whole plugin, so Neutron
+        sends every bulk create here, not just ports. Resources without a
+        batched path of their own are created one at a time, as Neutron's
+        emulated bulk create would.
+        """
+        created = []
+        cmd_mgr = utils.CommandManager()
+
+        def _delete_created(obj):
+            if obj:
+                delete(context, obj["id"])
+
+        with cmd_mgr.execute():
+            for item in body[resource + "s"]:
+                self._fix_missing_tenant_id(context, item[resource])
+                do = cmd_mgr.do(create)
+                cmd_mgr.undo(_delete_created)
+                created.append(do(context, item))
+        return created
+
+    @read_sessioned
     def get_mac_address_range(self, context, id, fields=None):
         return mac_address_ranges.get_mac_address_range(context, id, fields)
 
-    @sessioned
+    @read_sessioned
     def get_mac_address_ranges(self, context):
         return mac_address_ranges.get_mac_address_ranges(context)
 
@@ -127,6 +217,12 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         self._fix_missing_tenant_id(context, security_group["security_group"])
         return security_groups.create_security_group(context, security_group)
 
+    @sessioned
+    def create_security_group_bulk(self, context, security_group):
+        return self._create_bulk(context, "security_group", security_group,
+                                 security_groups.create_security_group,
+                                 security_groups.delete_security_group)
+
     @sessioned
     def create_security_group_rule(self, context, security_group_rule):
         self._fix_missing_tenant_id(context,
@@ -134,6 +230,13 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return security_groups.create_security_group_rule(context,
                                                           security_group_rule)
 
+    @sessioned
+    def create_security_group_rule_bulk(self, context, security_group_rule):
+        return self._create_bulk(context, "security_group_rule",
+                                 security_group_rule,
+                                 security_groups.create_security_group_rule,
+                                 security_groups.delete_security_group_rule)
+
     @sessioned
     def delete_security_group(self, context, id):
         security_groups.delete_security_group(context, id)
@@ -142,15 +245,15 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def delete_security_group_rule(self, context, id):
         security_groups.delete_security_group_rule(context, id)
 
-    @sessioned
+    @read_sessioned
     def get_security_group(self, context, id, fields=None):
         return security_groups.get_security_group(context, id, fields)
 
-    @sessioned
+    @read_sessioned
     def get_security_group_rule(self, context, id, fields=None):
         return security_groups.get_security_group_rule(context, id, fields)
 
-    @sessioned
+    @read_sessioned
     def get_security_groups(self, context, filters=None, fields=None,
                             sorts=None, limit=None, marker=None,
                             page_reverse=False):
@@ -158,7 +261,7 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
                                                    sorts, limit, marker,
                                                    page_reverse)
 
-    @sessioned
+    @read_sessioned
     def get_security_group_rules(self, context, filters=None, fields=None,
                                  sorts=None, limit=None, marker=None,
                                  page_reverse=False):
@@ -176,11 +279,11 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         self._fix_missing_tenant_id(context, ip_policy["ip_policy"])
         return ip_policies.create_ip_policy(context, ip_policy)
 
-    @sessioned
+    @read_sessioned
     def get_ip_policy(self, context, id):
         return ip_policies.get_ip_policy(context, id)
 
-    @sessioned
+    @read_sessioned
     def get_ip_policies(self, context, **filters):
         return ip_policies.get_ip_policies(context, **filters)
 
@@ -192,11 +295,11 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def delete_ip_policy(self, context, id):
         return ip_policies.delete_ip_policy(context, id)
 
-    @sessioned
+    @read_sessioned
     def get_ip_addresses(self, context, **filters):
         return ip_addresses.get_ip_addresses(context, **filters)
 
-    @sessioned
+    @read_sessioned
     def get_ip_address(self, context, id):
         return ip_addresses.get_ip_address(context, id)
 
@@ -214,11 +317,17 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         self._fix_missing_tenant_id(context, port["port"])
         return ports.create_port(context, port)
 
+    @sessioned
+    def create_port_bulk(self, context, ports_body):
+        for port in ports_body["ports"]:
+            self._fix_missing_tenant_id(context, port["port"])
+        return ports.create_ports(context, ports_body)
+
     @sessioned
     def post_update_port(self, context, id, port):
         return ports.post_update_port(context, id, port)
 
-    @sessioned
+    @read_sessioned
     def get_port(self, context, id, fields=None):
         return ports.get_port(context, id, fields)
 
@@ -226,11 +335,13 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def update_port(self, context, id, port):
         return ports.update_port(context, id, port)
 
-    @sessioned
-    def get_ports(self, context, filters=None, fields=None):
-        return ports.get_ports(context, filters, fields)
+    @read_sessioned
+    def get_ports(self, context, filters=None, fields=None, sorts=None,
+                  limit=None, marker=None, page_reverse=False):
+        return ports.get_ports(context, filters, fields, sorts, limit,
+                               marker, page_reverse)
 
-    @sessioned
+    @read_sessioned
     def get_ports_count(self, context, filters=None):
         return ports.get_ports_count(context, filters)
 
@@ -242,15 +353,15 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def disassociate_port(self, context, id, ip_address_id):
         return ports.disassociate_port(context, id, ip_address_id)
 
-    @sessioned
+    @read_sessioned
     def diagnose_port(self, context, id, fields):
         return ports.diagnose_port(context, id, fields)
 
-    @sessioned
+    @read_sessioned
     def get_route(self, context, id):
         return routes.get_route(context, id)
 
-    @sessioned
+    @read_sessioned
     def get_routes(self, context):
         return routes.get_routes(context)
 
@@ -268,19 +379,26 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         self._fix_missing_tenant_id(context, subnet["subnet"])
         return subnets.create_subnet(context, subnet)
 
+    @sessioned
+    def create_subnet_bulk(self, context, subnet):
+        return self._create_bulk(context, "subnet", subnet,
+                                 subnets.create_subnet, subnets.delete_subnet)
+
     @sessioned
     def update_subnet(self, context, id, subnet):
         return subnets.update_subnet(context, id, subnet)
 
-    @sessioned
+    @read_sessioned
     def get_subnet(self, context, id, fields=None):
         return subnets.get_subnet(context, id, fields)
 
-    @sessioned
-    def get_subnets(self, context, filters=None, fields=None):
-        return subnets.get_subnets(context, filters, fields)
+    @read_sessioned
+    def get_subnets(self, context, filters=None, fields=None, sorts=None,
+                    limit=None, marker=None, page_reverse=False):
+        return subnets.get_subnets(context, filters, fields, sorts, limit,
+                                   marker, page_reverse)
 
-    @sessioned
+    @read_sessioned
     def get_subnets_count(self, context, filters=None):
         return subnets.get_subnets_count(context, filters)
 
@@ -288,7 +406,7 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def delete_subnet(self, context, id):
         return subnets.delete_subnet(context, id)
 
-    @sessioned
+    @read_sessioned
     def diagnose_subnet(self, context, id, fields):
         return subnets.diagnose_subnet(context, id, fields)
 
@@ -297,19 +415,27 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         self._fix_missing_tenant_id(context, network["network"])
         return networks.create_network(context, network)
 
+    @sessioned
+    def create_network_bulk(self, context, network):
+        return self._create_bulk(context, "network", network,
+                                 networks.create_network,
+                                 networks.delete_network)
+
     @sessioned
     def update_network(self, context, id, network):
         return networks.update_network(context, id, network)
 
-    @sessioned
+    @read_sessioned
     def get_network(self, context, id, fields=None):
         return networks.get_network(context, id, fields)
 
-    @sessioned
-    def get_networks(self, context, filters=None, fields=None):
-        return networks.get_networks(context, filters, fields)
+    @read_sessioned
+    def get_networks(self, context, filters=None, fields=None, sorts=None,
+                     limit=None, marker=None, page_reverse=False):
+        return networks.get_networks(context, filters, fields, sorts, limit,
+                                     marker, page_reverse)
 
-    @sessioned
+    @read_sessioned
     def get_networks_count(self, context, filters=None):
         return networks.get_networks_count(context, filters)
 
@@ -317,7 +443,7 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def delete_network(self, context, id):
         return networks.delete_network(context, id)
 
-    @sessioned
+    @read_sessioned
     def diagnose_network(self, context, id, fields):
         return networks.diagnose_network(context, id, fields)
 
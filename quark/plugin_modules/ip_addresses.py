@@ -31,8 +31,17 @@ ipam_driver = (importutils.import_class(CONF.QUARK.ipam_driver))()
 
 def get_ip_addresses(context, **filters):
     LOG.info("get_ip_addresses for tenant %s" % context.tenant_id)
+    limit = filters.pop("limit", None)
+    marker = filters.pop("marker", None)
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise exceptions.BadRequest(resource="ip_addresses",
+                                        msg="limit must be an integer")
     filters["_deallocated"] = False
-    addrs = db_api.ip_address_find(context, scope=db_api.ALL, **filters)
+    addrs = db_api.paginate(db_api.ip_address_find, context, limit=limit,
+                            marker=marker, **filters)
     return [v._make_ip_dict(ip) for ip in addrs]
 
 
@@ -116,6 +125,7 @@ def update_ip_address(context, id, ip_address):
             if context.is_admin:
                 LOG.info("IP's deallocated time being manually reset")
                 address['deallocated_at'] = _get_deallocated_override()
+                db_api.ip_address_reuse_enqueue(context, address)
             else:
                 msg = "Modification of reset_allocation_time requires admin"
                 raise webob.exc.HTTPForbidden(detail=msg)
@@ -142,5 +152,6 @@ def update_ip_address(context, id, ip_address):
                 port['ip_addresses'].extend([address])
         else:
             address["deallocated"] = 1
+            db_api.ip_address_reuse_enqueue(context, address)
 
     return v._make_ip_dict(address)
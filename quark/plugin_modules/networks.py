@@ -163,7 +163,8 @@ def get_network(context, id, fields=None):
     return v._make_network_dict(network, fields=fields)
 
 
-def get_networks(context, filters=None, fields=None):
+def get_networks(context, filters=None, fields=None, sorts=None, limit=None,
+                 marker=None, page_reverse=False):
     """Retrieve a list of networks.
 
     The contents of the list depends on the identity of the user
@@ -181,12 +182,22 @@ def get_networks(context, filters=None, fields=None):
         network dictionary as listed in the RESOURCE_ATTRIBUTE_MAP
         object in neutron/api/v2/attributes.py. Only these fields
         will be returned.
+    : param sorts: a list of (key, ascending) pairs to order by, networks
+        are ordered by when they were created otherwise.
+    : param limit: the most networks to return. Without a limit every
+        matching network is returned, read in batches as the result is
+        iterated.
+    : param marker: the id of the network the page starts after.
+    : param page_reverse: return the page before marker instead.
     """
     LOG.info("get_networks for tenant %s with filters %s, fields %s" %
              (context.tenant_id, filters, fields))
-    nets = db_api.network_find(context, join_subnets=True, **filters) or []
-    nets = [v._make_network_dict(net, fields=fields) for net in nets]
-    return nets
+    join_subnets = v._wants(fields, "subnets", "all_subnets")
+    nets = db_api.paginate(db_api.network_find, context, limit=limit,
+                           marker=marker, sorts=sorts,
+                           page_reverse=page_reverse,
+                           join_subnets=join_subnets, **(filters or {}))
+    return (v._make_network_dict(net, fields=fields) for net in nets)
 
 
 def get_networks_count(context, filters=None):
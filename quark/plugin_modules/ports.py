@@ -14,6 +14,7 @@
 #    under the License.
 
 import netaddr
+from neutron.common import constants
 from neutron.common import exceptions
 from neutron.openstack.common import log as logging
 from neutron.openstack.common import uuidutils
@@ -26,6 +27,7 @@ from quark import exceptions as q_exc
 from quark import ipam
 from quark import network_strategy
 from quark import plugin_views as v
+from quark import port_jobs
 from quark import utils
 
 CONF = cfg.CONF
@@ -33,6 +35,12 @@ LOG = logging.getLogger(__name__)
 STRATEGY = network_strategy.STRATEGY
 
 
+def _has_backend_port(port):
+    """False while async provisioning hasn't created the backend port."""
+    return port.get("status") not in (constants.PORT_STATUS_BUILD,
+                                      constants.PORT_STATUS_ERROR)
+
+
 def create_port(context, port):
     """Create a port
 
@@ -96,6 +104,7 @@ def create_port(context, port):
     addresses = []
     mac = None
     backend_port = None
+    pending = port_jobs.enabled()
 
     with utils.CommandManager().execute() as cmd_mgr:
         @cmd_mgr.do
@@ -150,10 +159,10 @@ def create_port(context, port):
 
         @cmd_mgr.do
         def _allocate_backend_port(mac, addresses, net, port_id):
-            backend_port = net_driver.create_port(context, net["id"],
-                                                  port_id=port_id,
-                                                  security_groups=group_ids,
-                                                  device_id=device_id)
+            backend_port = net_driver.create_port(
+                context, net["id"], port_id=port_id,
+                security_groups=group_ids, device_id=device_id,
+                security_group_models=security_groups)
             return backend_port
 
         @cmd_mgr.undo
@@ -177,6 +186,8 @@ def create_port(context, port):
                 new_port = db_api.port_create(
                     context, addresses=addresses, mac_address=mac["address"],
                     backend_key=backend_port["uuid"], **port_attrs)
+                if pending:
+                    port_jobs.enqueue(context, port_id)
 
             return new_port
 
@@ -195,12 +206,256 @@ def create_port(context, port):
         # addresses, mac, backend_port, new_port
         mac = _allocate_mac(net, port_id, mac_address)
         _allocate_ips(fixed_ips, net, port_id, segment_id, mac)
-        backend_port = _allocate_backend_port(mac, addresses, net, port_id)
+        if pending:
+            # NOTE: backend_key stands in until quark.port_jobs creates the
+            #       backend port and records its key
+            port_attrs["status"] = constants.PORT_STATUS_BUILD
+            backend_port = {"uuid": port_id}
+        else:
+            backend_port = _allocate_backend_port(mac, addresses, net,
+                                                  port_id)
         new_port = _allocate_db_port(port_attrs, backend_port, addresses, mac)
 
     return v._make_port_dict(new_port)
 
 
+def create_ports(context, ports):
+    """Create many ports at once.
+
+    Takes the body Neutron hands to create_port_bulk, i.e. a "ports" list
+    of create_port bodies. MACs and IPs for ports without explicit values
+    are allocated in batches per network, backend ports are created one by
+    one, and every database row is written in a single transaction. A
+    failure anywhere rolls back the whole batch.
+    : param context: neutron api request context
+    : param ports: dictionary with a "ports" list of port bodies
+    """
+    LOG.info("create_ports for tenant %s" % context.tenant_id)
+    admin_only = ["mac_address", "device_owner", "bridge", "admin_state_up"]
+
+    port_reqs = []
+    nets = {}
+    for body in ports["ports"]:
+        port_attrs = body["port"]
+        utils.filter_body(context, port_attrs, admin_only=admin_only)
+        net_id = port_attrs["network_id"]
+        if net_id not in nets:
+            net = db_api.network_find(context, id=net_id, scope=db_api.ONE)
+            if not net:
+                raise exceptions.NetworkNotFound(net_id=net_id)
+            nets[net_id] = net
+
+        port_reqs.append(dict(
+            id=uuidutils.generate_uuid(), attrs=port_attrs, net=nets[net_id],
+            mac_address=utils.pop_param(port_attrs, "mac_address", None),
+            segment_id=utils.pop_param(port_attrs, "segment_id"),
+            fixed_ips=utils.pop_param(port_attrs, "fixed_ips")))
+
+    # NOTE (Perkins): If a device_id is given, try to prevent multiple ports
+    # from being created for a device already attached to the network
+    device_ids = [r["attrs"]["device_id"] for r in port_reqs
+                  if r["attrs"]["device_id"]]
+    if device_ids:
+        attached = set((p["network_id"], p["device_id"])
+                       for p in db_api.port_find(context,
+                                                 network_id=nets.keys(),
+                                                 device_id=device_ids,
+                                                 scope=db_api.ALL))
+        for req in port_reqs:
+            key = (req["net"]["id"], req["attrs"]["device_id"])
+            if not key[1]:
+                continue
+            if key in attached:
+                raise exceptions.BadRequest(
+                    resource="port", msg="This device is already connected to"
+                    " the requested network via another port")
+            attached.add(key)
+
+    for net_id in nets:
+        reqs = [r for r in port_reqs if r["net"]["id"] == net_id]
+        if not STRATEGY.is_parent_network(net_id):
+            # We don't honor segmented networks when they aren't "shared"
+            for req in reqs:
+                req["segment_id"] = None
+            port_count = db_api.port_count_all(context, network_id=[net_id],
+                                               tenant_id=[context.tenant_id])
+            quota.QUOTAS.limit_check(
+                context, context.tenant_id,
+                ports_per_network=port_count + len(reqs))
+        elif [r for r in reqs if not r["segment_id"]]:
+            raise q_exc.AmbiguousNetworkId(net_id=net_id)
+
+    group_lists = v.make_security_group_lists(
+        context, [req["attrs"].pop("security_groups", None)
+                  for req in port_reqs])
+    for req, (group_ids, groups) in zip(port_reqs, group_lists):
+        req["group_ids"], req["security_groups"] = group_ids, groups
+
+    def _ipam_driver(net):
+        return ipam.IPAM_REGISTRY.get_strategy(net["ipam_strategy"])
+
+    def _net_driver(net):
+        return registry.DRIVER_REGISTRY.get_driver(net["network_plugin"])
+
+    reuse_after = CONF.QUARK.ipam_reuse_after
+    macs = {}
+    addresses = {}
+    backend_ports = {}
+    pending = port_jobs.enabled()
+
+    with utils.CommandManager().execute() as cmd_mgr:
+        @cmd_mgr.do
+        def _allocate_macs(port_reqs):
+            for net_id, net in nets.items():
+                reqs = [r for r in port_reqs if r["net"]["id"] == net_id]
+                for req in reqs:
+                    if req["mac_address"]:
+                        macs[req["id"]] = _ipam_driver(
+                            net).allocate_mac_address(
+                            context, net_id, req["id"], reuse_after,
+                            mac_address=req["mac_address"])
+
+                bulk_ids = [r["id"] for r in reqs if not r["mac_address"]]
+                if bulk_ids:
+                    new_macs = []
+                    try:
+                        _ipam_driver(net).allocate_mac_addresses(
+                            context, new_macs, net_id, bulk_ids, reuse_after)
+                    finally:
+                        macs.update(zip(bulk_ids, new_macs))
+
+        @cmd_mgr.undo
+        def _allocate_macs_undo(result):
+            LOG.info("Rolling back MAC addresses...")
+            for req in port_reqs:
+                mac = macs.get(req["id"])
+                if not mac:
+                    continue
+                try:
+                    with context.session.begin():
+                        _ipam_driver(req["net"]).deallocate_mac_address(
+                            context, mac["address"])
+                except Exception:
+                    LOG.exception("Couldn't release MAC %s" % mac)
+
+        @cmd_mgr.do
+        def _allocate_ips(port_reqs):
+            for req in port_reqs:
+                if not req["fixed_ips"]:
+                    continue
+                for fixed_ip in req["fixed_ips"]:
+                    subnet_id = fixed_ip.get("subnet_id")
+                    ip_address = fixed_ip.get("ip_address")
+                    if not (subnet_id and ip_address):
+                        raise exceptions.BadRequest(
+                            resource="fixed_ips",
+                            msg="subnet_id and ip_address required")
+                    _ipam_driver(req["net"]).allocate_ip_address(
+                        context, addresses.setdefault(req["id"], []),
+                        req["net"]["id"], req["id"], reuse_after,
+                        segment_id=req["segment_id"],
+                        ip_address=ip_address, subnets=[subnet_id],
+                        mac_address=macs[req["id"]])
+
+            groups = {}
+            for req in port_reqs:
+                if not req["fixed_ips"]:
+                    key = (req["net"]["id"], req["segment_id"])
+                    groups.setdefault(key, []).append(req["id"])
+
+            for (net_id, segment_id), port_ids in groups.items():
+                _ipam_driver(nets[net_id]).allocate_ip_addresses(
+                    context, addresses, net_id, port_ids, reuse_after,
+                    segment_id=segment_id,
+                    mac_addresses=dict((port_id, macs[port_id])
+                                       for port_id in port_ids))
+
+        @cmd_mgr.undo
+        def _allocate_ips_undo(result):
+            LOG.info("Rolling back IP addresses...")
+            for req in port_reqs:
+                for address in addresses.get(req["id"], []):
+                    try:
+                        with context.session.begin():
+                            _ipam_driver(req["net"]).deallocate_ip_address(
+                                context, address)
+                    except Exception:
+                        LOG.exception("Couldn't release IP %s" % address)
+
+        @cmd_mgr.do
+        def _allocate_backend_ports(port_reqs):
+            for req in port_reqs:
+                backend_ports[req["id"]] = _net_driver(req["net"]).create_port(
+                    context, req["net"]["id"], port_id=req["id"],
+                    security_groups=req["group_ids"],
+                    device_id=req["attrs"]["device_id"],
+                    security_group_models=req["security_groups"])
+
+        @cmd_mgr.undo
+        def _allocate_backend_ports_undo(result):
+            LOG.info("Rolling back backend ports...")
+            by_net = {}
+            for req in port_reqs:
+                backend_port = backend_ports.get(req["id"])
+                if backend_port:
+                    by_net.setdefault(req["net"]["id"], []).append(
+                        backend_port["uuid"])
+            for net_id, backend_keys in by_net.items():
+                try:
+                    _net_driver(nets[net_id]).delete_ports(context,
+                                                           backend_keys)
+                except Exception:
+                    LOG.exception(
+                        "Couldn't rollback backend ports %s" % backend_keys)
+
+        @cmd_mgr.do
+        def _allocate_db_ports(port_reqs):
+            port_dicts = []
+            for req in port_reqs:
+                port_attrs = req["attrs"]
+                port_attrs["network_id"] = req["net"]["id"]
+                port_attrs["id"] = req["id"]
+                port_attrs["security_groups"] = req["security_groups"]
+                port_attrs.update(backend_ports[req["id"]])
+                port_attrs["addresses"] = addresses.get(req["id"], [])
+                port_attrs["mac_address"] = macs[req["id"]]["address"]
+                port_attrs["backend_key"] = backend_ports[req["id"]]["uuid"]
+                port_dicts.append(port_attrs)
+
+            with context.session.begin():
+                new_ports = db_api.port_create_bulk(context, port_dicts)
+                if pending:
+                    for req in port_reqs:
+                        port_jobs.enqueue(context, req["id"])
+            return new_ports
+
+        @cmd_mgr.undo
+        def _allocate_db_ports_undo(new_ports):
+            LOG.info("Rolling back database ports...")
+            if not new_ports:
+                return
+            try:
+                with context.session.begin():
+                    for new_port in new_ports:
+                        db_api.port_delete(context, new_port)
+            except Exception:
+                LOG.exception("Couldn't rollback db ports")
+
+        _allocate_macs(port_reqs)
+        _allocate_ips(port_reqs)
+        if pending:
+            # NOTE: as in create_port, quark.port_jobs creates the backend
+            #       ports later and records their keys
+            for req in port_reqs:
+                req["attrs"]["status"] = constants.PORT_STATUS_BUILD
+                backend_ports[req["id"]] = {"uuid": req["id"]}
+        else:
+            _allocate_backend_ports(port_reqs)
+        new_ports = _allocate_db_ports(port_reqs)
+
+    return [v._make_port_dict(new_port) for new_port in new_ports]
+
+
 def update_port(context, id, port):
     """Update values of a port.
 
@@ -287,8 +542,12 @@ def update_port(context, id, port):
         context, port_dict.pop("security_groups", None))
     net_driver = registry.DRIVER_REGISTRY.get_driver(
         port_db.network["network_plugin"])
-    net_driver.update_port(context, port_id=port_db.backend_key,
-                           security_groups=group_ids)
+    # NOTE: a port still being provisioned gets the groups it has when its
+    #       backend port is created
+    if _has_backend_port(port_db):
+        net_driver.update_port(context, port_id=port_db.backend_key,
+                               security_groups=group_ids,
+                               security_group_models=security_groups)
 
     port_dict["security_groups"] = security_groups
 
@@ -368,16 +627,24 @@ def get_port(context, id, fields=None):
     """
     LOG.info("get_port %s for tenant %s fields %s" %
              (id, context.tenant_id, fields))
-    results = db_api.port_find(context, id=id, fields=fields,
-                               scope=db_api.ONE)
+    projected = db_api.port_fields_projectable(fields)
+    if projected:
+        results = db_api.port_find_fields(context, fields, id=id,
+                                          scope=db_api.ONE)
+    else:
+        results = db_api.port_find(context, id=id, fields=fields,
+                                   scope=db_api.ONE)
 
     if not results:
         raise exceptions.PortNotFound(port_id=id, net_id='')
 
+    if projected:
+        return v._make_port_row_dict(results, fields)
     return v._make_port_dict(results)
 
 
-def get_ports(context, filters=None, fields=None):
+def get_ports(context, filters=None, fields=None, sorts=None, limit=None,
+              marker=None, page_reverse=False):
     """Retrieve a list of ports.
 
     The contents of the list depends on the identity of the user
@@ -395,6 +662,13 @@ def get_ports(context, filters=None, fields=None):
         port dictionary as listed in the RESOURCE_ATTRIBUTE_MAP
         object in neutron/api/v2/attributes.py. Only these fields
         will be returned.
+    : param sorts: a list of (key, ascending) pairs to order by, ports
+        are ordered by when they were created otherwise.
+    : param limit: the most ports to return. Without a limit every
+        matching port is returned, read in batches as the result is
+        iterated.
+    : param marker: the id of the port the page starts after.
+    : param page_reverse: return the page before marker instead.
     """
     LOG.info("get_ports for tenant %s filters %s fields %s" %
              (context.tenant_id, filters, fields))
@@ -410,9 +684,18 @@ def get_ports(context, filters=None, fields=None):
         ports = []
         for ip in query:
             ports.extend(ip.ports)
+    elif db_api.port_fields_projectable(fields):
+        ports = db_api.paginate(db_api.port_find_fields, context, limit=limit,
+                                marker=marker, sorts=sorts,
+                                page_reverse=page_reverse, fields=fields,
+                                **filters)
+        return (v._make_port_row_dict(port, fields) for port in ports)
     else:
-        ports = db_api.port_find(context, fields=fields,
-                                 join_security_groups=True, **filters)
+        ports = db_api.paginate(db_api.port_find, context, limit=limit,
+                                marker=marker, sorts=sorts,
+                                page_reverse=page_reverse, fields=fields,
+                                join_security_groups=True,
+                                batch_relations=True, **filters)
     return v._make_ports_list(ports, fields)
 
 
@@ -461,9 +744,16 @@ def delete_port(context, id):
 
     net_driver = registry.DRIVER_REGISTRY.get_driver(
         port.network["network_plugin"])
-    net_driver.delete_port(context, backend_key)
+    has_backend_port = _has_backend_port(port)
+    if has_backend_port:
+        net_driver.delete_port(context, backend_key)
 
     with context.session.begin():
+        if (not has_backend_port and
+                not db_api.port_job_delete(context, port_id=port["id"])):
+            # NOTE: its job finished after the port was read
+            context.session.refresh(port)
+            net_driver.delete_port(context, port["backend_key"])
         db_api.port_delete(context, port)
 
 
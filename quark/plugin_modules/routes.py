@@ -60,7 +60,7 @@ def create_route(context, route):
         subnet = db_api.subnet_find(context, id=subnet_id, scope=db_api.ONE)
         if not subnet:
             raise exceptions.SubnetNotFound(subnet_id=subnet_id)
-        policies = db_models.IPPolicy.get_ip_policy_cidrs(subnet)
+        policies = db_models.IPPolicy.get_ip_policy_ranges(subnet)
         alloc_pools = allocation_pool.AllocationPools(subnet["cidr"],
                                                       policies=policies)
         alloc_pools.validate_gateway_excluded(route["gateway"])
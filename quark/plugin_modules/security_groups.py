@@ -193,7 +193,9 @@ def get_security_groups(context, filters=None, fields=None,
                         page_reverse=False):
     LOG.info("get_security_groups for tenant %s" %
              (context.tenant_id))
-    groups = db_api.security_group_find(context, **filters)
+    groups = db_api.paginate(db_api.security_group_find, context,
+                             limit=limit, marker=marker, sorts=sorts,
+                             page_reverse=page_reverse, **(filters or {}))
     return [v._make_security_group_dict(group) for group in groups]
 
 
@@ -202,7 +204,9 @@ def get_security_group_rules(context, filters=None, fields=None,
                              page_reverse=False):
     LOG.info("get_security_group_rules for tenant %s" %
              (context.tenant_id))
-    rules = db_api.security_group_rule_find(context, **filters)
+    rules = db_api.paginate(db_api.security_group_rule_find, context,
+                            limit=limit, marker=marker, sorts=sorts,
+                            page_reverse=page_reverse, **(filters or {}))
     return [v._make_security_group_rule_dict(rule) for rule in rules]
 
 
@@ -26,6 +26,7 @@ from quark import allocation_pool
 from quark.db import api as db_api
 from quark.db import models as db_models
 from quark import exceptions as q_exc
+from quark import ipam
 from quark import network_strategy
 from quark.plugin_modules import ip_policies
 from quark.plugin_modules import routes
@@ -161,6 +162,7 @@ def create_subnet(context, subnet):
             new_subnet["routes"].append(db_api.route_create(
                 context, cidr=str(routes.DEFAULT_ROUTE), gateway=gateway_ip))
 
+    ipam.SUBNET_AVAILABILITY.invalidate(net_id)
     subnet_dict = v._make_subnet_dict(new_subnet)
     subnet_dict["gateway_ip"] = gateway_ip
 
@@ -204,7 +206,7 @@ def update_subnet(context, id, subnet):
         gateway_ip = utils.pop_param(s, "gateway_ip", None)
         allocation_pools = utils.pop_param(s, "allocation_pools", None)
 
-        policies = db_models.IPPolicy.get_ip_policy_cidrs(subnet_db)
+        policies = db_models.IPPolicy.get_ip_policy_ranges(subnet_db)
         alloc_pools = allocation_pool.AllocationPools(subnet_db["cidr"],
                                                       allocation_pools,
                                                       policies)
@@ -251,6 +253,7 @@ def update_subnet(context, id, subnet):
                 context, subnet_db["ip_policy"], exclude=cidrs)
 
         subnet = db_api.subnet_update(context, subnet_db, **s)
+    ipam.SUBNET_AVAILABILITY.invalidate(subnet["network_id"])
     return v._make_subnet_dict(subnet)
 
 
@@ -279,7 +282,8 @@ def get_subnet(context, id, fields=None):
     return v._make_subnet_dict(subnet)
 
 
-def get_subnets(context, filters=None, fields=None):
+def get_subnets(context, filters=None, fields=None, sorts=None, limit=None,
+                marker=None, page_reverse=False):
     """Retrieve a list of subnets.
 
     The contents of the list depends on the identity of the user
@@ -297,11 +301,22 @@ def get_subnets(context, filters=None, fields=None):
         subnet dictionary as listed in the RESOURCE_ATTRIBUTE_MAP
         object in neutron/api/v2/attributes.py. Only these fields
         will be returned.
+    : param sorts: a list of (key, ascending) pairs to order by, subnets
+        are ordered by when they were created otherwise.
+    : param limit: the most subnets to return. Without a limit every
+        matching subnet is returned, read in batches as the result is
+        iterated.
+    : param marker: the id of the subnet the page starts after.
+    : param page_reverse: return the page before marker instead.
     """
     LOG.info("get_subnets for tenant %s with filters %s fields %s" %
              (context.tenant_id, filters, fields))
-    subnets = db_api.subnet_find(context, join_dns=True, join_routes=True,
-                                 **filters)
+    subnets = db_api.paginate(
+        db_api.subnet_find, context, limit=limit, marker=marker, sorts=sorts,
+        page_reverse=page_reverse,
+        join_dns=v._wants(fields, "dns_nameservers"),
+        join_routes=v._wants(fields, "gateway_ip", "host_routes"),
+        **(filters or {}))
     return v._make_subnets_list(subnets, fields=fields)
 
 
@@ -331,6 +346,7 @@ def _delete_subnet(context, subnet):
     if subnet.allocated_ips:
         raise exceptions.SubnetInUse(subnet_id=subnet["id"])
     db_api.subnet_delete(context, subnet)
+    ipam.SUBNET_AVAILABILITY.invalidate(subnet["network_id"])
 
 
 def delete_subnet(context, id):
@@ -360,5 +376,5 @@ def diagnose_subnet(context, id, fields):
         raise exceptions.NotAuthorized()
 
     if id == "*":
-        return {'subnets': get_subnets(context, filters={})}
+        return {'subnets': list(get_subnets(context, filters={}))}
     return {'subnets': get_subnet(context, id)}
@@ -24,6 +24,7 @@ from oslo.config import cfg
 
 from quark.db import api as db_api
 from quark.db import models
+from quark import ip_ranges
 from quark import network_strategy
 from quark import utils
 
@@ -45,6 +46,11 @@ def _is_default_route(route):
     return route.value == 0
 
 
+def _wants(fields, *names):
+    """Whether a response limited to fields includes any of names."""
+    return not fields or any(name in fields for name in names)
+
+
 def _make_network_dict(network, fields=None):
     shared_net = STRATEGY.is_parent_network(network["id"])
     res = {"id": network["id"],
@@ -54,6 +60,8 @@ def _make_network_dict(network, fields=None):
            "ipam_strategy": network.get("ipam_strategy"),
            "status": "ACTIVE",
            "shared": shared_net}
+    if not _wants(fields, "subnets", "all_subnets"):
+        return res
     if not shared_net:
         if fields and "all_subnets" in fields:
             res["subnets"] = [_make_subnet_dict(s)
@@ -65,54 +73,51 @@ def _make_network_dict(network, fields=None):
     return res
 
 
-def _pools_from_cidr(cidr):
-    cidrs = cidr.iter_cidrs()
-    if len(cidrs) == 0:
-        return []
-    if len(cidrs) == 1:
-        return [dict(start=str(cidrs[0][0]),
-                     end=str(cidrs[0][-1]))]
-
-    pool_start = cidrs[0][0]
-    prev_cidr_end = cidrs[0][-1]
-    pools = []
-    for cidr in cidrs[1:]:
-        cidr_start = cidr[0]
-        if prev_cidr_end + 1 != cidr_start:
-            pools.append(dict(start=str(pool_start),
-                              end=str(prev_cidr_end)))
-            pool_start = cidr_start
-        prev_cidr_end = cidr[-1]
-    pools.append(dict(start=str(pool_start), end=str(prev_cidr_end)))
-    return pools
+def _pools_from_ranges(ranges, version):
+    def _ip(value):
+        ip = netaddr.IPAddress(value, version=6)
+        if version == 4:
+            return ip.ipv4()
+        return ip
+
+    return [dict(start=str(_ip(first)), end=str(_ip(last)))
+            for first, last in ranges]
 
 
 def _make_subnet_dict(subnet, fields=None):
-    dns_nameservers = [str(netaddr.IPAddress(dns["ip"]))
-                       for dns in subnet.get("dns_nameservers")]
     net_id = STRATEGY.get_parent_network(subnet["network_id"])
 
     def _allocation_pools(subnet):
-        ip_policy_cidrs = models.IPPolicy.get_ip_policy_cidrs(subnet)
-        cidr = netaddr.IPSet([netaddr.IPNetwork(subnet["cidr"])])
-        allocatable = cidr - ip_policy_cidrs
-        return _pools_from_cidr(allocatable)
+        ip_policy = models.IPPolicy.get_ip_policy_ranges(subnet)
+        cidr = netaddr.IPNetwork(subnet["cidr"])
+        net = cidr.ipv6()
+        allocatable = ip_ranges.FreeRanges(net.first, net.last,
+                                           ip_policy.ranges())
+        return _pools_from_ranges(allocatable.ranges(), cidr.version)
 
     res = {"id": subnet.get("id"),
            "name": subnet.get("name"),
            "tenant_id": subnet.get("tenant_id"),
            "network_id": net_id,
            "ip_version": subnet.get("ip_version"),
-           "dns_nameservers": dns_nameservers or [],
            "cidr": subnet.get("cidr"),
            "shared": STRATEGY.is_parent_network(net_id),
            "enable_dhcp": None,
            "ip_policy_id": subnet.get("ip_policy_id")}
 
-    if CONF.QUARK.show_allocation_pools:
-        res["allocation_pools"] = _allocation_pools(subnet)
-    else:
+    # NOTE: each of these reads a relationship, so only build the ones
+    #       the response is going to include
+    if _wants(fields, "dns_nameservers"):
+        res["dns_nameservers"] = [str(netaddr.IPAddress(dns["ip"]))
+                                  for dns in subnet.get("dns_nameservers")]
+
+    if _wants(fields, "allocation_pools"):
         res["allocation_pools"] = []
+        if CONF.QUARK.show_allocation_pools:
+            res["allocation_pools"] = _allocation_pools(subnet)
+
+    if not _wants(fields, "gateway_ip", "host_routes"):
+        return res
 
     def _host_route(route):
         return {"destination": route["cidr"],
@@ -171,7 +176,7 @@ def _port_dict(port, fields=None):
            "tenant_id": port.get("tenant_id"),
            "mac_address": port.get("mac_address"),
            "admin_state_up": port.get("admin_state_up"),
-           "status": "ACTIVE",
+           "status": port.get("status") or "ACTIVE",
            "security_groups": [group.get("id", None) for group in
                                port.get("security_groups", None)],
            "device_id": port.get("device_id"),
@@ -187,38 +192,70 @@ def _port_dict(port, fields=None):
     return res
 
 
-def _make_port_address_dict(ip, fields=None):
+def _make_port_row_dict(row, fields):
+    """Builds the requested fields of a port from a port_find_fields row."""
+    res = dict((field, row[field]) for field in fields if field in row)
+    if "network_id" in res:
+        res["network_id"] = STRATEGY.get_parent_network(res["network_id"])
+    if res.get("mac_address"):
+        mac = str(netaddr.EUI(res["mac_address"])).replace('-', ':')
+        res["mac_address"] = mac
+    if "bridge" in res and not res["bridge"]:
+        del res["bridge"]
+    if "status" in fields:
+        res["status"] = row.get("status") or "ACTIVE"
+    if "fixed_ips" in fields:
+        res["fixed_ips"] = [
+            {"subnet_id": ip["subnet_id"],
+             "ip_address": models.IPAddress.format_address(
+                 ip["address_readable"], ip["version"])}
+            for ip in row["ip_addresses"]]
+    return res
+
+
+def _make_port_address_dict(ip, fields=None, subnets=None):
+    """Builds a fixed_ips entry.
+
+    subnets maps subnet ids to the subnet dicts already built for the
+    response, so each subnet's view, allocation pools included, is only
+    worked out once however many addresses it has.
+    """
     ip_addr = {"subnet_id": ip.get("subnet_id"),
                "ip_address": ip.formatted()}
     if fields and "port_subnets" in fields:
-        ip_addr["subnet"] = _make_subnet_dict(ip["subnet"])
+        if subnets is None:
+            subnets = {}
+        subnet_id = ip.get("subnet_id")
+        if subnet_id not in subnets:
+            subnets[subnet_id] = _make_subnet_dict(ip["subnet"])
+        ip_addr["subnet"] = dict(subnets[subnet_id])
 
     return ip_addr
 
 
 def _make_port_dict(port, fields=None):
     res = _port_dict(port)
-    res["fixed_ips"] = [_make_port_address_dict(ip, fields)
+    subnets = {}
+    res["fixed_ips"] = [_make_port_address_dict(ip, fields, subnets)
                         for ip in port.ip_addresses]
     return res
 
 
 def _make_ports_list(query, fields=None):
-    ports = []
+    """Yields each port's dict as query is read."""
+    subnets = {}
     for port in query:
         port_dict = _port_dict(port, fields)
-        port_dict["fixed_ips"] = [_make_port_address_dict(addr, fields)
-                                  for addr in port.ip_addresses]
-        ports.append(port_dict)
-    return ports
+        port_dict["fixed_ips"] = [
+            _make_port_address_dict(addr, fields, subnets)
+            for addr in port.ip_addresses]
+        yield port_dict
 
 
 def _make_subnets_list(query, fields=None):
-    subnets = []
+    """Yields each subnet's dict as query is read."""
     for subnet in query:
-        subnet_dict = _make_subnet_dict(subnet, fields=fields)
-        subnets.append(subnet_dict)
-    return subnets
+        yield _make_subnet_dict(subnet, fields=fields)
 
 
 def _make_mac_range_dict(mac_range):
@@ -257,14 +294,36 @@ def _make_ip_policy_dict(ipp):
 
 
 def make_security_group_list(context, group_ids):
-    if not group_ids or not utils.attr_specified(group_ids):
-        return ([], [])
-    group_ids = list(set(group_ids))
-    groups = []
-    for gid in group_ids:
-        group = db_api.security_group_find(context, id=gid,
-                                           scope=db_api.ONE)
-        if not group:
-            raise sg_ext.SecurityGroupNotFound(id=gid)
-        groups.append(group)
-    return (group_ids, groups)
+    return make_security_group_lists(context, [group_ids])[0]
+
+
+def make_security_group_lists(context, group_id_lists):
+    """Looks up the security groups of many ports with a single query.
+
+    Returns a (group_ids, groups) pair for each list of ids in
+    group_id_lists, with duplicate ids dropped. Raises
+    SecurityGroupNotFound for the first id that doesn't exist.
+    """
+    lists = []
+    for group_ids in group_id_lists:
+        if not group_ids or not utils.attr_specified(group_ids):
+            group_ids = []
+        unique = []
+        for gid in group_ids:
+            if gid not in unique:
+                unique.append(gid)
+        lists.append(unique)
+
+    found = {}
+    wanted = set(gid for unique in lists for gid in unique)
+    if wanted:
+        found = dict((group["id"], group) for group in
+                     db_api.security_group_find(context, id=list(wanted),
+                                                scope=db_api.ALL) or [])
+    results = []
+    for unique in lists:
+        for gid in unique:
+            if gid not in found:
+                raise sg_ext.SecurityGroupNotFound(id=gid)
+        results.append((unique, [found[gid] for gid in unique]))
+    return results
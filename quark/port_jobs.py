@@ -0,0 +1,221 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Backend ports created after the API call that asked for them
+
+With async_port_provisioning on, create_port commits the port as BUILD,
+its addresses and MAC already allocated, along with a PortJob. The
+workers here claim due jobs, create each backend port through the
+network's driver and flip the port to ACTIVE. A failed attempt is tried
+again port_job_backoff seconds later, doubling each time, and after
+port_job_max_attempts the port is left in ERROR.
+
+    quark-port-worker --config-file /etc/neutron/neutron.conf \\
+        --config-file /etc/neutron/plugins/quark/quark.ini
+"""
+
+import datetime
+import sys
+
+import eventlet
+from neutron.common import config
+from neutron.common import constants
+from neutron import context as neutron_context
+from neutron.db import api as neutron_db_api
+from neutron.openstack.common import log as logging
+from neutron.openstack.common import timeutils
+from oslo.config import cfg
+
+from quark.db import api as db_api
+from quark.db import models
+from quark.drivers import registry
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+quark_opts = [
+    cfg.BoolOpt("async_port_provisioning",
+                default=False,
+                help=_("Commit new ports as BUILD and leave creating their"
+                       " backend ports to quark-port-worker.")),
+    cfg.IntOpt("port_job_workers",
+               default=8,
+               help=_("Backend ports each quark-port-worker creates at"
+                      " once.")),
+    cfg.IntOpt("port_job_max_attempts",
+               default=5,
+               help=_("Attempts at creating a backend port before its port"
+                      " is put in ERROR.")),
+    cfg.FloatOpt("port_job_backoff",
+                 default=2.0,
+                 help=_("Seconds before a failed backend port is tried"
+                        " again, doubled after every attempt.")),
+    cfg.IntOpt("port_job_lease",
+               default=300,
+               help=_("Seconds a worker holds a job for before another may"
+                      " take it over.")),
+    cfg.FloatOpt("port_job_poll_interval",
+                 default=1.0,
+                 help=_("Seconds an idle worker waits between looking for"
+                        " due jobs."))
+]
+
+CONF.register_opts(quark_opts, "QUARK")
+
+
+def enabled():
+    return CONF.QUARK.async_port_provisioning
+
+
+def enqueue(context, port_id):
+    """Queues creating the backend port of a port just added as BUILD."""
+    return db_api.port_job_create(context, port_id)
+
+
+def _context(tenant_id):
+    # NOTE: drivers tag what they create with the context's tenant
+    return neutron_context.Context(None, tenant_id, is_admin=True)
+
+
+def _job_values(job):
+    # NOTE: plain values, so nothing reads a job's row from another session
+    return dict(id=job["id"], tenant_id=job["tenant_id"],
+                port_id=job["port_id"], run_at=job["run_at"],
+                attempts=job["attempts"])
+
+
+def _provision(context, job):
+    port = db_api.port_find(context, id=job["port_id"], scope=db_api.ONE)
+    if not port:
+        with context.session.begin():
+            db_api.port_job_delete(context, job_id=job["id"])
+        return
+
+    net_driver = registry.DRIVER_REGISTRY.get_driver(
+        port.network["network_plugin"])
+    with context.session.begin():
+        backend_port = net_driver.create_port(
+            context, port["network_id"], port_id=port["id"],
+            security_groups=[group["id"] for group in port.security_groups],
+            device_id=port["device_id"],
+            security_group_models=port.security_groups)
+        if not db_api.port_job_delete(context, job_id=job["id"]):
+            LOG.info("Port %s was deleted while its backend port was"
+                     " created, deleting backend port %s" %
+                     (port["id"], backend_port["uuid"]))
+            net_driver.delete_port(context, backend_port["uuid"])
+            return
+        updates = dict(backend_key=backend_port["uuid"],
+                       status=constants.PORT_STATUS_ACTIVE)
+        if backend_port.get("bridge"):
+            updates["bridge"] = backend_port["bridge"]
+        db_api.port_update(context, port, **updates)
+
+
+def _failed(context, job, attempts, error):
+    # NOTE: aiclib keeps what went wrong in message rather than args
+    message = str(getattr(error, "message", None) or error)[:255]
+    with context.session.begin():
+        if attempts < CONF.QUARK.port_job_max_attempts:
+            delay = CONF.QUARK.port_job_backoff * 2 ** (attempts - 1)
+            run_at = timeutils.utcnow() + datetime.timedelta(seconds=delay)
+            db_api.port_job_update(context, job["id"], run_at=run_at,
+                                   last_error=message)
+            return
+        LOG.error("Giving up on the backend port of port %s after %d"
+                  " attempts" % (job["port_id"], attempts))
+        db_api.port_job_update(context, job["id"],
+                               state=models.PortJob.FAILED,
+                               last_error=message)
+        port = db_api.port_find(context, id=job["port_id"],
+                                scope=db_api.ONE)
+        if port:
+            db_api.port_update(context, port,
+                               status=constants.PORT_STATUS_ERROR)
+
+
+def run_job(job):
+    """Claims a job and creates its backend port.
+
+    Returns False when another worker claimed it first.
+    """
+    context = _context(job["tenant_id"])
+    try:
+        with context.session.begin():
+            if not db_api.port_job_claim(context, job,
+                                         CONF.QUARK.port_job_lease):
+                return False
+        attempts = job["attempts"] + 1
+        try:
+            _provision(context, job)
+        except Exception as e:
+            LOG.exception("Attempt %d at the backend port of port %s"
+                          " failed" % (attempts, job["port_id"]))
+            _failed(context, job, attempts, e)
+        return True
+    finally:
+        context.session.close()
+
+
+class Worker(object):
+    """Runs due jobs on a pool of port_job_workers greenthreads."""
+
+    def __init__(self):
+        self.pool = eventlet.GreenPool(CONF.QUARK.port_job_workers)
+
+    def run_once(self):
+        """Starts as many due jobs as there are free greenthreads."""
+        free = self.pool.free()
+        if not free:
+            return 0
+        context = neutron_context.get_admin_context()
+        try:
+            jobs = [_job_values(job)
+                    for job in db_api.port_job_find_due(context, free)]
+        finally:
+            context.session.close()
+        for job in jobs:
+            self.pool.spawn_n(run_job, job)
+        return len(jobs)
+
+    def serve(self):
+        while True:
+            try:
+                started = self.run_once()
+            except Exception:
+                LOG.exception("Error looking for due port jobs")
+                started = 0
+            if started:
+                eventlet.sleep(0)
+            else:
+                eventlet.sleep(CONF.QUARK.port_job_poll_interval)
+
+
+def main():
+    eventlet.monkey_patch()
+    config.init(sys.argv[1:])
+    if not CONF.config_file:
+        sys.exit(_("ERROR: Unable to find configuration file via the default"
+                   " search paths (~/.neutron/, ~/, /etc/neutron/, /etc/) and"
+                   " the '--config-file' option!"))
+    config.setup_logging(CONF)
+    neutron_db_api.configure_db()
+    neutron_db_api.register_models(base=models.BASEV2)
+    Worker().serve()
+
+
+if __name__ == "__main__":
+    main()
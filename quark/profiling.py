@@ -0,0 +1,276 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Profiles of individual plugin calls, taken while the server runs
+
+One in every profile_sample_rate plugin calls is profiled, along with any
+call made for a request quark.api.profiling.ProfileMiddleware marked as
+asking for it. Each profile lands in profile_dir/<method>/ named after its
+request, and only the newest profile_keep of each method are kept.
+
+The profiles are taken in the worker's thread, so under eventlet they also
+see whatever other greenthreads run while the call waits on I/O.
+
+    quark-profile-collapse /var/lib/quark/profiles/create_port > out.folded
+    flamegraph.pl out.folded > create_port.svg
+"""
+
+import argparse
+import collections
+import contextlib
+import cProfile as profiler
+import errno
+import os
+import pstats
+import random
+import signal
+import sys
+import threading
+import time
+
+from neutron.openstack.common import log as logging
+from oslo.config import cfg
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+quark_opts = [
+    cfg.IntOpt("profile_sample_rate",
+               default=0,
+               help=_("Profile one in this many plugin calls. 0 only"
+                      " profiles requests that ask for it.")),
+    cfg.StrOpt("profile_mode",
+               default="cprofile",
+               help=_("'cprofile' to write pstats dumps, or 'sample' to"
+                      " sample stacks every profile_sample_interval into"
+                      " collapsed stacks.")),
+    cfg.FloatOpt("profile_sample_interval",
+                 default=0.005,
+                 help=_("Seconds of CPU time between stack samples.")),
+    cfg.StrOpt("profile_dir",
+               default="/var/lib/quark/profiles",
+               help=_("Directory profiles are written under.")),
+    cfg.IntOpt("profile_keep",
+               default=100,
+               help=_("Number of profiles kept for each plugin method."))
+]
+
+CONF.register_opts(quark_opts, "QUARK")
+
+_local = threading.local()
+_random = random.Random()
+
+
+@contextlib.contextmanager
+def requested():
+    """Profiles every plugin call made inside the block."""
+    _local.requested = True
+    try:
+        yield
+    finally:
+        _local.requested = False
+
+
+def _wanted():
+    if getattr(_local, "active", False):
+        return False
+    if getattr(_local, "requested", False):
+        return True
+    rate = CONF.QUARK.profile_sample_rate
+    return rate > 0 and _random.randint(1, rate) == 1
+
+
+def _frame_name(frame):
+    return "%s:%s" % (frame.f_globals.get("__name__", "?"),
+                      frame.f_code.co_name)
+
+
+class StackSampler(object):
+    """Counts the stacks seen every interval seconds of CPU time.
+
+    Uses SIGPROF, so it only works from the main thread.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = collections.defaultdict(int)
+        self._previous = None
+
+    def _sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame))
+            frame = frame.f_back
+        self.stacks[";".join(reversed(names))] += 1
+
+    def start(self):
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write("%s %d\n" % (stack, count))
+
+
+def _profile_path(name, request_id, suffix):
+    directory = os.path.join(CONF.QUARK.profile_dir, name)
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return os.path.join(directory, "%d-%s%s" % (time.time() * 1000,
+                                                request_id, suffix))
+
+
+def _rotate(directory):
+    profiles = sorted(os.listdir(directory))
+    for stale in profiles[:-CONF.QUARK.profile_keep or None]:
+        try:
+            os.remove(os.path.join(directory, stale))
+        except OSError:
+            pass
+
+
+@contextlib.contextmanager
+def profile(name, context):
+    """Profiles the block as a call to plugin method name, if it's wanted.
+
+    Nothing is profiled inside a block that's already being profiled.
+    """
+    if not _wanted():
+        yield
+        return
+
+    sampler = None
+    prof = None
+    if CONF.QUARK.profile_mode == "sample":
+        sampler = StackSampler(CONF.QUARK.profile_sample_interval)
+        try:
+            sampler.start()
+        except ValueError:
+            # NOTE: signals can only be handled in the main thread
+            sampler = None
+    if sampler is None:
+        prof = profiler.Profile()
+        prof.enable()
+
+    _local.active = True
+    try:
+        yield
+    finally:
+        _local.active = False
+        request_id = getattr(context, "request_id", None) or "unknown"
+        try:
+            if sampler:
+                sampler.stop()
+                path = _profile_path(name, request_id, ".folded")
+                sampler.dump(path)
+            else:
+                prof.disable()
+                path = _profile_path(name, request_id, ".prof")
+                prof.dump_stats(path)
+            _rotate(os.path.dirname(path))
+        except Exception:
+            LOG.exception("Error writing profile of %s" % name)
+
+
+def collapse_pstats(stats):
+    """Rebuilds collapsed stacks from a pstats call graph.
+
+    pstats only records caller and callee pairs, so each function's own
+    time is spread over the paths reaching it in proportion to the calls
+    made along each one. Recursion is cut at the first repeat.
+    """
+    callees = collections.defaultdict(list)
+    roots = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller in callers:
+            callees[caller].append(func)
+
+    def label(func):
+        filename, line, funcname = func
+        return "%s:%s" % (os.path.basename(filename), funcname)
+
+    stacks = collections.defaultdict(float)
+
+    def walk(func, path, share):
+        cc, nc, tt, ct, callers = stats.stats[func]
+        # NOTE: paths worth under a microsecond aren't followed, or large
+        #       call graphs take forever to walk
+        if ct * share < 0.000001:
+            return
+        stacks[";".join(path)] += tt * share
+        for callee in callees[func]:
+            if label(callee) in path:
+                continue
+            callee_calls = stats.stats[callee][1]
+            calls = stats.stats[callee][4][func][1]
+            if callee_calls:
+                walk(callee, path + [label(callee)],
+                     share * float(calls) / callee_calls)
+
+    for root in roots:
+        walk(root, [label(root)], 1.0)
+    return stacks
+
+
+def _profile_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for filename in sorted(files):
+                    yield os.path.join(root, filename)
+        else:
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sums quark profiles into collapsed stacks, the input"
+                    " flamegraph.pl expects. Sampled profiles count samples"
+                    " and cProfile ones microseconds, so sum one kind at a"
+                    " time.")
+    parser.add_argument("paths", nargs="+",
+                        help="Profiles, or directories of them.")
+    args = parser.parse_args()
+
+    stacks = collections.defaultdict(float)
+    for path in _profile_files(args.paths):
+        if path.endswith(".folded"):
+            with open(path) as f:
+                for line in f:
+                    stack, _sep, count = line.rstrip("\n").rpartition(" ")
+                    stacks[stack] += int(count)
+        elif path.endswith(".prof"):
+            # NOTE: pstats times are in seconds, weighed as microseconds
+            for stack, seconds in collapse_pstats(
+                    pstats.Stats(path)).items():
+                stacks[stack] += seconds * 1000000
+    for stack, weight in sorted(stacks.items()):
+        if int(weight):
+            sys.stdout.write("%s %d\n" % (stack, weight))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from quark.benchmarks import stats
+from quark.tests import test_base
+
+
+class TestPercentile(test_base.TestBase):
+    def test_empty(self):
+        self.assertIsNone(stats.percentile([], 50))
+
+    def test_nearest_rank(self):
+        values = range(100, 0, -1)
+        self.assertEqual(stats.percentile(values, 50), 50)
+        self.assertEqual(stats.percentile(values, 99), 99)
+        self.assertEqual(stats.percentile(values, 100), 100)
+        self.assertEqual(stats.percentile(values, 0), 1)
+
+
+class TestSummarize(test_base.TestBase):
+    def test_summarize(self):
+        summary = stats.summarize([0.001, 0.002, 0.004], 2.0,
+                                  dict(retries=3))
+        self.assertEqual(summary["operations"], 3)
+        self.assertEqual(summary["throughput"], 1.5)
+        self.assertEqual(summary["latency_ms"]["p50"], 2.0)
+        self.assertEqual(summary["latency_ms"]["max"], 4.0)
+        self.assertEqual(summary["retries"], 3)
+
+    def test_summarize_nothing(self):
+        summary = stats.summarize([], 0)
+        self.assertIsNone(summary["throughput"])
+        self.assertIsNone(summary["latency_ms"]["p99"])
+
+
+class TestCounters(test_base.TestBase):
+    def test_add_update_reset(self):
+        counters = stats.Counters()
+        counters.add("retries")
+        counters.add("lock_wait_seconds", 0.5)
+        counters.update(dict(retries=2, errors=1))
+        self.assertEqual(counters.snapshot(),
+                         dict(retries=3, lock_wait_seconds=0.5, errors=1))
+        counters.reset()
+        self.assertEqual(counters.snapshot(), {})
@@ -0,0 +1,63 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import aiclib
+from neutron.openstack.common import uuidutils
+
+from quark.drivers import base
+
+
+class FakeNVPDriver(base.BaseDriver):
+    """Keeps logical ports in memory the way NVP would.
+
+    Ports get an lport uuid of their own, as they do from NVP, and
+    create_port can be made to fail with fail().
+    """
+
+    def __init__(self):
+        super(FakeNVPDriver, self).__init__()
+        self.lports = {}
+        self.failures = []
+
+    @classmethod
+    def get_name(klass):
+        return "FAKE_NVP"
+
+    def fail(self, count=1, code=503):
+        """Makes the next count calls to create_port fail with code."""
+        self.failures.extend([code] * count)
+
+    def create_port(self, context, network_id, port_id, status=True,
+                    security_groups=None, device_id="",
+                    security_group_models=None):
+        if self.failures:
+            raise aiclib.core.AICException(self.failures.pop(0),
+                                           "fake NVP failure")
+        lport = dict(uuid=uuidutils.generate_uuid(), lswitch=network_id,
+                     port_id=port_id, tenant_id=context.tenant_id,
+                     admin_status_enabled=status, device_id=device_id,
+                     security_groups=list(security_groups or []))
+        self.lports[lport["uuid"]] = lport
+        return dict(lport)
+
+    def update_port(self, context, port_id, status=True,
+                    security_groups=None, security_group_models=None):
+        lport = self.lports[port_id]
+        lport["admin_status_enabled"] = status
+        lport["security_groups"] = list(security_groups or [])
+        return dict(lport)
+
+    def delete_port(self, context, port_id, **kwargs):
+        self.lports.pop(port_id, None)
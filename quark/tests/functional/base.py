@@ -1,9 +1,13 @@
+import contextlib
+
 from neutron import context
 from neutron.db import api as neutron_db_api
 from oslo.config import cfg
 from sqlalchemy.orm import configure_mappers
 
+from quark.db import audit
 from quark.db import models
+from quark import ipam
 from quark.tests import test_base
 
 
@@ -14,6 +18,16 @@ class BaseFunctionalTest(test_base.TestBase):
         cfg.CONF.set_override('connection', 'sqlite://', 'database')
         configure_mappers()
         models.BASEV2.metadata.create_all(neutron_db_api.get_engine())
+        # NOTE: per-worker IPAM state would outlive the database
+        ipam.SUBNET_AVAILABILITY.clear()
 
     def tearDown(self):
         models.BASEV2.metadata.drop_all(neutron_db_api.get_engine())
+
+    @contextlib.contextmanager
+    def assertStatementBudget(self, budget):
+        """Fails if the block runs more than budget statements."""
+        with audit.recording() as log:
+            yield log
+        self.assertTrue(log.count <= budget,
+                        "Over a budget of %d: %s" % (budget, log.summary()))
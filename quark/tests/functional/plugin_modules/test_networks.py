@@ -19,6 +19,7 @@ import mock
 import netaddr
 from neutron.common import exceptions
 from neutron.common import rpc
+from oslo.config import cfg
 
 from quark.db import api as db_api
 import quark.ipam
@@ -81,3 +82,39 @@ class QuarkDeleteNetworKDeallocatedIPs(QuarkNetworkFunctionalTest):
                 self.plugin.delete_network(self.context, net_mod["id"])
             except Exception:
                 self.fail("delete network raised")
+
+
+class QuarkGetNetworksPaginated(QuarkNetworkFunctionalTest):
+    def setUp(self):
+        super(QuarkGetNetworksPaginated, self).setUp()
+        self.plugin = quark.plugin.Plugin()
+        with self.context.session.begin():
+            for i in xrange(5):
+                db_api.network_create(self.context, name="net%d" % i,
+                                      tenant_id="fake", network_plugin="BASE")
+        nets = db_api.network_find(self.context, scope=db_api.ALL)
+        self.nets = [net["id"] for net in
+                     sorted(nets, key=lambda n: (n["created_at"], n["id"]))]
+
+    def _ids(self, nets):
+        return [net["id"] for net in nets]
+
+    def test_pages_follow_marker(self):
+        page = list(self.plugin.get_networks(self.context, {}, limit=2))
+        self.assertEqual(self._ids(page), self.nets[:2])
+        page = list(self.plugin.get_networks(self.context, {}, limit=2,
+                                             marker=page[-1]["id"]))
+        self.assertEqual(self._ids(page), self.nets[2:4])
+
+    def test_sorts(self):
+        page = list(self.plugin.get_networks(
+            self.context, {}, limit=5, sorts=[("name", False)]))
+        self.assertEqual([net["name"] for net in page],
+                         ["net4", "net3", "net2", "net1", "net0"])
+
+    def test_unlimited_listing_streams_in_batches(self):
+        cfg.CONF.set_override("db_page_size", 2, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "db_page_size", "QUARK")
+        nets = self.plugin.get_networks(self.context, {})
+        self.assertEqual(next(nets)["id"], self.nets[0])
+        self.assertEqual(self._ids(nets), self.nets[1:])
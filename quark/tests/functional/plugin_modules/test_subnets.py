@@ -15,8 +15,11 @@
 
 import contextlib
 
+from oslo.config import cfg
+
 from quark.db import api as db_api
 import quark.ipam
+import quark.plugin
 from quark.tests.functional.base import BaseFunctionalTest
 
 
@@ -43,3 +46,39 @@ class QuarkGetSubnets(BaseFunctionalTest):
                                                            net["id"]).all()
             self.assertEqual(len(subnets), 1)
             self.assertEqual(subnets[0][0]["id"], "1")
+
+
+class QuarkGetSubnetsPaginated(BaseFunctionalTest):
+    def setUp(self):
+        super(QuarkGetSubnetsPaginated, self).setUp()
+        self.plugin = quark.plugin.Plugin()
+        network = dict(name="public", tenant_id="fake", network_plugin="BASE")
+        with self.context.session.begin():
+            net_mod = db_api.network_create(self.context, **network)
+            for i in xrange(5):
+                db_api.subnet_create(self.context, network=net_mod,
+                                     ip_version=4, ip_policy=None,
+                                     cidr="0.0.%d.0/24" % i, tenant_id="fake")
+        subnets = db_api.subnet_find(self.context, scope=db_api.ALL)
+        self.subnets = [subnet["id"] for subnet in sorted(
+            subnets, key=lambda s: (s["created_at"], s["id"]))]
+
+    def _ids(self, subnets):
+        return [subnet["id"] for subnet in subnets]
+
+    def test_pages_follow_marker(self):
+        page = list(self.plugin.get_subnets(self.context, {}, limit=2))
+        self.assertEqual(self._ids(page), self.subnets[:2])
+        page = list(self.plugin.get_subnets(self.context, {}, limit=2,
+                                            marker=page[-1]["id"]))
+        self.assertEqual(self._ids(page), self.subnets[2:4])
+        page = list(self.plugin.get_subnets(self.context, {}, limit=2,
+                                            marker=page[0]["id"],
+                                            page_reverse=True))
+        self.assertEqual(self._ids(page), self.subnets[:2])
+
+    def test_unlimited_listing_walks_batches(self):
+        cfg.CONF.set_override("db_page_size", 2, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "db_page_size", "QUARK")
+        subnets = self.plugin.get_subnets(self.context, {})
+        self.assertEqual(self._ids(subnets), self.subnets)
@@ -0,0 +1,67 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from neutron.common import rpc
+from oslo.config import cfg
+
+from quark.benchmarks import ipam as ipam_benchmark
+from quark.db import api as db_api
+import quark.ipam
+from quark.tests.functional.base import BaseFunctionalTest
+
+
+class QuarkIpamBenchmark(BaseFunctionalTest):
+    def setUp(self):
+        super(QuarkIpamBenchmark, self).setUp()
+        patcher = mock.patch("neutron.common.rpc.messaging")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        rpc.init(mock.MagicMock())
+
+        cfg.CONF.register_opts(ipam_benchmark.cli_opts)
+        for name, value in (("v4_subnets", 2), ("v4_prefix", 28),
+                            ("v6_subnets", 1), ("fill", 0.5),
+                            ("churn", 0)):
+            cfg.CONF.set_override(name, value)
+            self.addCleanup(cfg.CONF.clear_override, name)
+        ipam_benchmark.COUNTERS.reset()
+        quark.ipam.MAC_BLOCKS.clear()
+        self.addCleanup(quark.ipam.MAC_BLOCKS.clear)
+
+    def test_seed_network(self):
+        net_id = ipam_benchmark.seed_network(self.context, "ANY")
+        subnets = db_api.subnet_find(self.context, network_id=net_id)
+        self.assertEqual(len(subnets), 3)
+        v4 = db_api.subnet_find_allocation_counts(self.context, net_id,
+                                                  ip_version=4).all()
+        self.assertEqual(len(v4), 2)
+        for subnet, count in v4:
+            # NOTE: half of the 14 usable addresses in a /28
+            self.assertEqual(count, 7)
+            self.assertEqual(subnet["ip_policy"]["size"], 2)
+
+    def test_run_ports(self):
+        ipam_benchmark.seed_mac_range(self.context)
+        ipam_benchmark.seed_mac_range(self.context)
+        self.assertEqual(len(db_api.mac_address_range_find(self.context)), 1)
+
+        net_id = ipam_benchmark.seed_network(self.context, "ANY")
+        latencies = ipam_benchmark.run_ports(
+            ipam_benchmark._strategy("ANY"), net_id, 3, context=self.context)
+        self.assertEqual(len(latencies), 3)
+        counters = ipam_benchmark.COUNTERS.snapshot()
+        self.assertNotIn("errors", counters)
+        self.assertNotIn("deadlocks", counters)
@@ -72,6 +72,83 @@ class QuarkIPAddressAllocate(QuarkIpamBaseFunctionalTest):
             self.assertEqual(ipaddress[0]['used_by_tenant_id'], "fake")
 
 
+class QuarkIPAddressAllocateBulk(QuarkIpamBaseFunctionalTest):
+    @contextlib.contextmanager
+    def _stubs(self, network, subnet, ipam=quark.ipam.QuarkIpamANY):
+        self.ipam = ipam()
+        with self.context.session.begin():
+            net_mod = db_api.network_create(self.context, **network)
+            subnet["network"] = net_mod
+            sub_mod = db_api.subnet_create(self.context, **subnet)
+        yield net_mod, sub_mod
+
+    def _allocate(self, net, port_ids):
+        addresses = {}
+        self.ipam.allocate_ip_addresses(self.context, addresses, net["id"],
+                                        port_ids, 0)
+        return [[str(netaddr.IPAddress(a["address"]).ipv4())
+                 for a in addresses[port_id]] for port_id in port_ids]
+
+    def test_allocate_block(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/24", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        with self._stubs(network, subnet) as (net, sub):
+            self.assertEqual(self._allocate(net, ["1", "2", "3"]),
+                             [["0.0.0.0"], ["0.0.0.1"], ["0.0.0.2"]])
+            self.assertEqual(self._allocate(net, ["4"]), [["0.0.0.3"]])
+
+    def test_allocate_block_free_range(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/30", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        with self._stubs(network, subnet,
+                         quark.ipam.QuarkIpamANYFreeRange) as (net, sub):
+            self.assertEqual(self._allocate(net, ["1", "2"]),
+                             [["0.0.0.0"], ["0.0.0.1"]])
+            self.assertEqual(self._allocate(net, ["3", "4"]),
+                             [["0.0.0.2"], ["0.0.0.3"]])
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self._allocate(net, ["5"])
+
+
+class QuarkIPAddressAllocationCounts(QuarkIpamBaseFunctionalTest):
+    @contextlib.contextmanager
+    def _stubs(self, network, subnet):
+        self.ipam = quark.ipam.QuarkIpamANY()
+        with self.context.session.begin():
+            net_mod = db_api.network_create(self.context, **network)
+            subnet["network"] = net_mod
+            sub_mod = db_api.subnet_create(self.context, **subnet)
+        yield net_mod, sub_mod
+
+    def _counts(self, sub):
+        self.context.session.expire_all()
+        subnet, count = db_api.subnet_find_allocation_counts(
+            self.context, sub["network_id"], subnet_id=[sub["id"]]).first()
+        return subnet["generated_count"], subnet["allocated_count"], count
+
+    def test_counts_follow_allocate_and_deallocate(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/24", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        with self._stubs(network, subnet) as (net, sub):
+            self.assertEqual(self._counts(sub), (0, 0, 0))
+
+            ipaddress = []
+            self.ipam.allocate_ip_address(self.context, ipaddress,
+                                          net["id"], 0, 0)
+            self.assertEqual(self._counts(sub), (1, 1, 1))
+
+            with self.context.session.begin():
+                self.ipam.deallocate_ip_address(self.context, ipaddress[0])
+            self.assertEqual(self._counts(sub), (1, 0, 1))
+
+            with self.context.session.begin():
+                self.context.session.delete(ipaddress[0])
+            self.assertEqual(self._counts(sub), (0, 0, 0))
+
+
 class QuarkIPAddressReallocate(QuarkIpamBaseFunctionalTest):
     @contextlib.contextmanager
     def _stubs(self, network, subnet, address):
@@ -87,6 +164,7 @@ class QuarkIPAddressReallocate(QuarkIpamBaseFunctionalTest):
             ip = db_api.ip_address_create(self.context, **address)
             address.pop("address")
             db_api.ip_address_update(self.context, ip, **address)
+            db_api.ip_address_reuse_enqueue(self.context, ip)
 
             # NOTE(asadoughi): update after cidr constructor has been invoked
             db_api.subnet_update(self.context,
@@ -139,6 +217,55 @@ class QuarkIPAddressReallocate(QuarkIpamBaseFunctionalTest):
                                               0, 0)
 
 
+class QuarkIPAddressReuseQueue(QuarkIpamBaseFunctionalTest):
+    @contextlib.contextmanager
+    def _stubs(self, network, subnet):
+        self.ipam = quark.ipam.QuarkIpamANY()
+        with self.context.session.begin():
+            net_mod = db_api.network_create(self.context, **network)
+            subnet["network"] = net_mod
+            db_api.subnet_create(self.context, **subnet)
+        yield net_mod
+
+    def test_deallocated_ip_is_reallocated_from_queue(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/24", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        with self._stubs(network, subnet) as net:
+            ipaddress = []
+            self.ipam.allocate_ip_address(self.context, ipaddress,
+                                          net["id"], 0, 0)
+            with self.context.session.begin():
+                self.ipam.deallocate_ip_address(self.context, ipaddress[0])
+            self.assertEqual(
+                db_api.ip_address_reuse_find(self.context, net["id"], 0),
+                [ipaddress[0]["id"]])
+
+            reallocated = []
+            self.ipam.allocate_ip_address(self.context, reallocated,
+                                          net["id"], 0, 0)
+            self.assertEqual(reallocated[0]["id"], ipaddress[0]["id"])
+            self.assertFalse(reallocated[0]["_deallocated"])
+            self.assertEqual(
+                db_api.ip_address_reuse_find(self.context, net["id"], 0), [])
+
+    def test_queued_ip_waits_for_reuse_after(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/24", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        with self._stubs(network, subnet) as net:
+            ipaddress = []
+            self.ipam.allocate_ip_address(self.context, ipaddress,
+                                          net["id"], 0, 0)
+            with self.context.session.begin():
+                self.ipam.deallocate_ip_address(self.context, ipaddress[0])
+
+            reallocated = []
+            self.ipam.allocate_ip_address(self.context, reallocated,
+                                          net["id"], 0, 3600)
+            self.assertNotEqual(reallocated[0]["id"], ipaddress[0]["id"])
+
+
 class QuarkIPAddressFindReallocatable(QuarkIpamBaseFunctionalTest):
     @contextlib.contextmanager
     def _stubs(self, network, subnet):
@@ -180,3 +307,175 @@ class QuarkIPAddressFindReallocatable(QuarkIpamBaseFunctionalTest):
                 db_api.ip_address_find(self.context, **ip_kwargs)
             except Exception:
                 self.fail("This should not have raised")
+
+
+class QuarkIPAddressAllocateFreeRange(QuarkIpamBaseFunctionalTest):
+    @contextlib.contextmanager
+    def _stubs(self, network, subnet, addresses=None):
+        self.ipam = quark.ipam.QuarkIpamANYFreeRange()
+        with self.context.session.begin():
+            net_mod = db_api.network_create(self.context, **network)
+            subnet["network"] = net_mod
+            sub_mod = db_api.subnet_create(self.context, **subnet)
+            for addr in addresses or []:
+                db_api.ip_address_create(self.context, address=addr,
+                                         subnet_id=sub_mod["id"],
+                                         network_id=net_mod["id"], version=4)
+        yield net_mod
+
+    def _allocate(self, net):
+        ipaddress = []
+        self.ipam.allocate_ip_address(self.context, ipaddress, net["id"],
+                                      0, 0)
+        return netaddr.IPAddress(ipaddress[0]["address"]).ipv4()
+
+    def test_allocate_skips_generated_addresses(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/29", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        existing = [netaddr.IPAddress("0.0.0.0"),
+                    netaddr.IPAddress("0.0.0.2")]
+        with self._stubs(network, subnet, existing) as net:
+            self.assertEqual(self._allocate(net), netaddr.IPAddress("0.0.0.1"))
+            self.assertEqual(self._allocate(net), netaddr.IPAddress("0.0.0.3"))
+
+    def test_allocate_rebuilds_stale_ranges_without_retrying(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/29", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        with self._stubs(network, subnet) as net:
+            self.assertEqual(self._allocate(net), netaddr.IPAddress("0.0.0.0"))
+            # NOTE: simulate another worker allocating behind our back
+            with self.context.session.begin():
+                sub = db_api.subnet_find(self.context, network_id=net["id"],
+                                         scope=db_api.ONE)
+                db_api.ip_address_create(
+                    self.context, address=netaddr.IPAddress("0.0.0.1"),
+                    subnet_id=sub["id"], network_id=net["id"], version=4)
+            with mock.patch("quark.ipam.LOG") as log:
+                self.assertEqual(self._allocate(net),
+                                 netaddr.IPAddress("0.0.0.2"))
+                self.assertFalse(log.exception.called)
+
+    def test_allocate_exhausted_subnet_raises(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/31", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        with self._stubs(network, subnet) as net:
+            self._allocate(net)
+            self._allocate(net)
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self._allocate(net)
+            sub = db_api.subnet_find(self.context, network_id=net["id"],
+                                     scope=db_api.ONE)
+            self.assertEqual(sub["next_auto_assign_ip"], -1)
+
+    def test_select_subnet_statements_independent_of_subnets(self):
+        network = dict(name="public", tenant_id="fake")
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, **network)
+            for i in xrange(5):
+                policy = db_api.ip_policy_create(
+                    self.context, exclude=["0.0.%d.0/31" % i])
+                db_api.subnet_create(
+                    self.context, network=net, cidr="0.0.%d.0/24" % i,
+                    ip_policy=policy, tenant_id="fake", do_not_use=False)
+        self.ipam = quark.ipam.QuarkIpamANYFreeRange()
+        self.ipam.select_subnet(self.context, net["id"], None, None)
+        self.context.session.expire_all()
+        with self.assertStatementBudget(1):
+            self.ipam.select_subnet(self.context, net["id"], None, None)
+
+
+class QuarkIPAddressAllocateOptimistic(QuarkIpamBaseFunctionalTest):
+    @contextlib.contextmanager
+    def _stubs(self, network, subnet, addresses=None):
+        self.ipam = quark.ipam.QuarkIpamANYOptimistic()
+        with self.context.session.begin():
+            net_mod = db_api.network_create(self.context, **network)
+            subnet["network"] = net_mod
+            sub_mod = db_api.subnet_create(self.context, **subnet)
+            for addr in addresses or []:
+                db_api.ip_address_create(self.context, address=addr,
+                                         subnet_id=sub_mod["id"],
+                                         network_id=net_mod["id"], version=4)
+        yield net_mod
+
+    def _allocate(self, net):
+        ipaddress = []
+        self.ipam.allocate_ip_address(self.context, ipaddress, net["id"],
+                                      0, 0)
+        return netaddr.IPAddress(ipaddress[0]["address"]).ipv4()
+
+    def _cursor(self, net):
+        sub = db_api.subnet_find(self.context, network_id=net["id"],
+                                 scope=db_api.ONE)
+        return db_api.subnet_find_next_auto_assign_ip(self.context,
+                                                      sub["id"])
+
+    def test_allocate_advances_cursor(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/29", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        with self._stubs(network, subnet) as net:
+            self.assertEqual(self._allocate(net), netaddr.IPAddress("0.0.0.0"))
+            self.assertEqual(self._allocate(net), netaddr.IPAddress("0.0.0.1"))
+            self.assertEqual(self._cursor(net),
+                             netaddr.IPAddress("::ffff:0.0.0.2").value)
+
+    def test_allocate_skips_address_taken_behind_cursor(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/29", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        existing = [netaddr.IPAddress("0.0.0.0")]
+        with self._stubs(network, subnet, existing) as net:
+            self.assertEqual(self._allocate(net), netaddr.IPAddress("0.0.0.1"))
+
+    def test_allocate_rereads_cursor_after_losing_swap(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/29", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        advance = db_api.subnet_advance_next_auto_assign_ip
+
+        # NOTE: stands in for another worker moving the cursor between our
+        #       read and our swap, once.
+        def racing_advance(context, subnet_id, current, following):
+            racing_advance.calls += 1
+            if racing_advance.calls == 1:
+                advance(context, subnet_id, current, current + 3)
+            return advance(context, subnet_id, current, following)
+        racing_advance.calls = 0
+
+        with self._stubs(network, subnet) as net:
+            with mock.patch("quark.db.api.subnet_advance_next_auto_assign_ip",
+                            side_effect=racing_advance):
+                self.assertEqual(self._allocate(net),
+                                 netaddr.IPAddress("0.0.0.3"))
+            self.assertEqual(racing_advance.calls, 2)
+
+    def test_allocate_block_claims_cursor_once(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/29", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        with self._stubs(network, subnet) as net:
+            sub = db_api.subnet_find(self.context, network_id=net["id"],
+                                     scope=db_api.ONE)
+            addresses = self.ipam._allocate_block_from_subnet(
+                self.context, net["id"], sub, 3)
+            self.assertEqual([netaddr.IPAddress(a["address"]).ipv4()
+                              for a in addresses],
+                             [netaddr.IPAddress("0.0.0.%d" % i)
+                              for i in xrange(3)])
+            self.assertEqual(self._cursor(net),
+                             netaddr.IPAddress("::ffff:0.0.0.3").value)
+
+    def test_allocate_exhausted_subnet_raises(self):
+        network = dict(name="public", tenant_id="fake")
+        subnet = dict(cidr="0.0.0.0/31", ip_policy=None, tenant_id="fake",
+                      do_not_use=False)
+        with self._stubs(network, subnet) as net:
+            self._allocate(net)
+            self._allocate(net)
+            self.assertEqual(self._cursor(net), -1)
+            with self.assertRaises(exceptions.IpAddressGenerationFailure):
+                self._allocate(net)
@@ -0,0 +1,115 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for# the specific language governing permissions and limitations
+#  under the License.
+
+import aiclib
+import mock
+
+from quark.drivers import optimized_nvp_driver as nvp
+from quark.tests.functional.base import BaseFunctionalTest
+
+
+class QuarkOptimizedNVPDeletePorts(BaseFunctionalTest):
+    def setUp(self):
+        super(QuarkOptimizedNVPDeletePorts, self).setUp()
+        self.driver = nvp.OptimizedNVPDriver()
+        self.connection = mock.Mock()
+        self.connection.lswitch_port.side_effect = self._lswitch_port
+        patcher = mock.patch.object(self.driver, "get_connection",
+                                    return_value=self.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.deleted = []
+        self.failures = {}
+
+        session = self.context.session
+        with session.begin():
+            for i, port_ids in ((1, ["lport1", "lport2"]),
+                                (2, ["lport3", "lport4"])):
+                switch = nvp.LSwitch(id="switch%d" % i,
+                                     nvp_id="nvp-switch%d" % i,
+                                     network_id="net", port_count=2)
+                switch.ports = [nvp.LSwitchPort(id=port_id,
+                                                port_id=port_id)
+                                for port_id in port_ids]
+                session.add(switch)
+            profile = nvp.SecurityProfile(id="group", nvp_id="nvp-group",
+                                          rule_count=2)
+            profile.lswitch_ports = [switch.ports[0]]
+            session.add(profile)
+
+    def _lswitch_port(self, lswitch_uuid, port_id):
+        lport = mock.Mock()
+        if port_id in self.failures:
+            lport.delete.side_effect = self.failures[port_id]
+        else:
+            lport.delete.side_effect = (
+                lambda: self.deleted.append((lswitch_uuid, port_id)))
+        return lport
+
+    def _delete_ports(self, port_ids):
+        with self.context.session.begin():
+            self.driver.delete_ports(self.context, port_ids)
+        self.context.session.expire_all()
+
+    def _query(self, model):
+        return self.context.session.query(model).order_by(model.id).all()
+
+    def test_delete_ports(self):
+        self._delete_ports(["lport1", "lport3"])
+        self.assertEqual(sorted(self.deleted),
+                         [("nvp-switch1", "lport1"),
+                          ("nvp-switch2", "lport3")])
+        self.assertEqual([lport.port_id
+                          for lport in self._query(nvp.LSwitchPort)],
+                         ["lport2", "lport4"])
+        self.assertEqual([switch.port_count
+                          for switch in self._query(nvp.LSwitch)], [1, 1])
+
+    def test_delete_ports_with_profiles(self):
+        self._delete_ports(["lport3", "lport4"])
+        profile, = self._query(nvp.SecurityProfile)
+        self.assertEqual(profile.lswitch_ports, [])
+
+    def test_delete_ports_empties_switch(self):
+        self._delete_ports(["lport1", "lport2"])
+        self.assertEqual([switch.id for switch in self._query(nvp.LSwitch)],
+                         ["switch2"])
+        self.connection.lswitch.assert_called_with("nvp-switch1")
+
+    def test_delete_ports_keeps_last_switch(self):
+        self._delete_ports(["lport1", "lport2", "lport3", "lport4"])
+        switches = self._query(nvp.LSwitch)
+        self.assertEqual(len(switches), 1)
+        self.assertEqual(switches[0].port_count, 0)
+
+    def test_delete_ports_records_orphans(self):
+        self.failures = {"lport1": aiclib.core.AICException(500, "failed"),
+                         "lport2": aiclib.core.AICException(404, "gone"),
+                         "lport3": Exception("failed")}
+        self._delete_ports(["lport1", "lport2", "lport3"])
+        self.assertEqual([orphan.port_id
+                          for orphan in self._query(nvp.OrphanedLSwitchPort)],
+                         ["lport1"])
+        self.assertEqual([lport.port_id
+                          for lport in self._query(nvp.LSwitchPort)],
+                         ["lport4"])
+
+    def test_delete_ports_connection_per_delete(self):
+        self._delete_ports(["lport1", "lport3"])
+        self.assertEqual(self.driver.get_connection.call_count, 2)
+
+    def test_delete_ports_unknown(self):
+        self._delete_ports(["lport5"])
+        self.assertFalse(self.connection.lswitch_port.called)
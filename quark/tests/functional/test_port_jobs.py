@@ -0,0 +1,125 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for# the specific language governing permissions and limitations
+#  under the License.
+
+import mock
+from oslo.config import cfg
+
+from quark.db import api as db_api
+from quark.db import models
+from quark.drivers import registry
+from quark import port_jobs
+from quark.tests import fake_nvp
+from quark.tests.functional.base import BaseFunctionalTest
+
+
+class QuarkPortJobs(BaseFunctionalTest):
+    def setUp(self):
+        super(QuarkPortJobs, self).setUp()
+        self.nvp = fake_nvp.FakeNVPDriver()
+        patcher = mock.patch.dict(registry.DRIVER_REGISTRY.drivers,
+                                  {self.nvp.get_name(): self.nvp})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._override("port_job_backoff", 0)
+
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, name="public",
+                                        network_plugin=self.nvp.get_name())
+            self.group = db_api.security_group_create(self.context,
+                                                      name="group")
+            self.port = db_api.port_create(
+                self.context, network_id=net["id"], backend_key="pending",
+                device_id="device", status="BUILD",
+                security_groups=[self.group])
+            db_api.port_job_create(self.context, self.port["id"])
+        self.port_id = self.port["id"]
+
+    def _override(self, name, value):
+        cfg.CONF.set_override(name, value, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, name, "QUARK")
+
+    def _due(self):
+        self.context.session.expire_all()
+        return [port_jobs._job_values(job)
+                for job in db_api.port_job_find_due(self.context)]
+
+    def _jobs(self):
+        self.context.session.expire_all()
+        return self.context.session.query(models.PortJob).all()
+
+    def _port(self):
+        self.context.session.expire_all()
+        return db_api.port_find(self.context, id=self.port_id,
+                                scope=db_api.ONE)
+
+    def test_creates_backend_port(self):
+        job, = self._due()
+        self.assertTrue(port_jobs.run_job(job))
+        port = self._port()
+        self.assertEqual(port["status"], "ACTIVE")
+        lport = self.nvp.lports[port["backend_key"]]
+        self.assertEqual(lport["port_id"], self.port_id)
+        self.assertEqual(lport["tenant_id"], "fake")
+        self.assertEqual(lport["security_groups"], [self.group["id"]])
+        self.assertEqual(self._jobs(), [])
+
+    def test_claimed_once(self):
+        job, = self._due()
+        self.assertTrue(port_jobs.run_job(job))
+        self.assertFalse(port_jobs.run_job(job))
+        self.assertEqual(len(self.nvp.lports), 1)
+
+    def test_retried(self):
+        self.nvp.fail()
+        port_jobs.run_job(self._due()[0])
+        job, = self._jobs()
+        self.assertEqual(job["state"], models.PortJob.PENDING)
+        self.assertEqual(job["attempts"], 1)
+        self.assertIn("fake NVP failure", job["last_error"])
+        self.assertEqual(self._port()["status"], "BUILD")
+
+        port_jobs.run_job(self._due()[0])
+        self.assertEqual(self._port()["status"], "ACTIVE")
+
+    def test_gives_up(self):
+        self._override("port_job_max_attempts", 2)
+        self.nvp.fail(2)
+        for i in xrange(2):
+            port_jobs.run_job(self._due()[0])
+        job, = self._jobs()
+        self.assertEqual(job["state"], models.PortJob.FAILED)
+        self.assertEqual(self._due(), [])
+        self.assertEqual(self._port()["status"], "ERROR")
+
+    def test_port_deleted_while_creating(self):
+        create_port = self.nvp.create_port
+
+        def _create_port(context, *args, **kwargs):
+            lport = create_port(context, *args, **kwargs)
+            with self.context.session.begin():
+                db_api.port_job_delete(self.context, port_id=self.port_id)
+            return lport
+
+        with mock.patch.object(self.nvp, "create_port", _create_port):
+            port_jobs.run_job(self._due()[0])
+        self.assertEqual(self.nvp.lports, {})
+        self.assertEqual(self._port()["status"], "BUILD")
+
+    def test_worker(self):
+        worker = port_jobs.Worker()
+        self.assertEqual(worker.run_once(), 1)
+        worker.pool.waitall()
+        self.assertEqual(self._port()["status"], "ACTIVE")
+        self.assertEqual(worker.run_once(), 0)
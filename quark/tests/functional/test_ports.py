@@ -13,7 +13,12 @@
 # License for# the specific language governing permissions and limitations
 #  under the License.
 
+import netaddr
+from oslo.config import cfg
+
 from quark.db import api as db_api
+from quark import exceptions as q_exc
+import quark.plugin
 from quark.tests.functional.base import BaseFunctionalTest
 
 
@@ -38,6 +43,99 @@ class QuarkFindPortsSorted(BaseFunctionalTest):
         db_api.port_delete(self.context, port_mod3)
 
 
+class QuarkFindPortsPaginated(BaseFunctionalTest):
+    def setUp(self):
+        super(QuarkFindPortsPaginated, self).setUp()
+        network = dict(name="public", tenant_id="fake", network_plugin="BASE")
+        net_mod = db_api.network_create(self.context, **network)
+        for i in xrange(5):
+            db_api.port_create(self.context, network_id=net_mod["id"],
+                               backend_key="1", device_id=str(i),
+                               name="port%d" % (i % 2))
+        ports = db_api.port_find(self.context, scope=db_api.ALL)
+        self.ports = [port["id"] for port in ports]
+
+    def _ids(self, ports):
+        return [port["id"] for port in ports]
+
+    def test_pages_follow_marker(self):
+        page = db_api.paginate(db_api.port_find, self.context, limit=2)
+        self.assertEqual(self._ids(page), self.ports[:2])
+        page = db_api.paginate(db_api.port_find, self.context, limit=2,
+                               marker=page[-1]["id"])
+        self.assertEqual(self._ids(page), self.ports[2:4])
+        page = db_api.paginate(db_api.port_find, self.context, limit=2,
+                               marker=page[-1]["id"])
+        self.assertEqual(self._ids(page), self.ports[4:])
+
+    def test_page_reverse(self):
+        page = db_api.paginate(db_api.port_find, self.context, limit=2,
+                               marker=self.ports[3], page_reverse=True)
+        self.assertEqual(self._ids(page), self.ports[1:3])
+
+    def test_sorts(self):
+        page = db_api.paginate(db_api.port_find, self.context, limit=5,
+                               sorts=[("name", False), ("id", True)])
+        self.assertEqual([port["name"] for port in page],
+                         ["port1"] * 2 + ["port0"] * 3)
+        marker = page[1]["id"]
+        page = db_api.paginate(db_api.port_find, self.context, limit=5,
+                               marker=marker,
+                               sorts=[("name", False), ("id", True)])
+        self.assertEqual([port["name"] for port in page], ["port0"] * 3)
+
+    def test_invalid_sort_key(self):
+        with self.assertRaises(q_exc.InvalidSortKey):
+            db_api.paginate(db_api.port_find, self.context, limit=1,
+                            sorts=[("ip_addresses", True)])
+
+    def test_walks_everything_in_batches(self):
+        cfg.CONF.set_override("db_page_size", 2, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "db_page_size", "QUARK")
+        ports = db_api.paginate(db_api.port_find, self.context)
+        self.assertEqual(self._ids(ports), self.ports)
+
+
+class QuarkFindPortsFields(BaseFunctionalTest):
+    def setUp(self):
+        super(QuarkFindPortsFields, self).setUp()
+        network = dict(name="public", tenant_id="fake", network_plugin="BASE")
+        net_mod = db_api.network_create(self.context, **network)
+        subnet = db_api.subnet_create(self.context, network=net_mod,
+                                      cidr="192.168.0.0/24")
+        address = db_api.ip_address_create(
+            self.context, address=netaddr.IPAddress("192.168.0.10"),
+            subnet_id=subnet["id"], network_id=net_mod["id"], version=4)
+        group = db_api.security_group_create(self.context, name="group")
+        self.port = db_api.port_create(
+            self.context, network_id=net_mod["id"], backend_key="1",
+            device_id="device", addresses=[address], security_groups=[group])
+        self.subnet_id = subnet["id"]
+        self.group_id = group["id"]
+
+    def test_only_requested_columns(self):
+        ports = db_api.port_find_fields(self.context, ["device_id"],
+                                        scope=db_api.ALL)
+        self.assertEqual(ports, [dict(id=self.port["id"],
+                                      device_id="device")])
+
+    def test_relations(self):
+        port = db_api.port_find_fields(
+            self.context, ["fixed_ips", "security_groups"],
+            id=self.port["id"], scope=db_api.ONE)
+        self.assertEqual(port["security_groups"], [self.group_id])
+        self.assertEqual(port["ip_addresses"], [
+            dict(subnet_id=self.subnet_id,
+                 address_readable="192.168.0.10", version=4)])
+
+    def test_projectable(self):
+        self.assertTrue(db_api.port_fields_projectable(
+            ["id", "device_id", "fixed_ips", "status"]))
+        self.assertFalse(db_api.port_fields_projectable(
+            ["id", "port_subnets"]))
+        self.assertFalse(db_api.port_fields_projectable(None))
+
+
 class QuarkFindPortsFilterByDeviceOwner(BaseFunctionalTest):
     def test_port_list_device_owner_found_returns_only_those(self):
         # create a network
@@ -66,3 +164,61 @@ class QuarkFindPortsFilterByDeviceOwner(BaseFunctionalTest):
         db_api.port_delete(self.context, port_mod1)
         db_api.port_delete(self.context, port_mod2)
         db_api.port_delete(self.context, port_mod3)
+
+
+class QuarkGetPortsStatements(BaseFunctionalTest):
+    def setUp(self):
+        super(QuarkGetPortsStatements, self).setUp()
+        self.plugin = quark.plugin.Plugin()
+        network = dict(name="public", tenant_id="fake", network_plugin="BASE")
+        self.net = db_api.network_create(self.context, **network)
+        self.group = db_api.security_group_create(self.context, name="group")
+        self.subnet = db_api.subnet_create(self.context, network=self.net,
+                                           cidr="192.168.0.0/24")
+        self.addresses = 0
+
+    def _create_ports(self, count):
+        for i in xrange(count):
+            self.addresses += 1
+            address = db_api.ip_address_create(
+                self.context,
+                address=netaddr.IPAddress("192.168.0.%d" % self.addresses),
+                subnet_id=self.subnet["id"], network_id=self.net["id"],
+                version=4)
+            db_api.port_create(self.context, network_id=self.net["id"],
+                               backend_key="1", device_id=str(i),
+                               addresses=[address],
+                               security_groups=[self.group])
+        self.context.session.flush()
+
+    def test_list_does_not_grow_with_ports(self):
+        # NOTE: the ports, then their addresses and groups
+        self._create_ports(1)
+        with self.assertStatementBudget(3):
+            ports = list(self.plugin.get_ports(self.context))
+        self.assertEqual(len(ports), 1)
+
+        self._create_ports(5)
+        with self.assertStatementBudget(3):
+            ports = list(self.plugin.get_ports(self.context))
+        self.assertEqual(len(ports), 6)
+        self.assertEqual(ports[0]["security_groups"], [self.group["id"]])
+
+    def test_list_with_subnets_does_not_grow_with_ports(self):
+        # NOTE: plus the subnets, their nameservers, routes, policies and
+        #       the policies' excluded ranges
+        fields = ["id", "fixed_ips", "port_subnets"]
+        self._create_ports(1)
+        with self.assertStatementBudget(8):
+            ports = list(self.plugin.get_ports(self.context,
+                                               fields=fields))
+        self.assertEqual(len(ports), 1)
+
+        self._create_ports(5)
+        with self.assertStatementBudget(8):
+            ports = list(self.plugin.get_ports(self.context,
+                                               fields=fields))
+        self.assertEqual(len(ports), 6)
+        subnet = ports[0]["fixed_ips"][0]["subnet"]
+        self.assertEqual(subnet["id"], self.subnet["id"])
+        self.assertEqual(subnet["cidr"], "192.168.0.0/24")
@@ -118,10 +118,11 @@ class TestQuarkUpdateIPAddress(test_quark_plugin.TestQuarkPlugin):
         with contextlib.nested(
             mock.patch("%s.port_find" % db_mod),
             mock.patch("%s.ip_address_find" % db_mod),
-        ) as (port_find, ip_find):
+            mock.patch("%s.ip_address_reuse_enqueue" % db_mod),
+        ) as (port_find, ip_find, reuse_enqueue):
             port_find.return_value = port_models
             ip_find.return_value = addr_model
-            yield
+            yield reuse_enqueue
 
     def test_update_ip_address_does_not_exist(self):
         with self._stubs(ports=[], addr=None):
@@ -166,11 +167,12 @@ class TestQuarkUpdateIPAddress(test_quark_plugin.TestQuarkPlugin):
         path = 'quark.plugin_modules.ip_addresses'
         lookup = self._create_patch('%s._get_deallocated_override' % path)
 
-        with self._stubs(ports=[port], addr=ip):
+        with self._stubs(ports=[port], addr=ip) as reuse_enqueue:
             ip_address = {'ip_address': {'reset_allocation_time': True}}
             self.plugin.update_ip_address(self.admin_context, ip['id'],
                                           ip_address)
             self.assertTrue(lookup.called)
+            self.assertTrue(reuse_enqueue.called)
 
     def test_update_ip_address_update_deallocated_at_not_deallocated(self):
         port = dict(id=1, network_id=2, ip_addresses=[])
@@ -214,12 +216,14 @@ class TestQuarkUpdateIPAddress(test_quark_plugin.TestQuarkPlugin):
         port = dict(id=1, network_id=2, ip_addresses=[])
         ip = dict(id=1, address=3232235876, address_readable="192.168.1.100",
                   subnet_id=1, network_id=2, version=4)
-        with self._stubs(ports=[port], addr=ip, addr_ports=True):
+        with self._stubs(ports=[port], addr=ip,
+                         addr_ports=True) as reuse_enqueue:
             ip_address = {'ip_address': {'port_ids': []}}
             response = self.plugin.update_ip_address(self.context,
                                                      ip['id'],
                                                      ip_address)
             self.assertEqual(response['port_ids'], [])
+            self.assertTrue(reuse_enqueue.called)
 
 
 class TestQuarkGetIpAddresses(test_quark_plugin.TestQuarkPlugin):
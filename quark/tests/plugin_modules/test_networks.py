@@ -63,7 +63,7 @@ class TestQuarkGetNetworks(test_quark_plugin.TestQuarkPlugin):
         net = dict(id=1, tenant_id=self.context.tenant_id, name="public",
                    status="ACTIVE")
         with self._stubs(nets=[net], subnets=[subnet]):
-            nets = self.plugin.get_networks(self.context, {})
+            nets = list(self.plugin.get_networks(self.context, {}))
             for key in net.keys():
                 self.assertEqual(nets[0][key], net[key])
             self.assertEqual(nets[0]["subnets"][0], 1)
@@ -91,6 +91,9 @@ class TestQuarkGetNetworks(test_quark_plugin.TestQuarkPlugin):
 class TestQuarkGetNetworksShared(test_quark_plugin.TestQuarkPlugin):
     def setUp(self):
         super(TestQuarkGetNetworksShared, self).setUp()
+        # NOTE: an unlimited listing reads its first batch like this
+        self._page_args = dict(limit=cfg.CONF.QUARK.db_page_size,
+                               marker=None, sorts=None, page_reverse=False)
         self.strategy = {"public_network":
                          {"required": True,
                           "bridge": "xenbr0",
@@ -145,7 +148,8 @@ class TestQuarkGetNetworksShared(test_quark_plugin.TestQuarkPlugin):
         net1 = dict(id=1, tenant_id=self.context.tenant_id, name="mynet",
                     status="ACTIVE", subnets=[dict(id=1)])
         with self._stubs(nets=[net0, net1]) as net_find:
-            ret = self.plugin.get_networks(self.context, {"shared": [True]})
+            ret = list(self.plugin.get_networks(self.context,
+                                                {"shared": [True]}))
             """ Includes regression for RM8483. """
             for net in ret:
                 if net['shared']:
@@ -154,7 +158,8 @@ class TestQuarkGetNetworksShared(test_quark_plugin.TestQuarkPlugin):
                     self.assertEqual(1, len(net['subnets']))
             net_find.assert_called_with(self.context, None,
                                         join_subnets=True,
-                                        defaults=["public_network"])
+                                        defaults=["public_network"],
+                                        **self._page_args)
 
     def test_get_networks_shared_false(self):
         net0 = dict(id='public_network', tenant_id=self.context.tenant_id,
@@ -163,9 +168,10 @@ class TestQuarkGetNetworksShared(test_quark_plugin.TestQuarkPlugin):
                     status="ACTIVE")
         with self._stubs(nets=[net0, net1]) as net_find:
             invert = db_api.INVERT_DEFAULTS
-            self.plugin.get_networks(self.context, {"shared": [False]})
+            list(self.plugin.get_networks(self.context, {"shared": [False]}))
             net_find.assert_called_with(self.context, None, join_subnets=True,
-                                        defaults=[invert, "public_network"])
+                                        defaults=[invert, "public_network"],
+                                        **self._page_args)
 
     def test_get_networks_no_shared(self):
         net0 = dict(id='public_network', tenant_id=self.context.tenant_id,
@@ -173,9 +179,9 @@ class TestQuarkGetNetworksShared(test_quark_plugin.TestQuarkPlugin):
         net1 = dict(id=1, tenant_id=self.context.tenant_id, name="mynet",
                     status="ACTIVE")
         with self._stubs(nets=[net0, net1]) as net_find:
-            self.plugin.get_networks(self.context, {})
+            list(self.plugin.get_networks(self.context, {}))
             net_find.assert_called_with(self.context, None, join_subnets=True,
-                                        defaults=[])
+                                        defaults=[], **self._page_args)
 
 
 class TestQuarkGetNetworkCount(test_quark_plugin.TestQuarkPlugin):
@@ -394,6 +400,41 @@ class TestQuarkCreateNetwork(test_quark_plugin.TestQuarkPlugin):
                 self.plugin.create_network(admin_context, dict(network=net))
 
 
+class TestQuarkCreateNetworkBulk(test_quark_plugin.TestQuarkPlugin):
+    @contextlib.contextmanager
+    def _stubs(self):
+        net_mod = "quark.plugin_modules.networks"
+        with contextlib.nested(
+            mock.patch("%s.create_network" % net_mod),
+            mock.patch("%s.delete_network" % net_mod)
+        ) as (net_create, net_delete):
+            net_create.side_effect = lambda ctxt, net: dict(
+                id=net["network"]["name"], name=net["network"]["name"])
+            yield net_create, net_delete
+
+    def test_create_network_bulk(self):
+        nets = dict(networks=[dict(network=dict(name="public", tenant_id=0)),
+                              dict(network=dict(name="private",
+                                                tenant_id=0))])
+        with self._stubs() as (net_create, net_delete):
+            res = self.plugin.create_network_bulk(self.context, nets)
+            self.assertEqual(net_create.call_count, 2)
+            self.assertEqual([n["name"] for n in res], ["public", "private"])
+            self.assertFalse(net_delete.called)
+
+    def test_create_network_bulk_deletes_created_on_failure(self):
+        nets = dict(networks=[dict(network=dict(name="public", tenant_id=0)),
+                              dict(network=dict(name="private",
+                                                tenant_id=0))])
+        with self._stubs() as (net_create, net_delete):
+            net_create.side_effect = [dict(id="public", name="public"),
+                                      exceptions.BadRequest(resource="network",
+                                                            msg="busted")]
+            with self.assertRaises(exceptions.BadRequest):
+                self.plugin.create_network_bulk(self.context, nets)
+            net_delete.assert_called_once_with(self.context, "public")
+
+
 class TestQuarkDiagnoseNetworks(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
     def _stubs(self, nets=None, subnets=None):
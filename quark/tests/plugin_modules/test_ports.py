@@ -22,6 +22,7 @@ from neutron.common import exceptions
 from neutron.extensions import securitygroup as sg_ext
 from oslo.config import cfg
 
+from quark.db import api as db_api
 from quark.db import models
 from quark import exceptions as q_exc
 from quark import network_strategy
@@ -62,14 +63,55 @@ class TestQuarkGetPorts(test_quark_plugin.TestQuarkPlugin):
             mock.patch("%s.port_find" % db_mod)
         ) as (port_find,):
             port_find.return_value = port_models
-            yield
+            yield port_find
 
     def test_port_list_no_ports(self):
         with self._stubs(ports=[]):
-            ports = self.plugin.get_ports(self.context, filters=None,
-                                          fields=None)
+            ports = list(self.plugin.get_ports(self.context, filters=None,
+                                               fields=None))
             self.assertEqual(ports, [])
 
+    def test_port_list_page(self):
+        with self._stubs(ports=[]) as port_find:
+            self.plugin.get_ports(self.context, filters=None, fields=None,
+                                  sorts=[("name", True)], limit=1,
+                                  marker="port-1", page_reverse=True)
+            port_find.assert_called_once_with(
+                self.context, limit=1, marker="port-1",
+                sorts=[("name", True)], page_reverse=True, fields=None,
+                join_security_groups=True, batch_relations=True,
+                scope=db_api.ALL)
+
+    def test_port_list_projected_fields(self):
+        row = dict(id="1", device_id="2", network_id="3", mac_address=None,
+                   ip_addresses=[dict(subnet_id=1, version=4,
+                                      address_readable="192.168.1.100")])
+        fields = ["id", "device_id", "fixed_ips"]
+        with contextlib.nested(
+            mock.patch("quark.db.api.port_find"),
+            mock.patch("quark.db.api.port_find_fields")
+        ) as (port_find, port_find_fields):
+            port_find_fields.return_value = [row]
+            ports = list(self.plugin.get_ports(self.context, filters=None,
+                                               fields=fields))
+            self.assertFalse(port_find.called)
+            self.assertEqual(ports, [
+                {"id": "1", "device_id": "2",
+                 "fixed_ips": [{"subnet_id": 1,
+                                "ip_address": "192.168.1.100"}]}])
+
+    def test_port_show_projected_fields(self):
+        row = dict(id="1", network_id="3")
+        with contextlib.nested(
+            mock.patch("quark.db.api.port_find"),
+            mock.patch("quark.db.api.port_find_fields")
+        ) as (port_find, port_find_fields):
+            port_find_fields.return_value = row
+            port = self.plugin.get_port(self.context, "1",
+                                        fields=["network_id", "status"])
+            self.assertFalse(port_find.called)
+            self.assertEqual(port, {"network_id": "3", "status": "ACTIVE"})
+
     def test_port_list_with_device_owner_dhcp(self):
         ip = dict(id=1, address=3232235876, address_readable="192.168.1.100",
                   subnet_id=1, network_id=2, version=4)
@@ -79,11 +121,28 @@ class TestQuarkGetPorts(test_quark_plugin.TestQuarkPlugin):
                     tenant_id=self.context.tenant_id, device_id=2,
                     bridge="xenbr0", device_owner='network:dhcp')
         with self._stubs(ports=[port], addrs=[ip]):
-            ports = self.plugin.get_ports(self.context, filters=filters,
-                                          fields=None)
+            ports = list(self.plugin.get_ports(self.context,
+                                               filters=filters, fields=None))
             self.assertEqual(len(ports), 1)
             self.assertEqual(ports[0]["device_owner"], "network:dhcp")
 
+    def test_port_list_with_subnets_builds_each_subnet_once(self):
+        ip = dict(id=1, address=3232235876, address_readable="192.168.1.100",
+                  subnet_id=1, network_id=2, version=4)
+        port = dict(mac_address="AA:BB:CC:DD:EE:FF", network_id=1,
+                    tenant_id=self.context.tenant_id, device_id=2)
+        subnet = {"id": 1, "cidr": "192.168.1.0/24"}
+        with contextlib.nested(
+            self._stubs(ports=[port, port], addrs=[ip]),
+            mock.patch("quark.plugin_views._make_subnet_dict")
+        ) as (port_find, make_subnet):
+            make_subnet.return_value = subnet
+            ports = list(self.plugin.get_ports(
+                self.context, fields=["id", "fixed_ips", "port_subnets"]))
+        self.assertEqual(make_subnet.call_count, 1)
+        self.assertEqual([p["fixed_ips"][0]["subnet"] for p in ports],
+                         [subnet, subnet])
+
     def test_port_list_with_ports(self):
         ip = dict(id=1, address=3232235876, address_readable="192.168.1.100",
                   subnet_id=1, network_id=2, version=4)
@@ -99,8 +158,8 @@ class TestQuarkGetPorts(test_quark_plugin.TestQuarkPlugin):
                     'admin_state_up': None,
                     'device_id': 2}
         with self._stubs(ports=[port], addrs=[ip]):
-            ports = self.plugin.get_ports(self.context, filters=None,
-                                          fields=None)
+            ports = list(self.plugin.get_ports(self.context, filters=None,
+                                               fields=None))
             self.assertEqual(len(ports), 1)
             fixed_ips = ports[0].pop("fixed_ips")
             for key in expected.keys():
@@ -182,8 +241,8 @@ class TestQuarkGetPortsByIPAddress(test_quark_plugin.TestQuarkPlugin):
         with self._stubs(ports=[port], addr=ip):
             admin_ctx = self.context.elevated()
             filters = {"ip_address": ["192.168.0.1"]}
-            ports = self.plugin.get_ports(admin_ctx, filters=filters,
-                                          fields=None)
+            ports = list(self.plugin.get_ports(admin_ctx, filters=filters,
+                                               fields=None))
             self.assertEqual(len(ports), 1)
             self.assertEqual(ports[0]["device_owner"], "network:dhcp")
 
@@ -291,6 +350,28 @@ class TestQuarkCreatePort(test_quark_plugin.TestQuarkPlugin):
             for key in expected.keys():
                 self.assertEqual(result[key], expected[key])
 
+    def test_create_port_async(self):
+        cfg.CONF.set_override("async_port_provisioning", True, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "async_port_provisioning",
+                        "QUARK")
+        network = dict(id=1)
+        mac = dict(address="AA:BB:CC:DD:EE:FF")
+        port = dict(port=dict(mac_address=mac["address"], network_id=1,
+                              tenant_id=self.context.tenant_id, device_id=2))
+        with contextlib.nested(
+            self._stubs(port=port["port"], network=network, addr=dict(),
+                        mac=mac),
+            mock.patch("quark.drivers.base.BaseDriver.create_port"),
+            mock.patch("quark.db.api.port_job_create")
+        ) as (port_create, driver_create, job_create):
+            self.plugin.create_port(self.context, port)
+            self.assertFalse(driver_create.called)
+            port_id = port_create.call_args[1]["id"]
+            self.assertEqual(port_create.call_args[1]["status"], "BUILD")
+            self.assertEqual(port_create.call_args[1]["backend_key"],
+                             port_id)
+            job_create.assert_called_once_with(self.context, port_id)
+
     def test_create_port_segment_id_on_unshared_net_ignored(self):
         network = dict(id=1)
         mac = dict(address="AA:BB:CC:DD:EE:FF")
@@ -408,7 +489,7 @@ class TestQuarkCreatePort(test_quark_plugin.TestQuarkPlugin):
         with self._stubs(port=port["port"], network=network, addr=ip,
                          mac=mac) as port_create:
             with mock.patch("quark.db.api.security_group_find") as group_find:
-                group_find.return_value = (groups and group)
+                group_find.return_value = [group] if groups else []
                 port["port"]["security_groups"] = groups or [1]
                 result = self.plugin.create_port(self.context, port)
                 self.assertTrue(port_create.called)
@@ -459,6 +540,161 @@ class TestQuarkPortCreateQuota(test_quark_plugin.TestQuarkPlugin):
                 self.plugin.create_port(self.context, port)
 
 
+class TestQuarkCreatePortBulk(test_quark_plugin.TestQuarkPlugin):
+    @contextlib.contextmanager
+    def _stubs(self, network=None, port_count=0, existing=None):
+        if network:
+            network["network_plugin"] = "BASE"
+            network["ipam_strategy"] = "ANY"
+
+        def _create_bulk(context, port_dicts):
+            new_ports = []
+            for port_dict in port_dicts:
+                port_model = models.Port()
+                port_model.update(port_dict)
+                new_ports.append(port_model)
+            return new_ports
+
+        def _alloc_macs(context, macs, net_id, port_ids, reuse_after):
+            for i, port_id in enumerate(port_ids):
+                macs.append(dict(address=i + 1))
+
+        db_mod = "quark.db.api"
+        ipam = "quark.ipam.QuarkIpam"
+        with contextlib.nested(
+            mock.patch("%s.port_create_bulk" % db_mod),
+            mock.patch("%s.network_find" % db_mod),
+            mock.patch("%s.port_find" % db_mod),
+            mock.patch("%s.port_count_all" % db_mod),
+            mock.patch("%s.allocate_mac_addresses" % ipam),
+            mock.patch("%s.allocate_ip_addresses" % ipam),
+            mock.patch("%s.deallocate_mac_address" % ipam),
+            mock.patch("%s.deallocate_ip_address" % ipam),
+        ) as (create_bulk, net_find, port_find, count, alloc_macs,
+              alloc_ips, dealloc_mac, dealloc_ip):
+            create_bulk.side_effect = _create_bulk
+            net_find.return_value = network
+            port_find.return_value = existing or []
+            count.return_value = port_count
+            alloc_macs.side_effect = _alloc_macs
+            yield create_bulk, alloc_macs, alloc_ips, dealloc_mac
+
+    def _ports(self, *device_ids):
+        return dict(ports=[dict(port=dict(network_id=1, device_id=device_id,
+                                          tenant_id=self.context.tenant_id,
+                                          name="port%s" % device_id))
+                           for device_id in device_ids])
+
+    def test_create_port_bulk(self):
+        network = dict(id=1)
+        with self._stubs(network=network) as (create_bulk, alloc_macs,
+                                              alloc_ips, dealloc_mac):
+            result = self.plugin.create_port_bulk(self.context,
+                                                  self._ports(2, 3))
+            self.assertEqual(len(result), 2)
+            self.assertEqual([r["device_id"] for r in result], [2, 3])
+            self.assertEqual(create_bulk.call_count, 1)
+            self.assertEqual(alloc_macs.call_count, 1)
+            self.assertEqual(alloc_ips.call_count, 1)
+            port_ids = alloc_macs.call_args[0][3]
+            self.assertEqual(len(port_ids), 2)
+            self.assertEqual(alloc_ips.call_args[0][3], port_ids)
+            port_dicts = create_bulk.call_args[0][1]
+            self.assertEqual([p["id"] for p in port_dicts], port_ids)
+            self.assertEqual([p["mac_address"] for p in port_dicts], [1, 2])
+            self.assertEqual([p["backend_key"] for p in port_dicts], port_ids)
+
+    def test_create_port_bulk_async(self):
+        cfg.CONF.set_override("async_port_provisioning", True, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "async_port_provisioning",
+                        "QUARK")
+        network = dict(id=1)
+        with contextlib.nested(
+            self._stubs(network=network),
+            mock.patch("quark.drivers.base.BaseDriver.create_port"),
+            mock.patch("quark.db.api.port_job_create")
+        ) as ((create_bulk, alloc_macs, alloc_ips, dealloc_mac),
+              driver_create, job_create):
+            self.plugin.create_port_bulk(self.context, self._ports(2, 3))
+            self.assertFalse(driver_create.called)
+            port_dicts = create_bulk.call_args[0][1]
+            port_ids = [p["id"] for p in port_dicts]
+            self.assertEqual([p["status"] for p in port_dicts],
+                             ["BUILD", "BUILD"])
+            self.assertEqual([p["backend_key"] for p in port_dicts], port_ids)
+            self.assertEqual(job_create.call_args_list,
+                             [mock.call(self.context, port_id)
+                              for port_id in port_ids])
+
+    def test_create_port_bulk_security_groups(self):
+        network = dict(id=1)
+        groups = []
+        for gid in (1, 2):
+            group = models.SecurityGroup()
+            group.update(dict(id=gid, tenant_id=self.context.tenant_id))
+            groups.append(group)
+        ports = self._ports(2, 3)
+        ports["ports"][0]["port"]["security_groups"] = [1, 2, 1]
+        ports["ports"][1]["port"]["security_groups"] = [2]
+        with self._stubs(network=network) as (create_bulk, alloc_macs,
+                                              alloc_ips, dealloc_mac):
+            with mock.patch("quark.db.api.security_group_find") as group_find:
+                group_find.return_value = groups
+                self.plugin.create_port_bulk(self.context, ports)
+            self.assertEqual(group_find.call_count, 1)
+            self.assertEqual(sorted(group_find.call_args[1]["id"]), [1, 2])
+            port_dicts = create_bulk.call_args[0][1]
+            self.assertEqual(port_dicts[0]["security_groups"], groups)
+            self.assertEqual(port_dicts[1]["security_groups"], groups[1:])
+
+    def test_create_port_bulk_security_group_not_found(self):
+        network = dict(id=1)
+        ports = self._ports(2, 3)
+        ports["ports"][1]["port"]["security_groups"] = [1]
+        with self._stubs(network=network):
+            with mock.patch("quark.db.api.security_group_find") as group_find:
+                group_find.return_value = []
+                with self.assertRaises(sg_ext.SecurityGroupNotFound):
+                    self.plugin.create_port_bulk(self.context, ports)
+
+    def test_create_port_bulk_no_network_found(self):
+        with self._stubs(network=None):
+            with self.assertRaises(exceptions.NetworkNotFound):
+                self.plugin.create_port_bulk(self.context, self._ports(2))
+
+    def test_create_port_bulk_over_quota(self):
+        network = dict(id=1)
+        with self._stubs(network=network, port_count=249):
+            with self.assertRaises(exceptions.OverQuota):
+                self.plugin.create_port_bulk(self.context, self._ports(2, 3))
+
+    def test_create_port_bulk_same_device_id_bad_request(self):
+        network = dict(id=1)
+        with self._stubs(network=network):
+            with self.assertRaises(exceptions.BadRequest):
+                self.plugin.create_port_bulk(self.context, self._ports(2, 2))
+
+    def test_create_port_bulk_device_already_attached_bad_request(self):
+        network = dict(id=1)
+        existing = [dict(network_id=1, device_id=3)]
+        with self._stubs(network=network, existing=existing):
+            with self.assertRaises(exceptions.BadRequest):
+                self.plugin.create_port_bulk(self.context, self._ports(2, 3))
+
+    def test_create_port_bulk_failure_rolls_back_batch(self):
+        network = dict(id=1)
+        with self._stubs(network=network) as (create_bulk, alloc_macs,
+                                              alloc_ips, dealloc_mac):
+            create_bulk.side_effect = exceptions.NeutronException()
+            with mock.patch("quark.drivers.base.BaseDriver.delete_port") as (
+                    delete_port):
+                with self.assertRaises(exceptions.NeutronException):
+                    self.plugin.create_port_bulk(self.context,
+                                                 self._ports(2, 3))
+                self.assertEqual(delete_port.call_count, 2)
+            self.assertEqual(dealloc_mac.call_count, 2)
+
+
 class TestQuarkUpdatePort(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
     def _stubs(self, port, new_ips=None):
@@ -842,6 +1078,21 @@ class TestQuarkDeletePort(test_quark_plugin.TestQuarkPlugin):
             with self.assertRaises(exceptions.PortNotFound):
                 self.plugin.delete_port(self.context, 1)
 
+    def test_port_delete_still_building(self):
+        port = dict(port=dict(id=1, network_id=1, device_id=2,
+                              tenant_id=self.context.tenant_id,
+                              mac_address="AA:BB:CC:DD:EE:FF",
+                              backend_key=1, status="BUILD"))
+        with contextlib.nested(
+            self._stubs(port=port["port"]),
+            mock.patch("quark.db.api.port_job_delete")
+        ) as ((db_port_del, driver_port_del), job_delete):
+            job_delete.return_value = True
+            self.plugin.delete_port(self.context, 1)
+            job_delete.assert_called_once_with(self.context, port_id=1)
+            self.assertTrue(db_port_del.called)
+            self.assertFalse(driver_port_del.called)
+
 
 class TestPortDiagnose(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
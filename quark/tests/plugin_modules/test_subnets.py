@@ -23,6 +23,7 @@ from neutron.api.v2 import attributes as neutron_attrs
 from neutron.common import exceptions
 from oslo.config import cfg
 
+from quark.db import api as db_api
 from quark.db import models
 from quark import exceptions as q_exc
 from quark.tests import test_quark_plugin
@@ -64,7 +65,22 @@ class TestQuarkGetSubnets(test_quark_plugin.TestQuarkPlugin):
 
         with mock.patch("quark.db.api.subnet_find") as subnet_find:
             subnet_find.return_value = subnet_models
-            yield
+            yield subnet_find
+
+    def test_subnets_list_fields(self):
+        subnet = dict(id=1, network_id=1, name="subnet",
+                      tenant_id=self.context.tenant_id, ip_version=4,
+                      cidr="192.168.0.0/24")
+        with self._stubs(subnets=[subnet]) as subnet_find:
+            res = list(self.plugin.get_subnets(self.context, {},
+                                               ["id", "name"]))
+            subnet_find.assert_called_once_with(
+                self.context, join_dns=False, join_routes=False,
+                limit=cfg.CONF.QUARK.db_page_size, marker=None, sorts=None,
+                scope=db_api.ALL)
+            for key in ("dns_nameservers", "allocation_pools", "gateway_ip",
+                        "host_routes"):
+                self.assertNotIn(key, res[0])
 
     def test_subnets_list(self):
         subnet_id = str(uuid.uuid4())
@@ -77,7 +93,7 @@ class TestQuarkGetSubnets(test_quark_plugin.TestQuarkPlugin):
                       enable_dhcp=None)
 
         with self._stubs(subnets=[subnet], routes=[route]):
-            res = self.plugin.get_subnets(self.context, {}, {})
+            res = list(self.plugin.get_subnets(self.context, {}, {}))
             # Compare routes separately
             routes = res[0].pop("host_routes")
             for key in subnet.keys():
@@ -96,7 +112,7 @@ class TestQuarkGetSubnets(test_quark_plugin.TestQuarkPlugin):
                       enable_dhcp=None)
 
         with self._stubs(subnets=[subnet], routes=[route, route2]):
-            res = self.plugin.get_subnets(self.context, {}, {})
+            res = list(self.plugin.get_subnets(self.context, {}, {}))
 
             # Don't want to test that LOG.info is called but we can
             # know the case is covered by checking the gateway is the one
@@ -157,7 +173,7 @@ class TestQuarkGetSubnetsHideAllocPools(test_quark_plugin.TestQuarkPlugin):
                       enable_dhcp=None)
 
         with self._stubs(subnets=[subnet]):
-            res = self.plugin.get_subnets(self.context, {}, {})
+            res = list(self.plugin.get_subnets(self.context, {}, {}))
             self.assertEqual(res[0]["allocation_pools"], [])
 
 
@@ -58,3 +58,68 @@ class TestDBAPI(BaseFunctionalTest):
                                    scope=db_api.ONE)
         except Exception as e:
             self.fail("Expected no exceptions: %s" % e)
+
+
+class TestDBAPIFindCache(BaseFunctionalTest):
+    def setUp(self):
+        super(TestDBAPIFindCache, self).setUp()
+        self.context.is_admin = True
+        with self.context.session.begin():
+            self.group = db_api.security_group_create(self.context,
+                                                      name="group")
+
+    def _find(self, **filters):
+        with mock.patch.object(self.context.session, "query",
+                               wraps=self.context.session.query) as query:
+            group = db_api.security_group_find(self.context,
+                                               scope=db_api.ONE, **filters)
+        return group, query.call_count
+
+    def test_repeated_find_is_cached(self):
+        group, queries = self._find(id=self.group["id"])
+        self.assertEqual(group, self.group)
+        self.assertEqual(queries, 1)
+        group, queries = self._find(id=[self.group["id"]])
+        self.assertEqual(group, self.group)
+        self.assertEqual(queries, 0)
+
+    def test_helpers_invalidate(self):
+        self._find(name="group")
+        with self.context.session.begin():
+            db_api.security_group_update(self.context, self.group,
+                                         name="renamed")
+        group, queries = self._find(name="group")
+        self.assertIsNone(group)
+        self.assertEqual(queries, 1)
+
+    def test_pending_changes_skip_cache(self):
+        self._find(name="group")
+        self.group["name"] = "renamed"
+        group, queries = self._find(name="group")
+        self.assertIsNone(group)
+        self.assertEqual(queries, 1)
+
+    def test_cached_lists_are_copies(self):
+        groups = db_api.security_group_find(self.context, scope=db_api.ALL)
+        groups.append(None)
+        groups = db_api.security_group_find(self.context, scope=db_api.ALL)
+        self.assertEqual(groups, [self.group])
+
+    def test_elevated_context_not_served_tenant_results(self):
+        with self.context.session.begin():
+            other = db_api.security_group_create(self.context, name="other")
+            other["tenant_id"] = "other"
+        self.context.is_admin = False
+        groups = db_api.security_group_find(self.context, scope=db_api.ALL)
+        self.assertEqual(groups, [self.group])
+        admin_context = self.context.elevated()
+        self.assertIs(admin_context.session, self.context.session)
+        groups = db_api.security_group_find(admin_context, scope=db_api.ALL)
+        self.assertEqual(len(groups), 2)
+        groups = db_api.security_group_find(self.context, scope=db_api.ALL)
+        self.assertEqual(groups, [self.group])
+
+    def test_clear(self):
+        self._find(name="group")
+        db_api.find_cache_clear(self.context)
+        self.assertEqual(self._find(name="group")[1], 1)
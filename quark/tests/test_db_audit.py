@@ -0,0 +1,50 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo.config import cfg
+
+from quark.db import audit
+from quark.tests import test_base
+
+
+class TestStatementAudit(test_base.TestBase):
+    def test_shape(self):
+        self.assertEqual(audit.shape("SELECT *\n  FROM t WHERE id IN (?, ?)"),
+                         "SELECT * FROM t WHERE id IN (?)")
+        self.assertEqual(audit.shape("WHERE id IN (%(id_1)s, %(id_2)s)"),
+                         "WHERE id IN (?)")
+
+    def test_recording_nests(self):
+        with audit.recording() as outer:
+            outer.record("SELECT 1", 0.1)
+            with audit.recording() as inner:
+                inner.record("SELECT 1", 0.1)
+        self.assertIs(inner, outer)
+        self.assertEqual(outer.count, 2)
+        self.assertEqual(outer.repeated(2), [(2, "SELECT 1")])
+
+    def test_audited_logs_repeats(self):
+        cfg.CONF.set_override("statement_audit", True, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "statement_audit", "QUARK")
+        with mock.patch("quark.db.audit.LOG") as log:
+            with audit.audited("get_ports"):
+                for i in xrange(5):
+                    audit._local.log.record("SELECT * FROM t WHERE id = ?",
+                                            0.001)
+            self.assertEqual(log.warning.call_count, 1)
+            with audit.audited("get_ports"):
+                audit._local.log.record("SELECT 1", 0.001)
+            self.assertEqual(log.warning.call_count, 1)
@@ -13,7 +13,8 @@
 # License for the specific language governing permissions and limitations
 #  under the License.
 
-from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy import types
 
 from quark.db import custom_types
 from quark.tests import test_base
@@ -28,35 +29,64 @@ class TestDBCustomTypesINET(test_base.TestBase):
 
     def test_inet_load_dialect_impl(self):
         dialect = self.inet.load_dialect_impl(mysql.dialect())
-        self.assertEqual(type(dialect), type(custom_types.INET.impl()))
+        self.assertEqual(type(dialect), mysql.BINARY)
+        self.assertEqual(dialect.length, 16)
+
+    def test_inet_load_dialect_impl_postgresql(self):
+        dialect = self.inet.load_dialect_impl(postgresql.dialect())
+        self.assertEqual(type(dialect), postgresql.BYTEA)
 
     def test_inet_load_dialect_impl_sqlite(self):
         dialect = self.inet.load_dialect_impl(sqlite.dialect())
-        self.assertEqual(type(dialect), sqlite.CHAR)
+        self.assertEqual(type(dialect), types.LargeBinary)
 
     def test_process_bind_param(self):
         bind = self.inet.process_bind_param(None, None)
         self.assertIsNone(bind)
 
     def test_process_bind_param_with_value(self):
-        bind = self.inet.process_bind_param("foo", sqlite.dialect())
-        self.assertEqual(bind, "foo")
+        bind = self.inet.process_bind_param(0xffff0a000001, mysql.dialect())
+        self.assertEqual(bind, "\x00" * 10 + "\xff\xff\x0a\x00\x00\x01")
+
+    def test_process_bind_param_with_exhausted_marker(self):
+        bind = self.inet.process_bind_param(-1, mysql.dialect())
+        self.assertEqual(bind, "\xff" * 16)
 
-    def test_process_bind_param_with_value_not_sqlite(self):
-        bind = self.inet.process_bind_param("foo", mysql.dialect())
-        self.assertEqual(bind, "foo")
+    def test_process_bind_param_preserves_order(self):
+        values = [0, 1, 0xffff0a000001, 1 << 64, (1 << 127) + 1,
+                  (1 << 128) - 2]
+        binds = [self.inet.process_bind_param(v, mysql.dialect())
+                 for v in values]
+        self.assertEqual(binds, sorted(binds))
 
     def test_process_result_value(self):
         bind = self.inet.process_result_value(None, mysql.dialect())
         self.assertIsNone(bind)
 
     def test_process_result_value_with_value(self):
-        bind = self.inet.process_result_value(1.0, sqlite.dialect())
-        self.assertEqual(bind, 1.0)
+        for value in (0, 0xffff0a000001, (1 << 128) - 2, -1):
+            bind = self.inet.process_bind_param(value, sqlite.dialect())
+            result = self.inet.process_result_value(buffer(bind),
+                                                    sqlite.dialect())
+            self.assertEqual(result, value)
+
+
+class TestDBCustomTypesDecimalINET(test_base.TestBase):
+    def setUp(self):
+        super(TestDBCustomTypesDecimalINET, self).setUp()
+        self.inet = custom_types.DecimalINET()
 
-    def test_process_result_value_with_value_not_sqlite(self):
-        bind = self.inet.process_result_value(1.0, mysql.dialect())
-        self.assertEqual(bind, 1.0)
+    def test_inet_load_dialect_impl(self):
+        dialect = self.inet.load_dialect_impl(mysql.dialect())
+        self.assertEqual(type(dialect), type(custom_types.DecimalINET.impl()))
+
+    def test_process_bind_param_with_value(self):
+        bind = self.inet.process_bind_param(1, mysql.dialect())
+        self.assertEqual(bind, "1")
+
+    def test_process_result_value_with_value(self):
+        bind = self.inet.process_result_value("1", mysql.dialect())
+        self.assertEqual(bind, 1)
 
 
 class TestDBCustomTypesMACAddress(test_base.TestBase):
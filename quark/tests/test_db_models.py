@@ -16,6 +16,7 @@
 from netaddr import IPSet
 
 from quark.db import models
+from quark import ip_ranges
 from quark.tests import test_base
 
 
@@ -38,3 +39,28 @@ class TestDBModels(test_base.TestBase):
                       network=dict(ip_policy=None), ip_policy=None)
         ip_policy_rules = models.IPPolicy.get_ip_policy_cidrs(subnet)
         self.assertEqual(ip_policy_rules, IPSet())
+
+    def test_get_ip_policy_ranges_empty(self):
+        subnet = dict(id=1, ip_version=4, cidr="0.0.0.0/24",
+                      network=dict(ip_policy=None), ip_policy=None)
+        ip_policy_rules = models.IPPolicy.get_ip_policy_ranges(subnet)
+        self.assertEqual(ip_policy_rules, ip_ranges.IntervalSet())
+
+    def test_get_ip_policy_ranges_cached_by_cidrs(self):
+        cidrs = [models.IPPolicyCIDR(cidr="192.168.1.0/32"),
+                 models.IPPolicyCIDR(cidr="192.168.1.255/32")]
+        subnet = dict(id=1, ip_version=4, cidr="192.168.1.0/24",
+                      ip_policy=dict(exclude=cidrs))
+        first = models.IPPolicy.get_ip_policy_ranges(subnet)
+        self.assertIn("192.168.1.0", first)
+        self.assertIn("192.168.1.255", first)
+        self.assertNotIn("192.168.1.1", first)
+
+        subnet["ip_policy"] = dict(exclude=list(reversed(cidrs)))
+        self.assertIs(models.IPPolicy.get_ip_policy_ranges(subnet), first)
+
+        cidrs.append(models.IPPolicyCIDR(cidr="192.168.1.1/32"))
+        subnet["ip_policy"] = dict(exclude=cidrs)
+        changed = models.IPPolicy.get_ip_policy_ranges(subnet)
+        self.assertIsNot(changed, first)
+        self.assertIn("192.168.1.1", changed)
@@ -0,0 +1,102 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo.config import cfg
+
+from quark.db import replica
+from quark import plugin
+from quark.tests import test_base
+
+
+class TestReplicaSession(test_base.TestBase):
+    def setUp(self):
+        super(TestReplicaSession, self).setUp()
+        self.reader_context = mock.Mock(_session=None, tenant_id="tenant")
+        replica.RECENT_WRITERS.clear()
+        self.addCleanup(replica.RECENT_WRITERS.clear)
+        cfg.CONF.set_override("slave_connection", "sqlite://", "database")
+        self.addCleanup(cfg.CONF.clear_override, "slave_connection",
+                        "database")
+        patcher = mock.patch("quark.db.replica._facade")
+        self.facade = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.session = self.facade.return_value.get_session.return_value
+
+    def _window(self, seconds):
+        cfg.CONF.set_override("read_after_write_window", seconds, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "read_after_write_window",
+                        "QUARK")
+
+    def test_no_replica_reads_primary(self):
+        cfg.CONF.set_override("slave_connection", None, "database")
+        self.assertIsNone(replica.get_session(self.reader_context))
+        self.assertFalse(self.facade.called)
+
+    def test_replica_session(self):
+        self.assertEqual(replica.get_session(self.reader_context),
+                         self.session)
+        self.facade.return_value.get_session.assert_called_once_with(
+            autocommit=True, expire_on_commit=False)
+
+    def test_existing_session_is_kept(self):
+        self.reader_context._session = mock.Mock()
+        self.assertIsNone(replica.get_session(self.reader_context))
+
+    def test_recent_writer_reads_primary(self):
+        self._window(10)
+        replica.RECENT_WRITERS.wrote("tenant")
+        self.assertIsNone(replica.get_session(self.reader_context))
+        replica.RECENT_WRITERS.wrote("other")
+        self.reader_context.tenant_id = "another"
+        self.assertEqual(replica.get_session(self.reader_context),
+                         self.session)
+
+    def test_window_passes(self):
+        self._window(10)
+        with mock.patch("time.time") as now:
+            now.return_value = 100
+            replica.RECENT_WRITERS.wrote("tenant")
+            now.return_value = 111
+            self.assertEqual(replica.get_session(self.reader_context),
+                             self.session)
+
+    def test_no_window_ignores_writes(self):
+        replica.RECENT_WRITERS.wrote("tenant")
+        self.assertEqual(replica.get_session(self.reader_context),
+                         self.session)
+
+
+class TestSessionedWriters(test_base.TestBase):
+    def setUp(self):
+        super(TestSessionedWriters, self).setUp()
+        replica.RECENT_WRITERS.clear()
+        self.addCleanup(replica.RECENT_WRITERS.clear)
+        cfg.CONF.set_override("read_after_write_window", 10, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "read_after_write_window",
+                        "QUARK")
+
+    def test_failed_write_is_recorded(self):
+        context = mock.Mock(_session=None, tenant_id="tenant")
+
+        @plugin.sessioned
+        def create_thing(self, context):
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            create_thing(None, context)
+        self.assertTrue(replica.RECENT_WRITERS.wrote_recently("tenant"))
+        self.assertTrue(context.session.close.called)
+        self.assertIsNone(context._session)
@@ -0,0 +1,115 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import netaddr
+
+from quark import ip_ranges
+from quark.tests import test_base
+
+
+class TestFreeRanges(test_base.TestBase):
+    def test_empty_exclusions(self):
+        free = ip_ranges.FreeRanges(0, 9)
+        self.assertEqual(len(free), 10)
+        self.assertEqual(free.ranges(), [(0, 9)])
+
+    def test_exclusions_are_merged_and_clipped(self):
+        free = ip_ranges.FreeRanges(10, 20, [(18, 30), (0, 10), (14, 14),
+                                             (13, 13), (19, 19)])
+        self.assertEqual(free.ranges(), [(11, 12), (15, 17)])
+        self.assertEqual(len(free), 5)
+
+    def test_fully_excluded(self):
+        free = ip_ranges.FreeRanges(0, 3, [(0, 1), (2, 3)])
+        self.assertEqual(len(free), 0)
+        self.assertFalse(free)
+        self.assertIsNone(free.pop())
+        self.assertIsNone(free.peek())
+
+    def test_pop_returns_lowest_in_order(self):
+        free = ip_ranges.FreeRanges(0, 5, [(1, 1), (3, 4)])
+        self.assertEqual(free.peek(), 0)
+        popped = [free.pop() for _ in xrange(4)]
+        self.assertEqual(popped, [0, 2, 5, None])
+        self.assertEqual(len(free), 0)
+
+    def test_contains(self):
+        free = ip_ranges.FreeRanges(0, 9, [(3, 5)])
+        self.assertIn(0, free)
+        self.assertIn(9, free)
+        self.assertNotIn(4, free)
+        self.assertNotIn(10, free)
+        self.assertNotIn(-1, free)
+
+    def test_discard_splits_range(self):
+        free = ip_ranges.FreeRanges(0, 9)
+        self.assertTrue(free.discard(4))
+        self.assertEqual(free.ranges(), [(0, 3), (5, 9)])
+        self.assertTrue(free.discard(0))
+        self.assertTrue(free.discard(9))
+        self.assertEqual(free.ranges(), [(1, 3), (5, 8)])
+        self.assertEqual(len(free), 7)
+
+    def test_discard_single_value_range(self):
+        free = ip_ranges.FreeRanges(0, 2, [(1, 1)])
+        self.assertTrue(free.discard(2))
+        self.assertEqual(free.ranges(), [(0, 0)])
+
+    def test_discard_missing_value(self):
+        free = ip_ranges.FreeRanges(0, 9, [(3, 5)])
+        self.assertFalse(free.discard(4))
+        self.assertFalse(free.discard(42))
+        self.assertEqual(len(free), 7)
+
+    def test_iter(self):
+        free = ip_ranges.FreeRanges(0, 6, [(2, 4)])
+        self.assertEqual(list(free), [0, 1, 5, 6])
+
+
+class TestIntervalSet(test_base.TestBase):
+    def test_from_cidrs_merges_adjacent(self):
+        policy = ip_ranges.IntervalSet.from_cidrs(["192.168.1.0/32",
+                                                   "192.168.1.1/32",
+                                                   "192.168.1.255/32"])
+        self.assertEqual(len(policy.ranges()), 2)
+        self.assertEqual(policy.size, 3)
+
+    def test_contains_ip_strings_and_ints(self):
+        policy = ip_ranges.IntervalSet.from_cidrs(["192.168.1.0/30"])
+        self.assertIn("192.168.1.3", policy)
+        self.assertIn(netaddr.IPAddress("192.168.1.0"), policy)
+        self.assertIn(netaddr.IPAddress("::ffff:192.168.1.2").value, policy)
+        self.assertNotIn("192.168.1.4", policy)
+        self.assertNotIn("192.168.0.255", policy)
+
+    def test_empty(self):
+        policy = ip_ranges.IntervalSet()
+        self.assertFalse(policy)
+        self.assertNotIn("192.168.1.1", policy)
+        self.assertEqual(list(policy.iter_cidrs()), [])
+
+    def test_iter_cidrs_v4(self):
+        policy = ip_ranges.IntervalSet.from_cidrs(["192.168.1.0/31",
+                                                   "192.168.1.255/32"])
+        self.assertEqual([str(c) for c in policy.iter_cidrs(version=4)],
+                         ["192.168.1.0/31", "192.168.1.255/32"])
+
+    def test_union_and_equality(self):
+        first = ip_ranges.IntervalSet.from_cidrs(["192.168.1.0/25"])
+        second = ip_ranges.IntervalSet.from_cidrs(["192.168.1.128/25"])
+        merged = first.union(second.ranges())
+        self.assertEqual(merged,
+                         ip_ranges.IntervalSet.from_cidrs(["192.168.1.0/24"]))
+        self.assertNotEqual(merged, first)
@@ -14,6 +14,8 @@
 # limitations under the License.
 
 import contextlib
+import itertools
+import random
 
 import mock
 import netaddr
@@ -24,6 +26,7 @@ from oslo.db import exception as db_exc
 
 from quark.db import models
 from quark import exceptions as q_exc
+from quark import ip_ranges
 import quark.ipam
 from quark.tests import test_base
 
@@ -39,6 +42,32 @@ class QuarkIpamBaseTest(test_base.TestBase):
 
         self.ipam = quark.ipam.QuarkIpamANY()
         self.reuse_after = cfg.CONF.QUARK.ipam_reuse_after
+        quark.ipam.MAC_BLOCKS.clear()
+        self.addCleanup(quark.ipam.MAC_BLOCKS.clear)
+        # NOTE: select_subnet goes straight to the counts query unless a
+        #       test turns the availability summary on.
+        cfg.CONF.set_override("ipam_availability_cache_ttl", 0, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override,
+                        "ipam_availability_cache_ttl", "QUARK")
+        quark.ipam.SUBNET_AVAILABILITY.clear()
+        self.addCleanup(quark.ipam.SUBNET_AVAILABILITY.clear)
+
+        # NOTE: one queued candidate, claimed by whoever asks, so the
+        #       ip_address_find stubs below decide what gets reallocated.
+        patcher = mock.patch("quark.db.api.ip_address_reuse_find")
+        self.reuse_find = patcher.start()
+        self.reuse_find.side_effect = lambda *args, **kwargs: [1]
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("quark.db.api.ip_address_reuse_claim")
+        patcher.start().return_value = True
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("quark.db.api.ip_address_reuse_enqueue")
+        self.reuse_enqueue = patcher.start()
+        self.addCleanup(patcher.stop)
+        # NOTE: no v6 candidate exists yet unless a test says otherwise.
+        patcher = mock.patch("quark.db.api.ip_address_find_existing")
+        patcher.start().return_value = {}
+        self.addCleanup(patcher.stop)
 
         class FakeContext(object):
             def __enter__(*args, **kwargs):
@@ -151,6 +180,80 @@ class QuarkNewMacAddressAllocation(QuarkIpamBaseTest):
             self.assertEqual(mar["next_auto_assign_mac"], -1)
 
 
+class QuarkMacAddressBlockAllocation(QuarkIpamBaseTest):
+    @contextlib.contextmanager
+    def _stubs(self, block_size=64, released=1):
+        old_override = cfg.CONF.QUARK.mac_address_block_size
+        cfg.CONF.set_override("mac_address_block_size", block_size, "QUARK")
+        mar = dict(id=1, first_address=0, last_address=99,
+                   next_auto_assign_mac=0)
+        with contextlib.nested(
+            mock.patch("quark.db.api.mac_address_find"),
+            mock.patch("quark.db.api.mac_address_create"),
+            mock.patch("quark.db.api."
+                       "mac_address_range_find_allocation_counts"),
+            mock.patch("quark.db.api.mac_address_range_release_block"),
+            mock.patch("quark.db.api.mac_address_update")
+        ) as (mac_find, mac_create, mac_range_count, release_block,
+              mac_update):
+            mac_find.return_value = None
+            mac_create.side_effect = lambda context, **kw: kw
+            mac_range_count.return_value = (mar, 0)
+            release_block.return_value = released
+            yield mar, mac_range_count, mac_create, release_block
+        cfg.CONF.set_override("mac_address_block_size", old_override,
+                              "QUARK")
+
+    def test_allocate_macs_from_one_block(self):
+        with self._stubs() as (mar, mac_range_count, mac_create, _):
+            addresses = [self.ipam.allocate_mac_address(self.context, 0, 0,
+                                                        0)["address"]
+                         for i in xrange(3)]
+            self.assertEqual(addresses, [0, 1, 2])
+            self.assertEqual(mac_range_count.call_count, 1)
+            self.assertEqual(mar["next_auto_assign_mac"], 64)
+            self.assertEqual(len(quark.ipam.MAC_BLOCKS), 61)
+
+    def test_allocate_mac_refills_last_block_in_range(self):
+        with self._stubs() as (mar, mac_range_count, mac_create, _):
+            mar["next_auto_assign_mac"] = 90
+            address = self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.assertEqual(address["address"], 90)
+            self.assertEqual(mar["next_auto_assign_mac"], -1)
+            self.assertEqual(len(quark.ipam.MAC_BLOCKS), 9)
+
+    def test_allocate_mac_skips_duplicate_in_block(self):
+        with self._stubs() as (mar, mac_range_count, mac_create, _):
+            mac_create.side_effect = [Exception, dict(address=1)]
+            address = self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.assertEqual(address["address"], 1)
+            self.assertEqual(mac_range_count.call_count, 1)
+
+    def test_allocate_mac_block_size_one_reserves_single_mac(self):
+        with self._stubs(block_size=1) as (mar, mac_range_count, _, _):
+            address = self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.assertEqual(address["address"], 0)
+            self.assertEqual(mar["next_auto_assign_mac"], 1)
+            self.assertEqual(len(quark.ipam.MAC_BLOCKS), 0)
+
+    def test_release_rewinds_range(self):
+        with self._stubs() as (mar, _, mac_create, release_block):
+            self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            quark.ipam.MAC_BLOCKS.release(self.context)
+            release_block.assert_called_once_with(self.context, 1, 1, 63)
+            self.assertEqual(mac_create.call_count, 1)
+            self.assertEqual(len(quark.ipam.MAC_BLOCKS), 0)
+
+    def test_release_stores_deallocated_macs(self):
+        with self._stubs(block_size=3, released=0) as (mar, _, mac_create,
+                                                       release_block):
+            self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            quark.ipam.MAC_BLOCKS.release(self.context)
+            self.assertEqual(mac_create.call_count, 3)
+            self.assertEqual([c[1]["address"] for c in
+                              mac_create.call_args_list[1:]], [1, 2])
+
+
 class QuarkNewMacAddressAllocationCreateConflict(QuarkIpamBaseTest):
     @contextlib.contextmanager
     def _stubs(self, addresses=None, ranges=None):
@@ -314,6 +417,54 @@ class QuarkIPAddressDeallocation(QuarkIpamBaseTest):
         self.assertFalse(addr["deallocated"])
 
 
+class QuarkIPAddressReuseQueue(QuarkIpamBaseTest):
+    def _address(self, ip, exclude=None):
+        ip_policy = None
+        if exclude:
+            ip_policy = dict(size=1, exclude=[
+                models.IPPolicyCIDR(cidr=cidr) for cidr in exclude])
+        subnet = dict(id=1, cidr="0.0.0.0/24", ip_version=4,
+                      ip_policy=ip_policy)
+        return dict(id=1, address=netaddr.IPAddress(ip).ipv6().value,
+                    address_readable=ip, subnet_id=1, subnet=subnet,
+                    used_by_tenant_id=1, created_at=None, ports=[])
+
+    def test_deallocate_queues_address_for_reuse(self):
+        address = self._address("0.0.0.2")
+        self.ipam.deallocate_ip_address(self.context, address)
+        self.reuse_enqueue.assert_called_once_with(self.context, address)
+
+    def test_deallocate_does_not_queue_address_excluded_by_policy(self):
+        address = self._address("0.0.0.2", exclude=["0.0.0.2/32"])
+        self.ipam.deallocate_ip_address(self.context, address)
+        self.assertFalse(self.reuse_enqueue.called)
+
+    def test_reallocate_skips_address_claimed_elsewhere(self):
+        with contextlib.nested(
+            mock.patch("quark.db.api.ip_address_reuse_claim"),
+            mock.patch("quark.db.api.ip_address_find")
+        ) as (reuse_claim, addr_find):
+            reuse_claim.return_value = False
+            addresses = self.ipam.attempt_to_reallocate_ip(self.context, 0,
+                                                           0, 0)
+            self.assertEqual(addresses, [])
+            self.assertFalse(addr_find.called)
+
+    def test_reallocate_claims_queued_address(self):
+        address = self._address("0.0.0.2")
+        with contextlib.nested(
+            mock.patch("quark.db.api.ip_address_find"),
+            mock.patch("quark.db.api.ip_address_update")
+        ) as (addr_find, addr_update):
+            addr_find.return_value = address
+            addr_update.return_value = address
+            addresses = self.ipam.attempt_to_reallocate_ip(self.context, 0,
+                                                           0, 0)
+            self.assertEqual(addresses, [address])
+            self.assertEqual(self.reuse_find.call_args[1]["version"],
+                             [4, 6])
+
+
 class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
     def setUp(self):
         super(QuarkIpamTestBothIpAllocation, self).setUp()
@@ -796,22 +947,33 @@ class QuarkIpamAllocateFromV6Subnet(QuarkIpamBaseTest):
     def _stubs(self, policies=None, ip_address=None, deallocated=True):
         self.context.session.add = mock.Mock()
         ip_mod = None
+        existing = {}
         if ip_address:
             ip_mod = models.IPAddress()
             ip_mod["address"] = ip_address.value
             ip_mod["deallocated"] = deallocated
+            existing[ip_address.value] = (1, deallocated)
 
         with contextlib.nested(
-            mock.patch("quark.db.models.IPPolicy.get_ip_policy_cidrs"),
+            mock.patch("quark.db.models.IPPolicy.get_ip_policy_ranges"),
+            mock.patch("quark.db.api.ip_address_find_existing"),
             mock.patch("quark.db.api.ip_address_find"),
             mock.patch("quark.db.api.ip_address_create"),
-            mock.patch("quark.db.api.ip_address_update")
-        ) as (policy_find, ip_address_find, ip_create, ip_update):
+            mock.patch("quark.db.api.ip_address_reallocate")
+        ) as (policy_find, find_existing, ip_address_find, ip_create,
+              ip_reallocate):
             policy_find.return_value = policies
+            find_existing.return_value = existing
             ip_address_find.return_value = ip_mod
             ip_create.return_value = ip_mod
-            ip_update.return_value = ip_mod
-            yield policy_find, ip_address_find, ip_create, ip_update
+            ip_reallocate.return_value = True
+            yield find_existing, ip_create, ip_reallocate
+
+    def _generated(self, port_id, mac, count):
+        return [netaddr.IPAddress(ip, version=6) for ip in
+                itertools.islice(quark.ipam.generate_v6(mac, port_id,
+                                                        "feed::/104"),
+                                 count)]
 
     def test_reallocate_v6_with_mac_fails_policy_raises(self):
         port_id = "945af340-ed34-4fec-8c87-853a2df492b4"
@@ -826,12 +988,15 @@ class QuarkIpamAllocateFromV6Subnet(QuarkIpamBaseTest):
         old_override = cfg.CONF.QUARK.v6_allocation_attempts
         cfg.CONF.set_override('v6_allocation_attempts', 1, 'QUARK')
 
-        policy = netaddr.IPSet(["feed::/64"])
-        with self._stubs(policies=policy):
+        policy = ip_ranges.IntervalSet.from_cidrs(["feed::/64"])
+        with self._stubs(policies=policy) as (find_existing, ip_create,
+                                              ip_reallocate):
             with self.assertRaises(exceptions.IpAddressGenerationFailure):
                 self.ipam._allocate_from_v6_subnet(self.context, 0, subnet6,
                                                    port_id, self.reuse_after,
                                                    mac_address=mac)
+            find_existing.assert_called_once_with(self.context, 1, [])
+            self.assertEqual(0, ip_create.call_count)
 
         cfg.CONF.set_override('v6_allocation_attempts', old_override, 'QUARK')
 
@@ -847,41 +1012,73 @@ class QuarkIpamAllocateFromV6Subnet(QuarkIpamBaseTest):
 
         old_override = cfg.CONF.QUARK.v6_allocation_attempts
         cfg.CONF.set_override('v6_allocation_attempts', 1, 'QUARK')
-        ip_address = netaddr.IPAddress("fe80::")
+        ip_address = self._generated(port_id, mac["address"], 1)[0]
 
         with self._stubs(policies=[], ip_address=ip_address) as (
-                policy_find, ip_find, ip_create, ip_update):
+                find_existing, ip_create, ip_reallocate):
             a = self.ipam._allocate_from_v6_subnet(self.context, 0, subnet6,
                                                    port_id, self.reuse_after,
                                                    mac_address=mac)
             self.assertEqual(ip_address.value, a["address"])
-            self.assertEqual(1, ip_update.call_count)
+            ip_reallocate.assert_called_once_with(self.context, 1, 1,
+                                                  self.reuse_after)
             self.assertEqual(0, ip_create.call_count)
 
         cfg.CONF.set_override('v6_allocation_attempts', old_override, 'QUARK')
 
+    def test_allocate_v6_with_mac_probes_all_candidates_once(self):
+        port_id = "945af340-ed34-4fec-8c87-853a2df492b4"
+        subnet6 = dict(id=1, first_ip=0, last_ip=0,
+                       cidr="feed::/104", ip_version=6,
+                       next_auto_assign_ip=0,
+                       ip_policy=None)
+
+        mac = models.MacAddress()
+        mac["address"] = netaddr.EUI("AA:BB:CC:DD:EE:FF")
+        candidates = self._generated(port_id, mac["address"], 3)
+
+        old_override = cfg.CONF.QUARK.v6_allocation_attempts
+        cfg.CONF.set_override('v6_allocation_attempts', 3, 'QUARK')
+
+        with self._stubs(policies=[]) as (find_existing, ip_create,
+                                          ip_reallocate):
+            self.ipam._allocate_from_v6_subnet(self.context, 0, subnet6,
+                                               port_id, self.reuse_after,
+                                               mac_address=mac)
+            find_existing.assert_called_once_with(self.context, 1,
+                                                  candidates)
+            self.assertEqual(1, ip_create.call_count)
+            self.assertEqual(candidates[0],
+                             ip_create.call_args[1]["address"])
+            self.assertEqual(0, ip_reallocate.call_count)
+
+        cfg.CONF.set_override('v6_allocation_attempts', old_override, 'QUARK')
+
+    def test_rfc3041_does_not_reseed_global_random(self):
+        port_id = "945af340-ed34-4fec-8c87-853a2df492b4"
+        state = random.getstate()
+        quark.ipam.rfc3041_ip(port_id, "feed::/104").next()
+        self.assertEqual(state, random.getstate())
+
 
 class QuarkIpamAllocateV6IPGeneration(QuarkIpamBaseTest):
     @contextlib.contextmanager
-    def _stubs(self, ip_addresses, create_ip_return, update_ip_return):
+    def _stubs(self, existing, create_ip_return, reallocate_return):
         self.context.session.add = mock.Mock()
-        ip_mods = []
-        for ip in ip_addresses:
-            ip_mod = models.IPAddress()
-            ip_mod.update(ip)
-            ip_mods.append(ip_mod)
-
         old_override = cfg.CONF.QUARK.v6_allocation_attempts
-        cfg.CONF.set_override('v6_allocation_attempts', 2, 'QUARK')
+        cfg.CONF.set_override('v6_allocation_attempts', 3, 'QUARK')
         with contextlib.nested(
+            mock.patch("quark.db.api.ip_address_find_existing"),
             mock.patch("quark.db.api.ip_address_find"),
             mock.patch("quark.db.api.ip_address_create"),
-            mock.patch("quark.db.api.ip_address_update")
-        ) as (ip_address_find, ip_create, ip_update):
-            ip_address_find.side_effect = ip_mods
+            mock.patch("quark.db.api.ip_address_reallocate")
+        ) as (find_existing, ip_address_find, ip_create, ip_reallocate):
+            find_existing.return_value = existing
+            ip_address_find.return_value = reallocate_return
             ip_create.return_value = create_ip_return
-            ip_update.return_value = update_ip_return
-            yield ip_address_find, ip_create, ip_update
+            ip_reallocate.side_effect = (
+                lambda context, subnet_id, id, reuse: id == 2)
+            yield ip_address_find, ip_create, ip_reallocate
         cfg.CONF.set_override('v6_allocation_attempts', old_override, 'QUARK')
 
     def test_reallocate_v6_with_mac_already_exists(self):
@@ -891,21 +1088,53 @@ class QuarkIpamAllocateV6IPGeneration(QuarkIpamBaseTest):
                        next_auto_assign_ip=0,
                        ip_policy=None)
 
-        ip1 = {"address": netaddr.IPAddress("fe80::").value,
-               "deallocated": False}
-        ip2 = {"address": netaddr.IPAddress("fe81::").value,
-               "deallocated": True}
+        mac = models.MacAddress()
+        mac["address"] = netaddr.EUI("AA:BB:CC:DD:EE:FF")
+        candidates = [netaddr.IPAddress(ip, version=6) for ip in
+                      itertools.islice(quark.ipam.generate_v6(
+                          mac["address"], port_id, "feed::/104"), 2)]
+
+        # NOTE: the first candidate is in use, the second was deallocated
+        existing = {candidates[0].value: (1, False),
+                    candidates[1].value: (2, True)}
+        ip2 = {"address": candidates[1].value, "deallocated": False}
+
+        with self._stubs(existing, None, ip2) as (
+                ip_find, ip_create, ip_reallocate):
+            address = self.ipam._allocate_from_v6_subnet(
+                self.context, 0, subnet6, port_id, self.reuse_after,
+                mac_address=mac)
+            self.assertEqual(address, ip2)
+            ip_reallocate.assert_called_once_with(self.context, 1, 2,
+                                                  self.reuse_after)
+            self.assertEqual(0, ip_create.call_count)
+
+    def test_reallocate_v6_with_mac_lost_race_moves_on(self):
+        port_id = "945af340-ed34-4fec-8c87-853a2df492b4"
+        subnet6 = dict(id=1, first_ip=0, last_ip=0,
+                       cidr="feed::/104", ip_version=6,
+                       next_auto_assign_ip=0,
+                       ip_policy=None)
 
         mac = models.MacAddress()
         mac["address"] = netaddr.EUI("AA:BB:CC:DD:EE:FF")
+        candidates = [netaddr.IPAddress(ip, version=6) for ip in
+                      itertools.islice(quark.ipam.generate_v6(
+                          mac["address"], port_id, "feed::/104"), 3)]
 
-        with self._stubs([ip1, ip2], ip2, ip2) as (
-                ip_find, ip_create, ip_update):
-            self.ipam._allocate_from_v6_subnet(self.context, 0, subnet6,
-                                               port_id, self.reuse_after,
-                                               mac_address=mac)
-            self.assertEqual(1, ip_update.call_count)
-            self.assertEqual(0, ip_create.call_count)
+        # NOTE: someone else reallocates the first candidate before we do
+        existing = {candidates[0].value: (3, True)}
+        ip2 = {"address": candidates[1].value, "deallocated": False}
+
+        with self._stubs(existing, ip2, None) as (
+                ip_find, ip_create, ip_reallocate):
+            address = self.ipam._allocate_from_v6_subnet(
+                self.context, 0, subnet6, port_id, self.reuse_after,
+                mac_address=mac)
+            self.assertEqual(address, ip2)
+            self.assertEqual(1, ip_reallocate.call_count)
+            self.assertEqual(candidates[1],
+                             ip_create.call_args[1]["address"])
 
 
 class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
@@ -1153,6 +1382,7 @@ class QuarkIPAddressAllocateDeallocated(QuarkIpamBaseTest):
         address2 = dict(id=1, address=1)
         address["subnet"] = subnet
         addresses_found = [address, address2]
+        self.reuse_find.side_effect = lambda *args, **kwargs: [1, 2]
         self.context.session.delete = mock.Mock()
         with self._stubs(False, subnet, address, addresses_found,
                          sub_found=True):
@@ -1262,6 +1492,159 @@ class TestQuarkIpPoliciesIpAllocation(QuarkIpamBaseTest):
                              netaddr.IPAddress('::ffff:0.0.0.240').value)
 
 
+class QuarkIpamANYOptimisticAllocation(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkIpamANYOptimisticAllocation, self).setUp()
+        self.ipam = quark.ipam.QuarkIpamANYOptimistic()
+        network = netaddr.IPNetwork("192.168.0.0/30")
+        self.first = network.ipv6().first
+        self.last = network.ipv6().last
+
+    @contextlib.contextmanager
+    def _stubs(self, advanced=None, cursor=None):
+        self.context.session.add = mock.Mock()
+        with contextlib.nested(
+            mock.patch("quark.db.api.subnet_advance_next_auto_assign_ip"),
+            mock.patch("quark.db.api.subnet_find_next_auto_assign_ip"),
+            mock.patch("quark.db.api.subnet_find_allocation_counts")
+        ) as (advance, find_cursor, subnet_counts):
+            advance.side_effect = advanced
+            find_cursor.return_value = cursor
+            yield advance, subnet_counts
+
+    def _subnet(self, next_ip, exclude=None):
+        ip_policy = None
+        if exclude:
+            ip_policy = dict(size=len(exclude), exclude=[
+                models.IPPolicyCIDR(cidr=cidr) for cidr in exclude])
+        return dict(id=1, first_ip=self.first, last_ip=self.last,
+                    cidr="192.168.0.0/30", ip_version=4,
+                    next_auto_assign_ip=next_ip, ip_policy=ip_policy)
+
+    def test_allocate_never_locks_subnets(self):
+        subnet = self._subnet(self.first)
+        with self._stubs(advanced=[True]) as (advance, subnet_counts):
+            address = self.ipam._allocate_from_subnet(self.context, 0,
+                                                      subnet, 0, 0)
+            self.assertEqual(address["address"], self.first)
+            advance.assert_called_once_with(self.context, 1, self.first,
+                                            self.first + 1)
+            self.assertFalse(subnet_counts.called)
+
+    def test_allocate_skips_policy_excluded_addresses(self):
+        subnet = self._subnet(self.first, exclude=["192.168.0.0/32"])
+        with self._stubs(advanced=[True, True]) as (advance, subnet_counts):
+            address = self.ipam._allocate_from_subnet(self.context, 0,
+                                                      subnet, 0, 0)
+            self.assertEqual(address["address"], self.first + 1)
+            self.assertEqual(advance.call_count, 2)
+
+    def test_allocate_retries_swap_from_current_cursor(self):
+        subnet = self._subnet(self.first)
+        with self._stubs(advanced=[False, True], cursor=self.first + 2) as (
+                advance, subnet_counts):
+            address = self.ipam._allocate_from_subnet(self.context, 0,
+                                                      subnet, 0, 0)
+            self.assertEqual(address["address"], self.first + 2)
+            advance.assert_called_with(self.context, 1, self.first + 2,
+                                       self.first + 3)
+
+    def test_allocate_last_address_marks_subnet_exhausted(self):
+        subnet = self._subnet(self.last)
+        with self._stubs(advanced=[True]) as (advance, subnet_counts):
+            address = self.ipam._allocate_from_subnet(self.context, 0,
+                                                      subnet, 0, 0)
+            self.assertEqual(address["address"], self.last)
+            advance.assert_called_once_with(self.context, 1, self.last, -1)
+
+    def test_allocate_exhausted_cursor_raises_retryable(self):
+        subnet = self._subnet(-1)
+        with self._stubs() as (advance, subnet_counts):
+            with self.assertRaises(q_exc.IPAddressRetryableFailure):
+                self.ipam._allocate_from_subnet(self.context, 0, subnet,
+                                                0, 0)
+            self.assertFalse(advance.called)
+
+
+class QuarkIpamSubnetAvailability(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkIpamSubnetAvailability, self).setUp()
+        cfg.CONF.set_override("ipam_availability_cache_ttl", 10, "QUARK")
+
+    def _row(self, id, generated_count, next_auto_assign_ip=1, size=2,
+             ip_version=4, segment_id=None):
+        row = mock.Mock(first_ip=0, last_ip=255,
+                        next_auto_assign_ip=next_auto_assign_ip,
+                        generated_count=generated_count, size=size,
+                        ip_version=ip_version, segment_id=segment_id)
+        row.id = id
+        return row
+
+    @contextlib.contextmanager
+    def _stubs(self, rows):
+        with contextlib.nested(
+            mock.patch("quark.db.api.subnet_find_availability"),
+            mock.patch("quark.db.api.subnet_find_allocation_counts")
+        ) as (find_availability, subnet_counts):
+            find_availability.return_value = rows
+            subnet_counts.return_value = []
+            yield find_availability, subnet_counts
+
+    def test_full_network_skips_subnet_rows(self):
+        rows = [self._row(1, 255), self._row(2, 10, next_auto_assign_ip=-1)]
+        with self._stubs(rows) as (find_availability, subnet_counts):
+            subnet = self.ipam.select_subnet(self.context, 1, None, None)
+            self.assertIsNone(subnet)
+            self.assertFalse(subnet_counts.called)
+
+    def test_full_summary_is_reloaded_before_giving_up(self):
+        with self._stubs([]) as (find_availability, subnet_counts):
+            find_availability.side_effect = [[self._row(1, 255)],
+                                             [self._row(1, 255),
+                                              self._row(2, 10)]]
+            self.ipam.select_subnet(self.context, 1, None, None)
+            self.assertEqual(find_availability.call_count, 2)
+            self.assertEqual(subnet_counts.call_args[1]["subnet_id"], [2])
+
+    def test_only_subnets_with_room_are_counted(self):
+        rows = [self._row(1, 255), self._row(2, 10),
+                self._row(3, 10, ip_version=6)]
+        with self._stubs(rows) as (find_availability, subnet_counts):
+            self.ipam.select_subnet(self.context, 1, None, None,
+                                    ip_version=4)
+            self.assertEqual(subnet_counts.call_args[1]["subnet_id"], [2])
+
+    def test_summary_is_cached_and_follows_allocations(self):
+        rows = [self._row(1, 253)]
+        with self._stubs(rows) as (find_availability, subnet_counts):
+            availability = quark.ipam.SUBNET_AVAILABILITY
+            self.assertEqual(availability.available(self.context, 1), [1])
+            availability.allocated(1, 1)
+            self.assertEqual(availability.available(self.context, 1), [1])
+            availability.allocated(1, 1)
+            self.assertEqual(availability.available(self.context, 1), [])
+            self.assertEqual(find_availability.call_count, 1)
+
+            availability.invalidate(1)
+            self.assertEqual(availability.available(self.context, 1), [1])
+            self.assertEqual(find_availability.call_count, 2)
+
+    def test_explicit_address_ignores_summary(self):
+        rows = [self._row(1, 255)]
+        with self._stubs(rows) as (find_availability, subnet_counts):
+            self.ipam.select_subnet(self.context, 1,
+                                    netaddr.IPAddress("0.0.0.1"), None)
+            self.assertFalse(find_availability.called)
+            self.assertTrue(subnet_counts.called)
+
+    def test_disabled_summary_is_not_consulted(self):
+        cfg.CONF.set_override("ipam_availability_cache_ttl", 0, "QUARK")
+        with self._stubs([]) as (find_availability, subnet_counts):
+            self.ipam.select_subnet(self.context, 1, None, None)
+            self.assertFalse(find_availability.called)
+            self.assertTrue(subnet_counts.called)
+
+
 class QuarkIPAddressAllocationNotifications(QuarkIpamBaseTest):
     @contextlib.contextmanager
     def _stubs(self, address, addresses=None, subnets=None, deleted_at=None):
@@ -0,0 +1,83 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo.config import cfg
+
+from quark.drivers import base
+from quark import metrics
+from quark.tests import test_base
+
+
+class TestMetrics(test_base.TestBase):
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        cfg.CONF.set_override("metrics_enabled", True, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "metrics_enabled", "QUARK")
+        patcher = mock.patch("quark.metrics.REGISTRY", metrics.Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_timer(self):
+        with metrics.timer("plugin.create_port"):
+            pass
+        with self.assertRaises(ValueError):
+            with metrics.timer("plugin.create_port"):
+                raise ValueError()
+        counters, timers, gauges = metrics.REGISTRY.snapshot()
+        self.assertEqual(timers["plugin.create_port"][0], 2)
+        self.assertEqual(counters, {"plugin.create_port.errors": 1})
+
+    def test_disabled(self):
+        cfg.CONF.set_override("metrics_enabled", False, "QUARK")
+        with metrics.timer("plugin.create_port"):
+            metrics.incr("ipam.retries")
+        self.assertEqual(metrics.REGISTRY.snapshot(), ({}, {}, {}))
+
+    def test_render(self):
+        metrics.incr("ipam.retries", 2)
+        metrics.REGISTRY.observe("ipam.insert", 0.5)
+        text = metrics.REGISTRY.render("quark")
+        self.assertIn("quark_ipam_retries_total 2\n", text)
+        self.assertIn("quark_ipam_insert_seconds_count 1\n", text)
+        self.assertIn("quark_ipam_insert_seconds_sum 0.500000\n", text)
+
+    def test_statsd_deltas(self):
+        metrics.incr("ipam.retries", 2)
+        self.assertEqual(metrics.REGISTRY.statsd_lines("quark"),
+                         ["quark.ipam.retries:2|c"])
+        metrics.incr("ipam.retries")
+        self.assertEqual(metrics.REGISTRY.statsd_lines("quark"),
+                         ["quark.ipam.retries:1|c"])
+        self.assertEqual(metrics.REGISTRY.statsd_lines("quark"), [])
+
+    def test_push(self):
+        cfg.CONF.set_override("metrics_statsd_host", "127.0.0.1", "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "metrics_statsd_host",
+                        "QUARK")
+        cfg.CONF.set_override("metrics_statsd_interval", 0, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "metrics_statsd_interval",
+                        "QUARK")
+        metrics.incr("ipam.retries")
+        with mock.patch("quark.metrics._send") as send:
+            metrics.maybe_push()
+        send.assert_called_once_with("127.0.0.1", 8125,
+                                     ["quark.ipam.retries:1|c"])
+
+    def test_timed_driver(self):
+        driver = metrics.TimedDriver(base.BaseDriver())
+        driver.create_port(self.context, 1, 2)
+        timers = metrics.REGISTRY.snapshot()[1]
+        self.assertEqual(timers["driver.BASE.create_port"][0], 1)
@@ -15,6 +15,7 @@ from sqlalchemy.sql import column
 from sqlalchemy.sql import select
 from sqlalchemy.sql import table
 
+from quark.db.custom_types import DecimalINET
 from quark.db.custom_types import INET
 import quark.db.migration
 from quark.db.migration.alembic import target_metadata
@@ -634,7 +635,7 @@ class Test28e55acaf366(BaseMigrationTest):
         alembic_command.upgrade(self.config, '3d22de205729')
         self.ip_policy = table('quark_ip_policy',
                                column('id', sa.String(length=36)),
-                               column('size', INET()))
+                               column('size', DecimalINET()))
         self.ip_policy_cidrs = table(
             'quark_ip_policy_cidrs',
             column('id', sa.String(length=36)),
@@ -713,8 +714,8 @@ class Test1664300cb03a(BaseMigrationTest):
             column('id', sa.String(length=36)),
             column('ip_policy_id', sa.String(length=36)),
             column('cidr', sa.String(length=64)),
-            column('first_ip', INET()),
-            column('last_ip', INET()))
+            column('first_ip', DecimalINET()),
+            column('last_ip', DecimalINET()))
 
     def test_upgrade_empty(self):
         alembic_command.upgrade(self.config, '1664300cb03a')
@@ -778,6 +779,313 @@ class Test1664300cb03a(BaseMigrationTest):
             alembic_command.downgrade(self.config, '1acd075bd7e1')
 
 
+class Test707901b8e3dc(BaseMigrationTest):
+    def setUp(self):
+        super(Test707901b8e3dc, self).setUp()
+        alembic_command.upgrade(self.config, '1664300cb03a')
+        self.subnets = table(
+            'quark_subnets',
+            column('id', sa.String(length=36)),
+            column('_cidr', sa.String(length=64)),
+            column('allocated_count', sa.Integer()),
+            column('generated_count', sa.Integer()))
+        self.ip_addresses = table(
+            'quark_ip_addresses',
+            column('id', sa.String(length=36)),
+            column('address_readable', sa.String(length=128)),
+            column('address', DecimalINET()),
+            column('subnet_id', sa.String(length=36)),
+            column('_deallocated', sa.Boolean()))
+        self.mac_ranges = table(
+            'quark_mac_address_ranges',
+            column('id', sa.String(length=36)),
+            column('cidr', sa.String(length=255)),
+            column('first_address', sa.BigInteger()),
+            column('last_address', sa.BigInteger()),
+            column('next_auto_assign_mac', sa.BigInteger()),
+            column('allocated_count', sa.Integer()),
+            column('generated_count', sa.Integer()))
+        self.mac_addresses = table(
+            'quark_mac_addresses',
+            column('address', sa.BigInteger()),
+            column('mac_address_range_id', sa.String(length=36)),
+            column('deallocated', sa.Boolean()))
+
+    def test_upgrade_empty(self):
+        alembic_command.upgrade(self.config, '707901b8e3dc')
+        results = self.connection.execute(
+            select([self.subnets])).fetchall()
+        self.assertEqual(len(results), 0)
+
+    def test_upgrade_subnets(self):
+        self.connection.execute(
+            self.subnets.insert(),
+            dict(id="000", _cidr="192.168.10.0/24"),
+            dict(id="001", _cidr="192.168.11.0/24"))
+        self.connection.execute(
+            self.ip_addresses.insert(),
+            dict(id="1", address_readable="192.168.10.1", address=1,
+                 subnet_id="000", _deallocated=False),
+            dict(id="2", address_readable="192.168.10.2", address=2,
+                 subnet_id="000", _deallocated=True),
+            dict(id="3", address_readable="192.168.10.3", address=3,
+                 subnet_id="000", _deallocated=False))
+        alembic_command.upgrade(self.config, '707901b8e3dc')
+        results = dict(
+            (r["id"], (r["generated_count"], r["allocated_count"]))
+            for r in self.connection.execute(select([self.subnets])))
+        self.assertEqual(results, {"000": (3, 2), "001": (0, 0)})
+
+    def test_upgrade_mac_address_ranges(self):
+        self.connection.execute(
+            self.mac_ranges.insert(),
+            dict(id="000", cidr="AA:BB:CC/24", first_address=0,
+                 last_address=255, next_auto_assign_mac=2))
+        self.connection.execute(
+            self.mac_addresses.insert(),
+            dict(address=0, mac_address_range_id="000", deallocated=True),
+            dict(address=1, mac_address_range_id="000", deallocated=False))
+        alembic_command.upgrade(self.config, '707901b8e3dc')
+        results = self.connection.execute(
+            select([self.mac_ranges])).fetchall()
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["generated_count"], 2)
+        self.assertEqual(results[0]["allocated_count"], 1)
+
+
+class Test33e9e0aa5b3c(BaseMigrationTest):
+    def setUp(self):
+        super(Test33e9e0aa5b3c, self).setUp()
+        alembic_command.upgrade(self.config, '707901b8e3dc')
+        self.ip_addresses = table(
+            'quark_ip_addresses',
+            column('id', sa.String(length=36)),
+            column('address_readable', sa.String(length=128)),
+            column('address', DecimalINET()),
+            column('network_id', sa.String(length=36)),
+            column('subnet_id', sa.String(length=36)),
+            column('version', sa.Integer()),
+            column('deallocated_at', sa.DateTime()),
+            column('_deallocated', sa.Boolean()))
+        self.reuse = table(
+            'quark_ip_address_reuse',
+            column('ip_address_id', sa.String(length=36)),
+            column('network_id', sa.String(length=36)),
+            column('subnet_id', sa.String(length=36)),
+            column('version', sa.Integer()),
+            column('deallocated_at', sa.DateTime()))
+
+    def test_upgrade_empty(self):
+        alembic_command.upgrade(self.config, '33e9e0aa5b3c')
+        results = self.connection.execute(select([self.reuse])).fetchall()
+        self.assertEqual(len(results), 0)
+
+    def test_upgrade_queues_deallocated_ips(self):
+        deallocated_at = datetime.datetime(2014, 8, 1)
+        self.connection.execute(
+            self.ip_addresses.insert(),
+            dict(id="1", address_readable="192.168.10.1", address=1,
+                 network_id="net", subnet_id="000", version=4,
+                 _deallocated=False),
+            dict(id="2", address_readable="192.168.10.2", address=2,
+                 network_id="net", subnet_id="000", version=4,
+                 _deallocated=True, deallocated_at=deallocated_at))
+        alembic_command.upgrade(self.config, '33e9e0aa5b3c')
+        results = self.connection.execute(select([self.reuse])).fetchall()
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["ip_address_id"], "2")
+        self.assertEqual(results[0]["network_id"], "net")
+        self.assertEqual(results[0]["subnet_id"], "000")
+        self.assertEqual(results[0]["version"], 4)
+        self.assertEqual(results[0]["deallocated_at"], deallocated_at)
+
+
+class Test40c3dfb777ed(BaseMigrationTest):
+    def setUp(self):
+        super(Test40c3dfb777ed, self).setUp()
+        alembic_command.upgrade(self.config, '33e9e0aa5b3c')
+
+    def _subnets(self, inet):
+        return table(
+            'quark_subnets',
+            column('id', sa.String(length=36)),
+            column('_cidr', sa.String(length=64)),
+            column('first_ip', inet),
+            column('last_ip', inet),
+            column('next_auto_assign_ip', inet))
+
+    def _ip_addresses(self, inet):
+        return table(
+            'quark_ip_addresses',
+            column('id', sa.String(length=36)),
+            column('address_readable', sa.String(length=128)),
+            column('address', inet),
+            column('subnet_id', sa.String(length=36)))
+
+    def _seed(self):
+        v6 = netaddr.IPNetwork("fd00::/64")
+        self.connection.execute(
+            self._subnets(DecimalINET()).insert(),
+            dict(id="000", _cidr="192.168.10.0/24",
+                 first_ip=0xffffc0a80a00, last_ip=0xffffc0a80aff,
+                 next_auto_assign_ip=0xffffc0a80a0a),
+            dict(id="001", _cidr=str(v6), first_ip=v6.first,
+                 last_ip=v6.last, next_auto_assign_ip=-1))
+        self.connection.execute(
+            self._ip_addresses(DecimalINET()).insert(),
+            dict(id="1", address_readable="192.168.10.9",
+                 address=0xffffc0a80a09, subnet_id="000"),
+            dict(id="2", address_readable="192.168.10.10",
+                 address=0xffffc0a80a0a, subnet_id="000"))
+        return v6
+
+    def test_upgrade_empty(self):
+        alembic_command.upgrade(self.config, '40c3dfb777ed')
+        results = self.connection.execute(
+            select([self._subnets(INET())])).fetchall()
+        self.assertEqual(len(results), 0)
+
+    def test_upgrade_converts_values(self):
+        v6 = self._seed()
+        alembic_command.upgrade(self.config, '40c3dfb777ed')
+        subnets = self._subnets(INET())
+        results = dict(
+            (r["id"], (r["first_ip"], r["last_ip"], r["next_auto_assign_ip"]))
+            for r in self.connection.execute(select([subnets])))
+        self.assertEqual(results, {
+            "000": (0xffffc0a80a00, 0xffffc0a80aff, 0xffffc0a80a0a),
+            "001": (v6.first, v6.last, -1)})
+
+    def test_upgrade_compares_numerically(self):
+        self._seed()
+        alembic_command.upgrade(self.config, '40c3dfb777ed')
+        ip_addresses = self._ip_addresses(INET())
+        results = self.connection.execute(
+            select([ip_addresses.c.id]).where(
+                ip_addresses.c.address >= 0xffffc0a80a0a)).fetchall()
+        self.assertEqual([r["id"] for r in results], ["2"])
+
+    def test_upgrade_keeps_unique_address(self):
+        self._seed()
+        alembic_command.upgrade(self.config, '40c3dfb777ed')
+        with self.assertRaises(sa.exc.IntegrityError):
+            self.connection.execute(
+                self._ip_addresses(INET()).insert(),
+                dict(id="3", address_readable="192.168.10.9",
+                     address=0xffffc0a80a09, subnet_id="000"))
+
+    def test_downgrade(self):
+        self._seed()
+        alembic_command.upgrade(self.config, '40c3dfb777ed')
+        alembic_command.downgrade(self.config, '33e9e0aa5b3c')
+        subnets = self._subnets(DecimalINET())
+        results = self.connection.execute(
+            select([subnets.c.next_auto_assign_ip]).order_by(
+                subnets.c.id)).fetchall()
+        self.assertEqual([r[0] for r in results], [0xffffc0a80a0a, -1])
+
+
+class Testc159ccfdd8f4(BaseMigrationTest):
+    def setUp(self):
+        super(Testc159ccfdd8f4, self).setUp()
+        alembic_command.upgrade(self.config, '40c3dfb777ed')
+        self.ports = table(
+            'quark_ports',
+            column('id', sa.String(length=36)),
+            column('network_id', sa.String(length=36)),
+            column('backend_key', sa.String(length=36)),
+            column('device_id', sa.String(length=255)),
+            column('status', sa.String(length=16)))
+
+    def test_upgrade_existing_ports_active(self):
+        self.connection.execute(
+            self.ports.insert(),
+            dict(id="1", network_id="net", backend_key="1", device_id="1"))
+        alembic_command.upgrade(self.config, 'c159ccfdd8f4')
+        results = self.connection.execute(
+            select([self.ports.c.status])).fetchall()
+        self.assertEqual([r[0] for r in results], ["ACTIVE"])
+
+    def test_downgrade(self):
+        alembic_command.upgrade(self.config, 'c159ccfdd8f4')
+        alembic_command.downgrade(self.config, '40c3dfb777ed')
+        tables = sa.inspect(self.engine).get_table_names()
+        self.assertNotIn('quark_port_jobs', tables)
+
+
+class Test765ddf69357c(BaseMigrationTest):
+    def setUp(self):
+        super(Test765ddf69357c, self).setUp()
+        alembic_command.upgrade(self.config, 'c159ccfdd8f4')
+        self.profiles = table(
+            'quark_nvp_driver_security_profile',
+            column('id', sa.String(length=36)),
+            column('nvp_id', sa.String(length=36)),
+            column('rule_count', sa.Integer()))
+        self.lports = table(
+            'quark_nvp_driver_lswitchport',
+            column('id', sa.String(length=36)),
+            column('port_id', sa.String(length=36)),
+            column('switch_id', sa.String(length=36)),
+            column('rule_count', sa.Integer()))
+
+    def _seed(self):
+        rules = table('quark_security_group_rule',
+                      column('id', sa.String(length=36)),
+                      column('group_id', sa.String(length=36)),
+                      column('direction', sa.String(length=10)),
+                      column('ethertype', sa.String(length=4)))
+        ports = table('quark_ports',
+                      column('id', sa.String(length=36)),
+                      column('network_id', sa.String(length=36)),
+                      column('backend_key', sa.String(length=36)),
+                      column('device_id', sa.String(length=255)))
+        port_groups = table('quark_port_security_group_associations',
+                            column('port_id', sa.String(length=36)),
+                            column('group_id', sa.String(length=36)))
+        self.connection.execute(
+            self.profiles.insert(),
+            dict(id="1", nvp_id="nvp1"), dict(id="2", nvp_id="nvp2"))
+        self.connection.execute(
+            rules.insert(),
+            [dict(id=str(i), group_id=group_id, direction="ingress",
+                  ethertype="IPv4")
+             for i, group_id in enumerate(["1", "1", "2"])])
+        self.connection.execute(
+            ports.insert(),
+            dict(id="1", network_id="net", backend_key="lport1",
+                 device_id="1"),
+            dict(id="2", network_id="net", backend_key="lport2",
+                 device_id="2"))
+        self.connection.execute(
+            port_groups.insert(),
+            dict(port_id="1", group_id="1"), dict(port_id="1", group_id="2"),
+            dict(port_id="2", group_id="2"))
+        self.connection.execute(
+            self.lports.insert(),
+            dict(id="1", port_id="lport1", switch_id="1"),
+            dict(id="2", port_id="lport2", switch_id="1"))
+
+    def test_upgrade_counts_rules(self):
+        self._seed()
+        alembic_command.upgrade(self.config, '765ddf69357c')
+        results = self.connection.execute(
+            select([self.profiles.c.id, self.profiles.c.rule_count]).
+            order_by(self.profiles.c.id)).fetchall()
+        self.assertEqual(results, [("1", 2), ("2", 1)])
+        results = self.connection.execute(
+            select([self.lports.c.id, self.lports.c.rule_count]).
+            order_by(self.lports.c.id)).fetchall()
+        self.assertEqual(results, [("1", 3), ("2", 1)])
+
+    def test_downgrade(self):
+        alembic_command.upgrade(self.config, '765ddf69357c')
+        alembic_command.downgrade(self.config, 'c159ccfdd8f4')
+        tables = sa.inspect(self.engine).get_table_names()
+        self.assertNotIn('quark_nvp_driver_lswitchport_security_profiles',
+                         tables)
+
+
 class ModelsMigrationsSync(BaseMigrationTest,
                            test_migrations.ModelsMigrationsSync):
     def get_engine(self):
@@ -114,6 +114,7 @@ class TestNVPDriver(test_base.TestBase):
                                                 'result_count': 1})
         profile.query = mock.Mock(return_value=query)
         profile.read = mock.Mock(return_value=group)
+        profile.create = mock.Mock(return_value=group)
         return mock.Mock(return_value=profile)
 
     def _create_security_rule(self, rule={}):
@@ -633,6 +634,18 @@ class TestNVPDriverDeletePort(TestNVPDriver):
                 self.assertEqual(ae.args[0], "Exception not raised")
 
 
+class TestNVPDriverDeletePorts(TestNVPDriver):
+    def test_delete_ports(self):
+        cfg.CONF.set_override('port_delete_concurrency', 2, 'NVP')
+        self.addCleanup(cfg.CONF.clear_override, 'port_delete_concurrency',
+                        'NVP')
+        with mock.patch("%s.delete_port" % self.d_pkg) as delete_port:
+            self.driver.delete_ports(self.context, [1, 2, 3])
+            self.assertEqual(sorted(call[0][1]
+                                    for call in delete_port.call_args_list),
+                             [1, 2, 3])
+
+
 class TestNVPDriverDeletePortWithExceptions(TestNVPDriver):
     @contextlib.contextmanager
     def _stubs(self, switch_exception=None, delete_exception=None):
@@ -978,6 +991,99 @@ class TestNVPDriverDeleteSecurityGroupRule(TestNVPDriver):
                     {'ethertype': 'IPv6', 'direction': 'egress'})
 
 
+class TestNVPDriverSecurityProfileCache(TestNVPDriver):
+    @contextlib.contextmanager
+    def _stubs(self):
+        with contextlib.nested(
+                mock.patch("%s.get_connection" % self.d_pkg),
+                mock.patch("%s._lswitches_for_network" % self.d_pkg),
+        ) as (get_connection, get_switches):
+            connection = self._create_connection(has_switches=True)
+            connection.securityprofile = self._create_security_profile()
+            get_connection.return_value = connection
+            get_switches.return_value = connection.lswitch().query()
+            yield connection
+
+    def test_create_port_with_created_group(self):
+        with self._stubs() as connection:
+            self.driver.create_security_group(
+                self.context, 'foo', group_id=1,
+                port_ingress_rules=[{'ethertype': 'IPv4'}])
+            self.driver.create_port(self.context, self.net_id, self.port_id,
+                                    security_groups=[1])
+            self.assertFalse(connection.securityprofile().query.called)
+            connection.lswitch_port().assert_has_calls([
+                mock.call.security_profiles([self.profile_id]),
+            ], any_order=True)
+
+    def test_group_read_once(self):
+        with self._stubs() as connection:
+            for i in xrange(2):
+                self.driver.update_port(self.context, self.port_id,
+                                        security_groups=[1])
+            self.assertEqual(
+                connection.securityprofile().query().results.call_count, 1)
+
+    def test_update_counts_rules(self):
+        with self._stubs() as connection:
+            self.driver.create_security_group(self.context, 'foo',
+                                              group_id=1)
+            self.driver.update_security_group(
+                self.context, 1,
+                port_ingress_rules=[{'ethertype': 'IPv4'}] * 3)
+            with self.assertRaises(sg_ext.qexception.InvalidInput):
+                self.driver.create_port(
+                    self.context, self.net_id, self.port_id,
+                    security_groups=[1])
+            self.assertFalse(connection.lswitch_port().create.called)
+
+    def test_delete_drops_group(self):
+        with self._stubs() as connection:
+            self.driver.create_security_group(self.context, 'foo',
+                                              group_id=1)
+            self.driver.delete_security_group(self.context, 1)
+            connection.securityprofile().query().results.return_value = {
+                'result_count': 0, 'results': []}
+            with self.assertRaises(sg_ext.SecurityGroupNotFound):
+                self.driver.update_port(self.context, self.port_id,
+                                        security_groups=[1])
+
+    def test_expired_reloaded_in_background(self):
+        cfg.CONF.set_override('security_profile_cache_ttl', 10, 'NVP')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'security_profile_cache_ttl', 'NVP')
+        with contextlib.nested(
+                self._stubs(),
+                mock.patch("time.time"),
+                mock.patch("eventlet.spawn_n")) as (connection, now, spawn):
+            now.return_value = 100
+            self.driver.create_security_group(self.context, 'foo',
+                                              group_id=1)
+            now.return_value = 111
+            self.driver.update_port(self.context, self.port_id,
+                                    security_groups=[1])
+            self.assertFalse(connection.securityprofile().query.called)
+            self.assertEqual(spawn.call_count, 1)
+
+            connection.securityprofile().read().update(
+                {'logical_port_egress_rules': [{'ethertype': 'IPv4'}]})
+            spawn.call_args[0][0](*spawn.call_args[0][1:])
+            entry = self.driver.security_profiles.get(self.context, 1)
+            self.assertEqual(entry['egress'], 1)
+            self.assertEqual(entry['expires_at'], 121)
+
+    def test_rule_count_per_port_reads_profile_once(self):
+        with self._stubs() as connection:
+            ports = [{'security_profiles': [self.profile_id, 'other']}] * 3
+            query = connection.lswitch_port().query()
+            query.security_profile_uuid().results.return_value = {
+                'results': ports}
+            self.assertEqual(
+                self.driver._check_rule_count_per_port(self.context, 1), 0)
+            self.assertEqual(connection.securityprofile().read.call_count,
+                             1)
+
+
 class TestNVPDriverLoadConfig(TestNVPDriver):
     def test_load_config(self):
         controllers = "192.168.221.139:443:admin:admin:30:10:2:2"
@@ -1002,29 +1108,32 @@ class TestNVPDriverLoadConfig(TestNVPDriver):
 
 class TestNVPGetConnection(TestNVPDriver):
     @contextlib.contextmanager
-    def _stubs(self, has_conn):
-        controllers = "192.168.221.139:443:admin:admin:30:10:2:2"
-        cfg.CONF.set_override("controller_connection", [controllers], "NVP")
-        if has_conn:
-            self.driver.nvp_connections.append(dict(connection="foo"))
-        else:
-            self.driver.nvp_connections.append(dict(port="443",
-                                                    ip_address="192.168.0.1",
-                                                    username="admin",
-                                                    password="admin",
-                                                    http_timeout=10,
-                                                    retries=1,
-                                                    backoff=0))
+    def _stubs(self):
+        self.driver.nvp_connections.append(dict(port="443",
+                                                ip_address="192.168.0.1",
+                                                username="admin",
+                                                password="admin",
+                                                http_timeout=10,
+                                                retries=1,
+                                                backoff=0))
         with mock.patch("aiclib.nvp.Connection") as (aiclib_conn):
             yield aiclib_conn
-        cfg.CONF.clear_override("controller_connection", "NVP")
 
     def test_get_connection(self):
-        with self._stubs(has_conn=False) as aiclib_conn:
-            self.driver.get_connection()
-            self.assertTrue(aiclib_conn.called)
-
-    def test_get_connection_connection_defined(self):
-        with self._stubs(has_conn=True) as aiclib_conn:
-            self.driver.get_connection()
+        with self._stubs() as aiclib_conn:
+            connection = self.driver.get_connection()
             self.assertFalse(aiclib_conn.called)
+            connection._action(None, "GET", "/ws.v1/lswitch")
+            aiclib_conn.assert_called_once_with("https://192.168.0.1:443",
+                                                username="admin",
+                                                password="admin",
+                                                timeout=10, retries=1,
+                                                backoff=0)
+            aiclib_conn.return_value._action.assert_called_once_with(
+                None, "GET", "/ws.v1/lswitch")
+
+    def test_get_connection_connection_reused(self):
+        with self._stubs() as aiclib_conn:
+            self.driver.get_connection()._action(None, "GET", "/ws.v1/a")
+            self.driver.get_connection()._action(None, "GET", "/ws.v1/b")
+            self.assertEqual(aiclib_conn.call_count, 1)
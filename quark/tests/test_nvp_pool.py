@@ -0,0 +1,158 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import inspect
+
+import aiclib
+import mock
+from oslo.config import cfg
+
+from quark.drivers import nvp_pool
+from quark.tests import test_base
+
+
+class TestControllerPool(test_base.TestBase):
+    def setUp(self):
+        super(TestControllerPool, self).setUp()
+        configs = [dict(ip_address="192.168.0.%d" % i, port="443",
+                        username="admin", password="admin", http_timeout=10,
+                        retries=1, backoff=0) for i in (1, 2)]
+        self.connections = {}
+        patcher = mock.patch("aiclib.nvp.Connection",
+                             side_effect=self._connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = nvp_pool.ControllerPool(configs)
+        self.first, self.second = self.pool.controllers
+
+    def _override(self, name, value):
+        cfg.CONF.set_override(name, value, "NVP")
+        self.addCleanup(cfg.CONF.clear_override, name, "NVP")
+
+    def _connection(self, uri, **kwargs):
+        connection = self.connections.get(uri)
+        if connection is None:
+            connection = self.connections[uri] = mock.Mock()
+            connection._action.return_value = uri
+        return connection
+
+    def _fail(self, controller, code=500):
+        uri = "https://%s" % controller.name
+        self._connection(uri)._action.side_effect = (
+            aiclib.core.AICException(code, "failed"))
+
+    def test_least_outstanding(self):
+        self.first.outstanding = 1
+        self.assertEqual(self.pool.select(), self.second)
+        self.assertEqual(self.pool.select(), self.second)
+
+    def test_round_robin(self):
+        self._override("controller_selection", "round_robin")
+        self.first.outstanding = 1
+        chosen = [self.pool.select() for i in xrange(4)]
+        self.assertEqual(chosen, [self.first, self.second] * 2)
+
+    def test_read_fails_over(self):
+        self._fail(self.first)
+        results = [self.pool.request(None, "GET", "/ws.v1/lswitch")
+                   for i in xrange(2)]
+        self.assertEqual(results, ["https://192.168.0.2:443"] * 2)
+        self.assertEqual(self.first.failures, 2)
+
+    def test_write_does_not_fail_over(self):
+        self._fail(self.first)
+        self.pool._next = 0
+        with self.assertRaises(aiclib.core.AICException):
+            self.pool.request(None, "POST", "/ws.v1/lswitch")
+        self.assertFalse(self._connection(
+            "https://192.168.0.2:443")._action.called)
+
+    def test_client_error_is_not_a_failure(self):
+        self._fail(self.first, code=404)
+        self.pool._next = 0
+        with self.assertRaises(aiclib.core.AICException):
+            self.pool.request(None, "GET", "/ws.v1/lswitch")
+        self.assertEqual(self.first.failures, 0)
+        self.assertEqual(self.first.outstanding, 0)
+
+    def test_broken_controller_left_alone(self):
+        self._override("controller_failure_threshold", 2)
+        self.first.failures = 2
+        self.first.retry_at = 0
+        # NOTE: one request is let through to see if it has recovered
+        self.assertEqual(self.pool.select(), self.first)
+        self.assertEqual(self.pool.select(), self.second)
+        self.assertEqual(self.pool.select(), self.second)
+
+        self.pool.request(None, "GET", "/ws.v1/lswitch")
+        self.first.retry_at = 0
+        self.pool._next = 0
+        self.assertEqual(self.pool.request(None, "GET", "/ws.v1/lswitch"),
+                         "https://192.168.0.1:443")
+        self.assertEqual(self.first.failures, 0)
+
+    def test_connections_kept(self):
+        self._override("connections_per_controller", 1)
+        for i in xrange(3):
+            self.pool.request(None, "GET", "/ws.v1/lswitch")
+        self.assertEqual(len(self.first._idle), 1)
+        self.assertEqual(len(self.second._idle), 1)
+
+    def test_concurrent_requests_own_connections(self):
+        used = []
+
+        def _connect(uri, **kwargs):
+            connection = mock.Mock()
+
+            def _action(entity, method, resource):
+                used.append(connection)
+                if len(used) == 1:
+                    # NOTE: a second request while the first is in flight
+                    self.first.request(None, "GET", "/ws.v1/lswitch")
+            connection._action.side_effect = _action
+            return connection
+
+        self.first._idle.append(_connect(None))
+        with mock.patch("aiclib.nvp.Connection", side_effect=_connect):
+            self.first.request(None, "GET", "/ws.v1/lswitch")
+        self.assertEqual(len(used), 2)
+        self.assertIsNot(used[0], used[1])
+
+    def test_no_controllers(self):
+        pool = nvp_pool.ControllerPool([])
+        with self.assertRaises(aiclib.core.AICException):
+            pool.request(None, "GET", "/ws.v1/lswitch")
+
+
+class TestPooledConnection(test_base.TestBase):
+    def test_action_signature(self):
+        # NOTE: PooledConnection and Controller rely on this private method
+        #       of aiclib's, pinned in requirements.txt
+        args = inspect.getargspec(aiclib.nvp.Connection._action).args
+        self.assertEqual(args, ["self", "entity", "method", "resource"])
+
+    def test_entities_use_pool(self):
+        pool = mock.Mock()
+        connection = nvp_pool.PooledConnection(pool)
+        switch = connection.lswitch()
+        switch.create()
+        pool.request.assert_called_once_with(switch, "POST", mock.ANY)
+
+    def test_queries_use_pool(self):
+        pool = mock.Mock()
+        connection = nvp_pool.PooledConnection(pool)
+        query = connection.lswitch().query()
+        query.results()
+        pool.request.assert_called_once_with(query, "GET", mock.ANY)
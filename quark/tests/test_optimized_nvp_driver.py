@@ -431,6 +431,48 @@ class TestCreateSecurityGroups(TestOptimizedNVPDriver):
             self.driver.create_security_group(self.context, "newgroup")
             self.assertTrue(self.context.session.add.called)
 
+    def test_create_security_group_counts_rules(self):
+        with mock.patch("%s.get_connection" % self.d_pkg):
+            self.driver.create_security_group(
+                self.context, "newgroup",
+                port_ingress_rules=[{'ethertype': 'IPv4'}],
+                port_egress_rules=[{'ethertype': 'IPv4'},
+                                   {'ethertype': 'IPv6'}])
+            profile = self.context.session.add.call_args[0][0]
+            self.assertEqual(profile.rule_count, 3)
+
+
+class TestSecurityProfileRuleCounts(TestOptimizedNVPDriver):
+    @contextlib.contextmanager
+    def _stubs(self, rowcount=1):
+        old_execute = self.context.session.execute
+        self.context.session.execute = mock.Mock()
+        self.context.session.execute.return_value.rowcount = rowcount
+        yield self.context.session.execute
+        self.context.session.execute = old_execute
+
+    def test_updated_recounts_ports(self):
+        with self._stubs() as execute:
+            self.driver._security_profile_updated(
+                self.context, 1,
+                dict(uuid=self.profile_id,
+                     logical_port_ingress_rules=[{'ethertype': 'IPv4'}],
+                     logical_port_egress_rules=[]))
+            self.assertEqual(execute.call_count, 2)
+            profile_update = execute.call_args_list[0][0][0]
+            self.assertEqual(profile_update.table.name,
+                             "quark_nvp_driver_security_profile")
+            self.assertEqual(execute.call_args[0][0].table.name,
+                             "quark_nvp_driver_lswitchport")
+
+    def test_unchanged_leaves_ports_alone(self):
+        with self._stubs(rowcount=0) as execute:
+            self.driver._security_profile_updated(
+                self.context, 1,
+                dict(uuid=self.profile_id, logical_port_ingress_rules=[],
+                     logical_port_egress_rules=[]))
+            self.assertEqual(execute.call_count, 1)
+
 
 class TestDeleteSecurityGroups(TestOptimizedNVPDriver):
     def test_delete_security_group(self):
@@ -467,6 +509,8 @@ class TestSecurityGroupRules(TestOptimizedNVPDriver):
             get_connection.return_value = connection
 
             old_query = self.context.session.query
+            old_execute = self.context.session.execute
+            self.context.session.execute = mock.Mock()
             sec_group = quark.db.models.SecurityGroup()
             for rule in rules:
                 rule_mod = quark.db.models.SecurityGroupRule()
@@ -480,6 +524,7 @@ class TestSecurityGroupRules(TestOptimizedNVPDriver):
 
             yield connection
             self.context.session.query = old_query
+            self.context.session.execute = old_execute
 
     def test_security_rule_create_no_rules(self):
         with self._stubs() as connection:
@@ -504,6 +549,54 @@ class TestSecurityGroupRules(TestOptimizedNVPDriver):
             ], any_order=True)
 
 
+class TestGetSecurityGroup(TestOptimizedNVPDriver):
+    @contextlib.contextmanager
+    def _stubs(self):
+        old_query = self.context.session.query
+        self.context.session.query = mock.Mock()
+        with mock.patch("%s._query_security_group" % self.d_pkg) as profile:
+            profile.return_value = mock.Mock(nvp_id=self.profile_id)
+            yield self.context.session.query
+        self.context.session.query = old_query
+
+    def _group(self):
+        group = quark.db.models.SecurityGroup(id=1)
+        rule = quark.db.models.SecurityGroupRule()
+        rule.update(dict(direction="egress", ethertype="IPv4"))
+        group.rules.append(rule)
+        return group
+
+    def test_loaded_group_is_not_read_again(self):
+        with self._stubs() as query:
+            profile = self.driver._get_security_group(self.context, 1,
+                                                      group=self._group())
+            self.assertFalse(query.called)
+            self.assertEqual(profile['uuid'], self.profile_id)
+            self.assertEqual(profile['logical_port_egress_rules'],
+                             [{'ethertype': 'IPv4'}])
+
+    def test_create_port_passes_loaded_groups(self):
+        group = self._group()
+        with contextlib.nested(
+                self._stubs(),
+                mock.patch("%s.get_connection" % self.d_pkg),
+                mock.patch("%s._lswitch_select_open" % self.d_pkg),
+                mock.patch("%s._lswitch_select_by_nvp_id" % self.d_pkg),
+                mock.patch("%s._lport_set_profiles" % self.d_pkg),
+        ) as (query, get_connection, select_open, select_by_id,
+              set_profiles):
+            get_connection.return_value = self._create_connection()
+            select_open.return_value = self.lswitch_uuid
+            select_by_id.return_value = self._create_lswitch_mock()
+            self.driver.create_port(self.context, self.net_id, self.port_id,
+                                    security_groups=[1],
+                                    security_group_models=[group])
+            self.assertFalse(query.called)
+            self.assertEqual(
+                self.driver.security_profiles.get(self.context, 1)['egress'],
+                1)
+
+
 class TestCreateLswitchOptimized(TestOptimizedNVPDriver):
     def test_create_lswitch_optimized(self):
         self.driver._lswitch_create_optimized(self.context, "public", 1, 1)
@@ -590,3 +683,15 @@ class TestQueryMethods(TestOptimizedNVPDriver):
         with self._stubs() as query_return:
             self.driver._query_security_group(self.context, 1)
             self.assertTrue(query_return.filter.called)
+
+    def test_check_rule_count_per_port(self):
+        with self._stubs() as query_return:
+            query_return.join().filter().scalar.return_value = 4
+            self.assertEqual(
+                self.driver._check_rule_count_per_port(self.context, 1), 4)
+
+    def test_check_rule_count_per_port_no_ports(self):
+        with self._stubs() as query_return:
+            query_return.join().filter().scalar.return_value = None
+            self.assertEqual(
+                self.driver._check_rule_count_per_port(self.context, 1), 0)
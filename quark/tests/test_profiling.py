@@ -0,0 +1,82 @@
+# Copyright 2014 Openstack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import pstats
+import shutil
+import tempfile
+
+import mock
+from oslo.config import cfg
+
+from quark import profiling
+from quark.tests import test_base
+
+
+class TestProfiling(test_base.TestBase):
+    def setUp(self):
+        super(TestProfiling, self).setUp()
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        self._override("profile_dir", self.profile_dir)
+        self.context.request_id = "req-1"
+
+    def _override(self, name, value):
+        cfg.CONF.set_override(name, value, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, name, "QUARK")
+
+    def _profiles(self, name="create_port"):
+        directory = os.path.join(self.profile_dir, name)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(os.listdir(directory))
+
+    def _call(self):
+        with profiling.profile("create_port", self.context):
+            with profiling.profile("create_port_bulk", self.context):
+                sum(range(1000))
+
+    def test_not_wanted(self):
+        self._call()
+        self.assertEqual(self._profiles(), [])
+
+    def test_requested(self):
+        with profiling.requested():
+            self._call()
+        profiles = self._profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].endswith("-req-1.prof"))
+        self.assertEqual(self._profiles("create_port_bulk"), [])
+
+        stats = pstats.Stats(os.path.join(self.profile_dir, "create_port",
+                                          profiles[0]))
+        stacks = profiling.collapse_pstats(stats)
+        self.assertTrue([stack for stack in stacks
+                         if stack.endswith("<sum>")])
+
+    def test_sampled(self):
+        self._override("profile_sample_rate", 1)
+        self._call()
+        self.assertEqual(len(self._profiles()), 1)
+
+    def test_rotated(self):
+        self._override("profile_sample_rate", 1)
+        self._override("profile_keep", 2)
+        with mock.patch("time.time") as now:
+            for i in xrange(3):
+                now.return_value = 1000 + i
+                self._call()
+        self.assertEqual(self._profiles(), ["1001000-req-1.prof",
+                                            "1002000-req-1.prof"])